@@ -0,0 +1,98 @@
+import asyncio
+import logging
+from os import getenv
+from typing import List, Optional
+
+import jinja2
+from models import chat_completions
+from models.chunking import MarkdownChunker
+from models.tools import context_limit, estimate_tokens
+
+DISTILL_MODES = ("auto", "single", "chunked")
+SYSTEM_PROMPT = "You are a Master Educator and Technical Author. Your task is to take a dense, raw academic paper and transform it into a lucid, self-contained technical monograph."
+# Characters of the paper's beginning given to every section for orientation
+OPENING_CHARS = 2000
+# Tokens kept free in the context window for a single pass's or the merge pass's response
+RESPONSE_RESERVE_TOKENS = 16000
+
+
+class PaperDistiller:
+    """
+    Distills a raw paper into a monograph with the unredactor prompt.
+
+    Papers whose prompt fits in the model's context window, less
+    RESPONSE_RESERVE_TOKENS for the response, take a single call. Longer ones
+    are distilled map-reduce: the markdown is split at section headings into
+    parts of at most `section_tokens` (env DISTILL_SECTION_TOKENS, default
+    8000), the parts are distilled into notes concurrently (the model
+    semaphore bounds how many calls run at once), and a final pass writes the
+    monograph from the notes. Notes too long for one merge prompt are
+    condensed again the same way first. `mode` (env DISTILL_MODE: "auto",
+    "single" or "chunked") forces either path.
+    """
+
+    def __init__(
+        self,
+        model: str,
+        templates: jinja2.Environment,
+        mode: Optional[str] = None,
+        section_tokens: Optional[int] = None,
+    ):
+        if mode is None:
+            mode = getenv("DISTILL_MODE", "auto")
+        if section_tokens is None:
+            section_tokens = int(getenv("DISTILL_SECTION_TOKENS", "8000"))
+        if mode not in DISTILL_MODES:
+            raise ValueError(f"Unknown distillation mode '{mode}', expected one of {DISTILL_MODES}")
+        self.model = model
+        self.mode = mode
+        self.section_tokens = section_tokens
+        self.final_template = templates.get_template("unredactor.j2")
+        self.section_template = templates.get_template("distill_section.j2")
+        # estimate_tokens counts ~4 characters per token
+        self.chunker = MarkdownChunker(section_tokens * 4, 0)
+
+    def _merge_budget(self) -> int:
+        """Tokens of notes that fit in one merge prompt."""
+        return max(self.section_tokens, context_limit(self.model) - RESPONSE_RESERVE_TOKENS)
+
+    def _fits_single_pass(self, user_prompt: str) -> bool:
+        """Whether a prompt leaves RESPONSE_RESERVE_TOKENS of the model's context window for the response."""
+        prompt_tokens = estimate_tokens(SYSTEM_PROMPT) + estimate_tokens(user_prompt)
+        return prompt_tokens <= context_limit(self.model) - RESPONSE_RESERVE_TOKENS
+
+    async def distill(self, paper: str) -> str:
+        if self.mode != "chunked":
+            user_prompt = self.final_template.render(paper=paper)
+            if self.mode == "single" or self._fits_single_pass(user_prompt):
+                return await self._complete(user_prompt)
+
+        opening = paper[:OPENING_CHARS]
+        notes = await self._distill_sections(paper, opening)
+        # Condense until the notes fit in one merge prompt
+        while estimate_tokens(notes) > self._merge_budget():
+            logging.info(f"Section notes are ~{estimate_tokens(notes)} tokens; condensing them again.")
+            condensed = await self._distill_sections(notes, opening)
+            if len(condensed) >= len(notes):
+                logging.warning("Condensing section notes did not shorten them; merging them as they are.")
+                break
+            notes = condensed
+        return await self._complete(self.final_template.render(paper=notes))
+
+    async def _distill_sections(self, text: str, opening: str) -> str:
+        sections = await self.sections(text)
+        logging.info(f"Distilling {len(sections)} sections of ~{estimate_tokens(text)} tokens concurrently.")
+        notes = await asyncio.gather(*(
+            self._complete(self.section_template.render(
+                section=section, index=i + 1, count=len(sections), opening=opening,
+            ))
+            for i, section in enumerate(sections)
+        ))
+        return "\n\n".join(note for note in notes if note.strip() and note.strip() != "NOTHING")
+
+    async def sections(self, text: str) -> List[str]:
+        """Splits `text` into sections on the chunker's thread pool, off the event loop."""
+        return [section async for batch in self.chunker.stream(text) for section in batch]
+
+    async def _complete(self, user_prompt: str) -> str:
+        return await chat_completions(model=self.model, system_prompt=SYSTEM_PROMPT, user_prompt=user_prompt)
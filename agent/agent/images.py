@@ -0,0 +1,157 @@
+import asyncio
+import hashlib
+import json
+import logging
+import mimetypes
+import os
+import pathlib
+import re
+from collections import OrderedDict
+from os import getenv
+from typing import Dict, List, Optional, Tuple, Union
+
+try:
+    from PIL import Image
+except ImportError:  # Resized variants are optional; originals are served without Pillow
+    Image = None
+
+MANIFEST_NAME = "manifest.json"
+VARIANTS_DIR = "variants"
+PAPER_HASH_PATTERN = re.compile(r"[0-9a-f]{16,128}")
+IMAGE_NAME_PATTERN = re.compile(r"\w[\w.\-]*")
+
+
+def variant_widths() -> List[int]:
+    """Widths of the resized variants, from the IMAGE_VARIANT_WIDTHS env var (default "480,960")."""
+    value = getenv("IMAGE_VARIANT_WIDTHS", "480,960")
+    return sorted(int(width) for width in value.split(",") if width.strip())
+
+
+def build_image_manifest(images_dir: pathlib.Path, widths: Optional[List[int]] = None) -> Dict[str, dict]:
+    """
+    Hashes every image in `images_dir`, writes resized variants narrower than
+    the original for each of `widths` (when Pillow is installed) and records
+    them in a manifest, so serving an image needs no hashing or resizing.
+    Blocking; run it on a thread.
+    """
+    if widths is None:
+        widths = variant_widths()
+    manifest: Dict[str, dict] = {}
+    for path in sorted(images_dir.iterdir()):
+        if not path.is_file() or not IMAGE_NAME_PATTERN.fullmatch(path.name) or path.name == MANIFEST_NAME:
+            continue
+        data = path.read_bytes()
+        entry = {"etag": hashlib.sha256(data).hexdigest()[:32], "size": len(data), "variants": {}}
+        if Image is not None and widths:
+            try:
+                entry["variants"] = _write_variants(path, widths)
+            except Exception as e:
+                logging.warning(f"Could not resize image {path}: {e}")
+        manifest[path.name] = entry
+
+    tmp_path = images_dir / (MANIFEST_NAME + ".tmp")
+    tmp_path.write_text(json.dumps(manifest))
+    os.replace(tmp_path, images_dir / MANIFEST_NAME)
+    return manifest
+
+
+def _write_variants(path: pathlib.Path, widths: List[int]) -> Dict[str, dict]:
+    variants = {}
+    with Image.open(path) as image:
+        original_format = image.format
+        for width in widths:
+            if width >= image.width:
+                break
+            height = max(1, round(image.height * width / image.width))
+            resized = image.resize((width, height), Image.LANCZOS)
+            if original_format == "JPEG" and resized.mode not in ("RGB", "L"):
+                resized = resized.convert("RGB")
+            variant_path = path.parent / VARIANTS_DIR / str(width) / path.name
+            variant_path.parent.mkdir(parents=True, exist_ok=True)
+            resized.save(variant_path, format=original_format)
+            data = variant_path.read_bytes()
+            variants[str(width)] = {"etag": hashlib.sha256(data).hexdigest()[:32], "size": len(data)}
+    return variants
+
+
+class ImageStore:
+    """
+    Looks up paper images for serving. Images live under the content-addressed
+    paper directory and never change, so each one's path, strong ETag and
+    stat result are resolved once from the paper's manifest (built on first
+    use for papers cached before manifests existed) and kept in memory. At
+    most `max_papers` manifests (env IMAGE_STORE_MAX_PAPERS, default 256) are
+    kept, least recently used first out. Names are validated as plain file
+    names, so requests can't escape the papers directory.
+    """
+
+    def __init__(self, papers_dir: Union[str, pathlib.Path], max_papers: Optional[int] = None):
+        if max_papers is None:
+            max_papers = int(getenv("IMAGE_STORE_MAX_PAPERS", "256"))
+        self.papers_dir = pathlib.Path(papers_dir)
+        self.max_papers = max_papers
+        # Paper hash -> image name -> manifest entry, least recently used first
+        self._manifests: "OrderedDict[str, Dict[str, dict]]" = OrderedDict()
+        # (paper hash, image name, width) -> (path, stat result)
+        self._files: Dict[Tuple[str, str, int], Tuple[pathlib.Path, os.stat_result]] = {}
+
+    def _read_manifest(self, paper_hash: str) -> Optional[Dict[str, dict]]:
+        images_dir = self.papers_dir / paper_hash / "images"
+        try:
+            return json.loads((images_dir / MANIFEST_NAME).read_text())
+        except FileNotFoundError:
+            if not images_dir.is_dir():
+                return None
+            logging.info(f"Building the image manifest of paper {paper_hash}")
+            return build_image_manifest(images_dir)
+
+    async def _manifest(self, paper_hash: str) -> Optional[Dict[str, dict]]:
+        manifest = self._manifests.get(paper_hash)
+        if manifest is not None:
+            self._manifests.move_to_end(paper_hash)
+            return manifest
+        manifest = await asyncio.to_thread(self._read_manifest, paper_hash)
+        if manifest is None:
+            return None
+        self._manifests[paper_hash] = manifest
+        while len(self._manifests) > self.max_papers:
+            evicted, _ = self._manifests.popitem(last=False)
+            self._files = {key: value for key, value in self._files.items() if key[0] != evicted}
+        return manifest
+
+    async def lookup(
+        self, paper_hash: str, image_name: str, width: Optional[int] = None
+    ) -> Optional[Tuple[pathlib.Path, os.stat_result, str]]:
+        """
+        The file to serve for an image, its stat result and its ETag, or None
+        if there is no such image. With `width`, the smallest variant at least
+        that wide is chosen, or the original if there is none.
+        """
+        if not PAPER_HASH_PATTERN.fullmatch(paper_hash) or not IMAGE_NAME_PATTERN.fullmatch(image_name):
+            return None
+        manifest = await self._manifest(paper_hash)
+        if manifest is None or image_name not in manifest:
+            return None
+        entry = manifest[image_name]
+
+        chosen = 0
+        if width:
+            fitting = [int(w) for w in entry["variants"] if int(w) >= width]
+            chosen = min(fitting, default=0)
+        etag = entry["variants"][str(chosen)]["etag"] if chosen else entry["etag"]
+
+        key = (paper_hash, image_name, chosen)
+        cached = self._files.get(key)
+        if cached is None:
+            images_dir = self.papers_dir / paper_hash / "images"
+            path = images_dir / VARIANTS_DIR / str(chosen) / image_name if chosen else images_dir / image_name
+            try:
+                cached = (path, path.stat())
+            except FileNotFoundError:
+                return None
+            self._files[key] = cached
+        return cached[0], cached[1], f'"{etag}"'
+
+    @staticmethod
+    def media_type(image_name: str) -> str:
+        return mimetypes.guess_type(image_name)[0] or "application/octet-stream"
@@ -0,0 +1,181 @@
+import asyncio
+import json
+import logging
+import os
+import pathlib
+import time
+import uuid
+from os import getenv
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional, Union
+
+# A job runner gets the job and a callback reporting the stage it has reached, and returns the result event
+JobRunner = Callable[[Dict[str, object], Callable[[str], None]], Awaitable[Dict[str, object]]]
+
+FINISHED = ("done", "failed")
+
+
+class LoadJobQueue:
+    """
+    Persistent queue of /load jobs run in the background by a fixed pool of
+    `workers` (env LOAD_JOB_WORKERS, default 2), so at most that many papers are
+    processed at once and the HTTP request returns immediately.
+
+    Each job is a JSON file in `directory` recording its status (queued,
+    running, done, failed), the stage it is in and when each stage started.
+    Jobs that were queued or running when the process stopped are queued again
+    on `start`; they resume cheaply because finished stages are cached (URL
+    cache, paper cache, shared RAG segments). Finished jobs are kept for
+    `retention` seconds (env LOAD_JOB_RETENTION_SECONDS, default 86400), and
+    pruned on `start` and whenever a job finishes.
+    """
+
+    def __init__(
+        self,
+        directory: Union[str, pathlib.Path],
+        runner: JobRunner,
+        workers: Optional[int] = None,
+        retention: Optional[float] = None,
+    ):
+        if workers is None:
+            workers = int(getenv("LOAD_JOB_WORKERS", "2"))
+        if retention is None:
+            retention = float(getenv("LOAD_JOB_RETENTION_SECONDS", "86400"))
+        self.directory = pathlib.Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.runner = runner
+        self.workers = workers
+        self.retention = retention
+        self.jobs: Dict[str, Dict[str, object]] = {}
+        self._queue: "asyncio.Queue[str]" = asyncio.Queue()
+        self._worker_tasks: List[asyncio.Task] = []
+        # Set and replaced whenever a job changes, to wake followers
+        self._changed: Dict[str, asyncio.Event] = {}
+
+    async def start(self):
+        """Loads persisted jobs, re-queues unfinished ones and starts the workers."""
+        for path in sorted(self.directory.glob("*.json"), key=lambda p: p.stat().st_mtime):
+            try:
+                job = json.loads(path.read_text())
+            except (OSError, ValueError) as e:
+                logging.error(f"Ignoring unreadable job file {path}: {e}")
+                continue
+            if job["status"] in FINISHED:
+                self.jobs[job["id"]] = job
+                continue
+            job["status"] = "queued"
+            job["resumed"] = int(job.get("resumed", 0)) + 1
+            self.jobs[job["id"]] = job
+            self._save(job)
+            self._queue.put_nowait(job["id"])
+            logging.info(f"Resuming load job {job['id']} for {job['url']} (was at stage {job['stage']})")
+        self._prune()
+
+        self._worker_tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+
+    async def stop(self):
+        """Stops the workers. Running jobs stay marked as running on disk and resume on the next start."""
+        for task in self._worker_tasks:
+            task.cancel()
+        await asyncio.gather(*self._worker_tasks, return_exceptions=True)
+        self._worker_tasks = []
+
+    def submit(self, chat_uuid: str, url: str, user_input: str) -> Dict[str, object]:
+        now = time.time()
+        job = {
+            "id": uuid.uuid4().hex,
+            "chat_uuid": chat_uuid,
+            "url": url,
+            "user_input": user_input,
+            "status": "queued",
+            "stage": "queued",
+            "stages": {},
+            "created_at": now,
+            "updated_at": now,
+            "resumed": 0,
+            "result": None,
+        }
+        self.jobs[job["id"]] = job
+        self._save(job)
+        self._queue.put_nowait(job["id"])
+        logging.info(f"Queued load job {job['id']} for {url} ({self._queue.qsize()} waiting)")
+        return job
+
+    def get(self, job_id: str) -> Optional[Dict[str, object]]:
+        return self.jobs.get(job_id)
+
+    def for_chat(self, chat_uuid: str) -> List[Dict[str, object]]:
+        return [job for job in self.jobs.values() if job["chat_uuid"] == chat_uuid]
+
+    async def follow(self, job_id: str) -> AsyncIterator[Dict[str, object]]:
+        """Yields the job now and after every change, until it is finished."""
+        while True:
+            job = self.jobs.get(job_id)
+            if job is None:
+                return
+            if job["status"] in FINISHED:
+                yield job
+                return
+            changed = self._changed.setdefault(job_id, asyncio.Event())
+            yield job
+            await changed.wait()
+
+    async def _work(self):
+        while True:
+            job_id = await self._queue.get()
+            job = self.jobs[job_id]
+            try:
+                self._update(job, status="running")
+                result = await self.runner(job, lambda stage: self._enter_stage(job, stage))
+                failed = result.get("type") == "error"
+                self._enter_stage(job, "finished")
+                self._update(job, status="failed" if failed else "done", result=result)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.error(f"Load job {job_id} failed: {e}", exc_info=True)
+                self._update(job, status="failed", result={"type": "error", "status": "failure", "content": str(e)})
+            finally:
+                self._queue.task_done()
+            self._prune()
+
+    def _prune(self):
+        """Forgets finished jobs older than the retention period and deletes their files."""
+        cutoff = time.time() - self.retention
+        expired = [
+            job_id for job_id, job in self.jobs.items()
+            if job["status"] in FINISHED and float(job["updated_at"]) < cutoff
+        ]
+        for job_id in expired:
+            del self.jobs[job_id]
+            self._changed.pop(job_id, None)
+            (self.directory / f"{job_id}.json").unlink(missing_ok=True)
+        if expired:
+            logging.info(f"Pruned {len(expired)} finished load jobs")
+
+    def _enter_stage(self, job: Dict[str, object], stage: str):
+        now = time.time()
+        previous = job["stages"].get(job["stage"])
+        if previous is not None and "finished_at" not in previous:
+            previous["finished_at"] = now
+        job["stages"][stage] = {"started_at": now}
+        self._update(job, stage=stage)
+
+    def _update(self, job: Dict[str, object], **fields):
+        job.update(fields)
+        job["updated_at"] = time.time()
+        self._save(job)
+        changed = self._changed.pop(job["id"], None)
+        if changed is not None:
+            changed.set()
+
+    def _save(self, job: Dict[str, object]):
+        path = self.directory / f"{job['id']}.json"
+        tmp_path = path.with_name(path.name + ".tmp")
+        tmp_path.write_text(json.dumps(job))
+        os.replace(tmp_path, path)
+
+    def stats(self) -> Dict[str, object]:
+        counts: Dict[str, int] = {}
+        for job in self.jobs.values():
+            counts[str(job["status"])] = counts.get(str(job["status"]), 0) + 1
+        return {"workers": self.workers, "waiting": self._queue.qsize(), "jobs": counts}
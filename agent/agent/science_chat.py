@@ -1,27 +1,58 @@
 import asyncio
+import fcntl
 import hashlib
 import logging
+import os
 import pathlib
 import re
 import shutil
 import uuid
+from typing import AsyncIterator, Callable, Dict, Optional, Tuple
 
 import aiofiles
 import aiohttp
 import jinja2
 from models.chat import ChatClient
 from models.datalab import process_pdf_with_datalab
-from models import chat_completions
+from models import configure_embedding_store
+from models.segments import document_key
+from models.session_store import configure_session_store
+
+from agent.distillation import PaperDistiller
+from agent.images import ImageStore, build_image_manifest
+from agent.jobs import LoadJobQueue
+from agent.url_cache import PaperUrlCache
 
 # Setup basic logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
+# Size of the pieces a PDF is streamed to disk in
+DOWNLOAD_CHUNK_BYTES = 64 * 1024
+# Markdown images like ![...](images/figure1.png), capturing the alt text and the image name "figure1.png"
+# Stands for the image API's base URL in cached markdown, so the cache doesn't depend on where it is served
+IMAGE_URL_PLACEHOLDER = "{{IMAGE_BASE_URL}}"
+# Links that are already templated are left alone, so templating is idempotent
+IMAGE_LINK_PATTERN = re.compile(r"!\[(.*?)\]\((?!" + re.escape(IMAGE_URL_PLACEHOLDER) + r")(?:images/)?(.*?)\)")
+# Marks a cached paper whose markdown has templated image links
+TEMPLATED_MARKER = ".templated"
+
 
 class ScienceChatOrchestrator:
     """
     Orchestrates the lifecycle of a scientific chat session. Handles commands,
     document processing (download, parsing, distillation), and regular chat.
     Implements a file-based cache to avoid reprocessing PDFs.
+
+    Each paper is processed once even when several sessions load it at the same
+    time: loaders in this process share one job per paper hash, cancelled once
+    no loader waits for it any more, and jobs in different processes are
+    serialized by a lock file, removed once the paper is cached. A paper is
+    built in a `.<hash>.partial` staging directory that is renamed into place
+    only when complete, so a crash never leaves a half-written cache entry
+    behind.
+
+    After `start_jobs`, /load commands are queued as background jobs (see
+    LoadJobQueue) and answered with a job ID instead of waiting for the paper.
     """
 
     def __init__(self, chat_client: ChatClient, model_name: str = "grok-3-mini-high", api_base_url: str = "http://localhost:8000"):
@@ -29,6 +60,7 @@ class ScienceChatOrchestrator:
         self.model = model_name
         self.distillation_model = "grok-3-mini-high"
         self.api_base_url = api_base_url
+        self.image_base_url = f"{api_base_url}/v1/images"
 
         self.cache_dir = pathlib.Path("agent_cache")
         self.temp_dir = self.cache_dir / "temp"
@@ -36,132 +68,399 @@ class ScienceChatOrchestrator:
         self.temp_dir.mkdir(parents=True, exist_ok=True)
         self.papers_dir.mkdir(parents=True, exist_ok=True)
 
-        self._load_unredactor_prompt()
+        # Reuse embeddings of identical chunks across sessions and restarts
+        configure_embedding_store(self.cache_dir / "embeddings")
+        # Persist session RAG indexes so they survive restarts
+        configure_session_store(self.cache_dir / "sessions")
+        # Known paper URLs, so reloading one doesn't download the PDF again
+        self.url_cache = PaperUrlCache(self.cache_dir / "url_index.json")
+        # Served paper images, with their ETags and stat results kept in memory
+        self.image_store = ImageStore(self.papers_dir)
+        # Cached papers known to have templated markdown, so loading them skips the marker check
+        self._templated_papers: set = set()
+        # In-flight processing jobs by paper hash, with the number of loaders waiting on each
+        self._paper_jobs: Dict[str, asyncio.Future] = {}
+        self._paper_job_waiters: Dict[asyncio.Future, int] = {}
+        # Background /load jobs, once start_jobs has been called
+        self.load_jobs: Optional[LoadJobQueue] = None
 
-    def _load_unredactor_prompt(self):
-        """Loads the distillation prompt template from the file."""
+        self._load_prompts()
+
+    def _load_prompts(self):
+        """Loads the distillation prompt templates from the prompts directory."""
         template_dir = pathlib.Path(__file__).parent / "prompts"
         env = jinja2.Environment(loader=jinja2.FileSystemLoader(template_dir))
-        self.unredactor_template = env.get_template("unredactor.j2")
+        self.distiller = PaperDistiller(self.distillation_model, env)
 
-    async def _download_pdf(self, url: str) -> pathlib.Path:
-        """Downloads a PDF from a URL to a temporary directory."""
+    async def _download_pdf(
+        self, url: str, headers: Optional[Dict[str, str]] = None
+    ) -> Optional[Tuple[pathlib.Path, str, Dict[str, Optional[str]]]]:
+        """
+        Streams a PDF from a URL to a temporary file, hashing it in the same pass.
+        Returns the file path, its SHA256 hash and the response's ETag and
+        Last-Modified validators; memory use does not depend on the PDF size.
+        Returns None if a conditional request (`headers`) was answered with 304 Not Modified.
+        """
         temp_pdf_path = self.temp_dir / f"{uuid.uuid4()}.pdf"
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url) as response:
-                response.raise_for_status()
-                async with aiofiles.open(temp_pdf_path, 'wb') as f:
-                    await f.write(await response.read())
-        return temp_pdf_path
-
-    async def _get_file_hash(self, file_path: pathlib.Path) -> str:
-        """Computes the SHA256 hash of a file."""
         sha256 = hashlib.sha256()
-        async with aiofiles.open(file_path, 'rb') as f:
-            while chunk := await f.read(8192):
-                sha256.update(chunk)
-        return sha256.hexdigest()
-
-    def _filter_markdown_images(self, markdown_text: str, chat_uuid: str, paper_hash: str) -> str:
-        """Replaces local image paths in markdown with full API URLs."""
-        # This regex finds markdown images like ![...](images/figure1.png)
-        # and captures the image name "figure1.png"
-        pattern = r"!\[(.*?)\]\((?:images/)?(.*?)\)"
-        
-        def replace_func(match):
-            image_name = match.group(2)
-            new_url = f"{self.api_base_url}/v1/images/{chat_uuid}/{paper_hash}/{image_name}"
-            return f"![{match.group(1)}]({new_url})"
-
-        return re.sub(pattern, replace_func, markdown_text)
+        try:
+            async with aiohttp.ClientSession() as session:
+                async with session.get(url, headers=headers) as response:
+                    if response.status == 304 and headers:
+                        return None
+                    response.raise_for_status()
+                    validators = {
+                        "etag": response.headers.get("ETag"),
+                        "last_modified": response.headers.get("Last-Modified"),
+                    }
+                    async with aiofiles.open(temp_pdf_path, 'wb') as f:
+                        async for chunk in response.content.iter_chunked(DOWNLOAD_CHUNK_BYTES):
+                            sha256.update(chunk)
+                            await f.write(chunk)
+        except BaseException:
+            temp_pdf_path.unlink(missing_ok=True)
+            raise
+        return temp_pdf_path, sha256.hexdigest(), validators
 
-    async def _distill_text(self, paper_content: str) -> str:
-        """Generates a distilled version of the paper using an LLM."""
-        user_prompt = self.unredactor_template.render(paper=paper_content)
-        system_prompt = "You are a Master Educator and Technical Author. Your task is to take a dense, raw academic paper and transform it into a lucid, self-contained technical monograph."
-        
-        distilled_content = await chat_completions(
-            model=self.distillation_model,
-            system_prompt=system_prompt,
-            user_prompt=user_prompt,
+    def _is_paper_cached(self, paper_hash: str) -> bool:
+        paper_cache_dir = self.papers_dir / paper_hash
+        return (paper_cache_dir / "raw.md").exists() and (paper_cache_dir / "distilled.md").exists()
+
+    async def _fetch_paper(self, url: str) -> Tuple[str, Optional[pathlib.Path]]:
+        """
+        Resolves a URL to a paper hash. A URL whose paper is already cached is
+        not downloaded: it is used as is while fresh, and revalidated with a
+        conditional GET once stale. Returns the hash and the downloaded PDF, or
+        None if nothing was downloaded.
+        """
+        entry = self.url_cache.get(url)
+        headers: Dict[str, str] = {}
+        if entry is not None and self._is_paper_cached(str(entry["hash"])):
+            if self.url_cache.is_fresh(entry):
+                self.url_cache.hit(url)
+                logging.info(f"URL cache hit for {url}: paper {entry['hash']}")
+                return str(entry["hash"]), None
+            headers = self.url_cache.conditional_headers(entry)
+
+        try:
+            download = await self._download_pdf(url, headers)
+        except aiohttp.ClientResponseError:
+            if headers:
+                # The URL no longer serves the cached paper; don't revalidate it again
+                logging.info(f"Revalidating {url} failed; dropping it from the URL cache")
+                self.url_cache.discard(url)
+            raise
+        if download is None:
+            self.url_cache.touch(url)
+            logging.info(f"URL cache revalidated {url}: paper {entry['hash']} not modified")
+            return str(entry["hash"]), None
+
+        temp_pdf_path, paper_hash, validators = download
+        self.url_cache.put(url, paper_hash, validators["etag"], validators["last_modified"])
+        return paper_hash, temp_pdf_path
+
+    @staticmethod
+    def _template_markdown_images(markdown_text: str, paper_hash: str) -> str:
+        """Points local image paths in markdown at the image API, with its base URL left as a placeholder."""
+        return IMAGE_LINK_PATTERN.sub(
+            lambda match: f"![{match.group(1)}]({IMAGE_URL_PLACEHOLDER}/{paper_hash}/{match.group(2)})",
+            markdown_text,
         )
-        return distilled_content
 
-    async def _handle_load_command(self, chat_uuid: str, url: str, user_input: str) -> dict:
-        """Orchestrates the full PDF processing pipeline, using a cache."""
+    def _render_markdown(self, markdown_text: str) -> str:
+        """Fills in the image API's base URL. Image URLs don't depend on the session, so neither does the result."""
+        return markdown_text.replace(IMAGE_URL_PLACEHOLDER, self.image_base_url)
+
+    def _migrate_paper_markdown(self, paper_hash: str):
+        """Templates the image links of a paper cached before they were templated at cache time, once. Blocking."""
+        paper_cache_dir = self.papers_dir / paper_hash
+        if (paper_cache_dir / TEMPLATED_MARKER).exists():
+            return
+        logging.info(f"Templating image links of cached paper {paper_hash}")
+        for name in ("raw.md", "distilled.md"):
+            path = paper_cache_dir / name
+            tmp_path = path.with_name(f".{name}.tmp")
+            tmp_path.write_text(self._template_markdown_images(path.read_text(encoding='utf-8'), paper_hash), encoding='utf-8')
+            tmp_path.replace(path)
+        (paper_cache_dir / TEMPLATED_MARKER).touch()
+
+    async def _read_cached_markdown(self, paper_hash: str, name: str) -> str:
+        if paper_hash not in self._templated_papers:
+            await asyncio.to_thread(self._migrate_paper_markdown, paper_hash)
+            self._templated_papers.add(paper_hash)
+        async with aiofiles.open(self.papers_dir / paper_hash / name, 'r', encoding='utf-8') as f:
+            return await f.read()
+
+    @staticmethod
+    def _segment_key(paper_hash: str, version: str, text: str) -> str:
+        """
+        Shared RAG segment key of a paper's text. It includes a digest of the
+        text, so a segment is only shared by sessions adding exactly the same
+        text: segments persisted when the text still carried a session's image
+        URLs (or a different API base URL) are never attached to other sessions.
+        """
+        return f"{paper_hash}/{version}/{document_key(text)[:16]}"
+
+    async def _distill_text(self, paper_content: str) -> str:
+        """Generates a distilled version of the paper using an LLM, section by section for long papers."""
+        return await self.distiller.distill(paper_content)
+
+    async def _ensure_paper(
+        self,
+        paper_hash: str,
+        pdf_path: Optional[pathlib.Path],
+        progress: Callable[[str], None] = lambda stage: None,
+    ):
+        """
+        Makes sure the processed paper is in the cache. Concurrent calls for the
+        same paper wait for a single processing job.
+        """
+        if self._is_paper_cached(paper_hash):
+            return
+        job = self._paper_jobs.get(paper_hash)
+        if job is None:
+            if pdf_path is None:
+                raise RuntimeError(f"Paper {paper_hash} is not cached and its PDF was not downloaded")
+            job = asyncio.ensure_future(self._process_paper_locked(paper_hash, pdf_path, progress))
+            self._paper_jobs[paper_hash] = job
+            job.add_done_callback(lambda _: self._forget_paper_job(paper_hash, job))
+        else:
+            logging.info(f"Waiting for paper {paper_hash} already being processed")
+            progress("parse")
+        self._paper_job_waiters[job] = self._paper_job_waiters.get(job, 0) + 1
+        try:
+            # A cancelled loader must not cancel the job other loaders are waiting on
+            await asyncio.shield(job)
+        finally:
+            self._paper_job_waiters[job] -= 1
+            if not self._paper_job_waiters[job]:
+                del self._paper_job_waiters[job]
+                if not job.done():
+                    # The last loader went away; a later one starts a fresh job
+                    logging.info(f"Cancelling the processing of paper {paper_hash}: no loader is waiting for it")
+                    self._forget_paper_job(paper_hash, job)
+                    job.cancel()
+
+    def _forget_paper_job(self, paper_hash: str, job: asyncio.Future):
+        if self._paper_jobs.get(paper_hash) is job:
+            del self._paper_jobs[paper_hash]
+
+    async def _process_paper_locked(self, paper_hash: str, pdf_path: pathlib.Path, progress: Callable[[str], None]):
+        """Processes a paper while holding its lock file, unless another process finished it meanwhile."""
+        lock_path = self.papers_dir / f".{paper_hash}.lock"
+        lock_file = await self._lock_paper(lock_path)
         try:
-            # Add user command to history
-            self.chat_client.add_message_to_history(chat_uuid, {"role": "user", "content": user_input})
-
-            # 1. Download PDF and compute hash
-            temp_pdf_path = await self._download_pdf(url)
-            paper_hash = await self._get_file_hash(temp_pdf_path)
-            
-            paper_cache_dir = self.papers_dir / paper_hash
-            raw_md_path = paper_cache_dir / "raw.md"
-            distilled_md_path = paper_cache_dir / "distilled.md"
-            images_dir = paper_cache_dir / "images"
-
-            # 2. Check cache
-            if paper_cache_dir.exists():
-                logging.info(f"Cache hit for paper hash: {paper_hash}")
-                async with aiofiles.open(raw_md_path, 'r', encoding='utf-8') as f:
-                    raw_markdown = await f.read()
-                async with aiofiles.open(distilled_md_path, 'r', encoding='utf-8') as f:
-                    distilled_markdown = await f.read()
+            if self._is_paper_cached(paper_hash):
+                logging.info(f"Paper {paper_hash} was processed by another process")
             else:
-                logging.info(f"Cache miss for paper hash: {paper_hash}. Processing from scratch.")
-                # 3. Cache Miss: Process from scratch
-                paper_cache_dir.mkdir()
-                
-                # Run Datalab to get raw markdown and images
-                datalab_output_dir = paper_cache_dir / "datalab_temp"
-                raw_markdown = await process_pdf_with_datalab(temp_pdf_path, datalab_output_dir)
-                if not raw_markdown:
-                    raise ValueError("Failed to parse PDF with Datalab.")
-                
-                # Move images to the correct cache location
-                if (datalab_output_dir / "images").exists():
-                    shutil.move(str(datalab_output_dir / "images"), str(images_dir))
-                
-                # Distill text
-                distilled_markdown = await self._distill_text(raw_markdown)
-
-                # Save to cache
-                async with aiofiles.open(raw_md_path, 'w', encoding='utf-8') as f:
-                    await f.write(raw_markdown)
-                async with aiofiles.open(distilled_md_path, 'w', encoding='utf-8') as f:
-                    await f.write(distilled_markdown)
-            
-            temp_pdf_path.unlink() # Clean up downloaded temp file
-
-            # 4. Filter markdown to insert correct, session-specific image URLs
-            session_raw_md = self._filter_markdown_images(raw_markdown, chat_uuid, paper_hash)
-            session_distilled_md = self._filter_markdown_images(distilled_markdown, chat_uuid, paper_hash)
-
-            # 5. Add both versions to RAG context for the current session
-            await self.chat_client.add_document(chat_uuid, session_raw_md)
-            await self.chat_client.add_document(chat_uuid, session_distilled_md)
-
-            # 6. Add assistant confirmation to history and return distilled text for display
+                await self._process_paper(paper_hash, pdf_path, progress)
+            # The paper is published, so later loaders don't lock at all; ones already waiting re-check the path
+            lock_path.unlink(missing_ok=True)
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+            lock_file.close()
+
+    @staticmethod
+    async def _lock_paper(lock_path: pathlib.Path):
+        """
+        Opens and exclusively locks a paper's lock file. A lock taken on a file
+        its holder unlinked meanwhile guards nothing, so that case starts over.
+        """
+        while True:
+            lock_file = open(lock_path, "a")
+            try:
+                await asyncio.to_thread(fcntl.flock, lock_file, fcntl.LOCK_EX)
+                if os.fstat(lock_file.fileno()).st_ino == os.stat(lock_path).st_ino:
+                    return lock_file
+            except FileNotFoundError:
+                pass
+            except BaseException:
+                lock_file.close()
+                raise
+            lock_file.close()
+
+    async def _process_paper(self, paper_hash: str, pdf_path: pathlib.Path, progress: Callable[[str], None]):
+        """Runs Datalab and distillation into a staging directory, then publishes it with an atomic rename."""
+        paper_cache_dir = self.papers_dir / paper_hash
+        staging_dir = self.papers_dir / f".{paper_hash}.partial"
+        # Holding the lock, anything here is left over from a crashed run
+        shutil.rmtree(staging_dir, ignore_errors=True)
+        if paper_cache_dir.exists():
+            logging.warning(f"Removing incomplete cache directory for paper {paper_hash}")
+            shutil.rmtree(paper_cache_dir)
+        staging_dir.mkdir()
+
+        try:
+            # Run Datalab to get raw markdown and images
+            progress("parse")
+            datalab_output_dir = staging_dir / "datalab_temp"
+            raw_markdown = await process_pdf_with_datalab(pdf_path, datalab_output_dir)
+            if not raw_markdown:
+                raise ValueError("Failed to parse PDF with Datalab.")
+
+            # Move images to the correct cache location. Datalab writes them next to article.md.
+            images_dir = staging_dir / "images"
+            images_dir.mkdir()
+            for path in datalab_output_dir.iterdir():
+                if path.is_file() and path.name != "article.md":
+                    shutil.move(str(path), str(images_dir / path.name))
+            # Hash images and pre-generate resized variants so serving them is just a file read
+            await asyncio.to_thread(build_image_manifest, images_dir)
+
+            # Distill text
+            progress("distill")
+            distilled_markdown = await self._distill_text(raw_markdown)
+
+            # Save to cache, with image links templated once so loading the paper needs no regex pass
+            async with aiofiles.open(staging_dir / "raw.md", 'w', encoding='utf-8') as f:
+                await f.write(self._template_markdown_images(raw_markdown, paper_hash))
+            async with aiofiles.open(staging_dir / "distilled.md", 'w', encoding='utf-8') as f:
+                await f.write(self._template_markdown_images(distilled_markdown, paper_hash))
+            (staging_dir / TEMPLATED_MARKER).touch()
+            staging_dir.rename(paper_cache_dir)
+        except BaseException:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+            raise
+        logging.info(f"Cached processed paper {paper_hash}")
+
+    async def _handle_load_command(
+        self, chat_uuid: str, url: str, progress: Callable[[str], None] = lambda stage: None
+    ) -> dict:
+        """
+        Orchestrates the full PDF processing pipeline, using a cache. `progress`
+        is called with each stage entered: download, parse, distill and embed.
+        """
+        try:
+            # 1. Resolve the URL to a paper hash, downloading the PDF unless the URL cache knows it
+            progress("download")
+            paper_hash, temp_pdf_path = await self._fetch_paper(url)
+
+            # 2. Check cache, processing the paper on a miss (or waiting for whoever already is)
+            try:
+                if self._is_paper_cached(paper_hash):
+                    logging.info(f"Cache hit for paper hash: {paper_hash}")
+                else:
+                    logging.info(f"Cache miss for paper hash: {paper_hash}. Processing from scratch.")
+                    await self._ensure_paper(paper_hash, temp_pdf_path, progress)
+            finally:
+                if temp_pdf_path is not None:
+                    temp_pdf_path.unlink(missing_ok=True) # Clean up downloaded temp file
+
+            # 3. Read both versions from the cache and fill in the image URLs
+            raw_markdown = self._render_markdown(await self._read_cached_markdown(paper_hash, "raw.md"))
+            distilled_markdown = self._render_markdown(await self._read_cached_markdown(paper_hash, "distilled.md"))
+
+            # 4. Add both versions to RAG context for the current session
+            # The text is the same for every session, so sessions loading the same paper share one
+            # index segment (keyed by paper hash) and its cached embeddings
+            progress("embed")
+            await self.chat_client.add_document(chat_uuid, raw_markdown, key=self._segment_key(paper_hash, "raw", raw_markdown))
+            await self.chat_client.add_document(
+                chat_uuid, distilled_markdown, key=self._segment_key(paper_hash, "distilled", distilled_markdown)
+            )
+
+            # 5. Add assistant confirmation to history and return distilled text for display
             assistant_message = "I have finished processing the paper. Both the original and the distilled versions are now in my context. Feel free to ask any questions."
-            self.chat_client.add_message_to_history(
+            await self.chat_client.add_message_to_history(
                 chat_uuid,
                 {"role": "assistant", "content": assistant_message}
             )
-            return {"type": "distillation", "status": "success", "content": session_distilled_md}
+            return {"type": "distillation", "status": "success", "content": distilled_markdown, "paper_hash": paper_hash}
 
         except Exception as e:
             logging.error(f"Failed to process URL {url}: {e}", exc_info=True)
             return {"type": "error", "status": "failure", "content": f"Failed to process URL: {e}"}
 
+    async def start_jobs(self):
+        """Runs /load commands as background jobs from now on, resuming any left unfinished."""
+        self.load_jobs = LoadJobQueue(self.cache_dir / "jobs", self._run_load_job)
+        await self.load_jobs.start()
+
+    async def stop_jobs(self):
+        if self.load_jobs is not None:
+            await self.load_jobs.stop()
+
+    async def _run_load_job(self, job: dict, progress: Callable[[str], None]) -> dict:
+        result = await self._handle_load_command(job["chat_uuid"], job["url"], progress)
+        if result.get("paper_hash"):
+            # The distilled text is in the paper cache; jobs keep only a reference to it (see job_result)
+            result = {key: value for key, value in result.items() if key != "content"}
+        return result
+
+    async def job_result(self, job: dict) -> Optional[dict]:
+        """
+        A finished job's result event, with the distilled text read back from the
+        paper cache, or an error event if the paper has been removed from it since.
+        """
+        result = job["result"]
+        if result is None or "content" in result or not result.get("paper_hash"):
+            return result
+        paper_hash = result["paper_hash"]
+        try:
+            content = self._render_markdown(await self._read_cached_markdown(paper_hash, "distilled.md"))
+        except FileNotFoundError:
+            logging.warning(f"Paper {paper_hash} of job {job['id']} is no longer in the cache")
+            return {
+                "type": "error",
+                "status": "failure",
+                "content": "The processed paper is no longer cached. Load it again.",
+                "paper_hash": paper_hash,
+            }
+        return {**result, "content": content}
+
+    async def _load(self, chat_uuid: str, user_input: str) -> dict:
+        """Starts a /load command: as a background job if jobs are running, otherwise inline."""
+        url = user_input.split(" ", 1)[1]
+        # Add user command to history
+        await self.chat_client.add_message_to_history(chat_uuid, {"role": "user", "content": user_input})
+        if self.load_jobs is None:
+            return await self._handle_load_command(chat_uuid, url)
+        job = self.load_jobs.submit(chat_uuid, url, user_input)
+        return {
+            "type": "job",
+            "status": "queued",
+            "content": f"Loading the paper in the background. Follow its progress at /v1/jobs/{job['id']}.",
+            "job_id": job["id"],
+        }
+
     async def process_input(self, chat_uuid: str, user_input: str) -> dict:
         """
         Processes user input, routing to command handlers or the chat client.
         """
         if user_input.lower().startswith("/load "):
-            url = user_input.split(" ", 1)[1]
-            return await self._handle_load_command(chat_uuid, url, user_input)
+            return await self._load(chat_uuid, user_input)
         else:
             response = await self.chat_client.get_response(chat_uuid, user_input, self.model)
-            return {"type": "chat", "content": response} 
\ No newline at end of file
+            return {"type": "chat", "content": response}
+
+    async def process_input_stream(self, chat_uuid: str, user_input: str) -> AsyncIterator[dict]:
+        """
+        Streaming variant of process_input. Chat replies are yielded as
+        {"type": "delta"} events followed by a final {"type": "chat"} event
+        carrying the full text. Commands yield their single result event, except
+        background /load jobs, which yield the job event, a {"type": "progress"}
+        event per stage and then the result.
+        """
+        if user_input.lower().startswith("/load "):
+            event = await self._load(chat_uuid, user_input)
+            yield event
+            if event["type"] != "job":
+                return
+            # Report each stage of the job, then its result
+            async for job in self.load_jobs.follow(event["job_id"]):
+                if job["result"] is not None:
+                    yield await self.job_result(job)
+                else:
+                    yield {"type": "progress", "status": job["status"], "content": job["stage"], "job_id": job["id"]}
+            return
+
+        parts = []
+        try:
+            async for delta in self.chat_client.get_response_stream(chat_uuid, user_input, self.model):
+                parts.append(delta)
+                yield {"type": "delta", "content": delta}
+        except Exception as e:
+            logging.error(f"Streaming chat failed for {chat_uuid}: {e}", exc_info=True)
+            yield {"type": "error", "status": "failure", "content": f"Failed to generate response: {e}"}
+            return
+        yield {"type": "chat", "content": "".join(parts).strip()}
@@ -0,0 +1,174 @@
+import asyncio
+import json
+import logging
+import os
+import pathlib
+import time
+from collections import OrderedDict
+from os import getenv
+from typing import Dict, Optional, Union
+
+
+class PaperUrlCache:
+    """
+    Maps paper URLs to the content hash of the PDF they served, with the
+    response's ETag and Last-Modified validators, so a repeated /load of a known
+    URL doesn't download the PDF again.
+
+    An entry validated less than `max_age` seconds ago (env PAPER_URL_MAX_AGE_SECONDS,
+    default 86400) is used as is. Older entries are revalidated with a conditional
+    GET, which costs one round trip when the server answers 304 Not Modified.
+    At most `max_entries` URLs are kept (env PAPER_URL_CACHE_MAX_ENTRIES, default
+    10000), least recently used first out. The map is persisted as JSON at `path`,
+    written on a worker thread at most once per `save_delay` seconds (env
+    PAPER_URL_CACHE_SAVE_DELAY_SECONDS, default 1); `flush` writes pending changes.
+    """
+
+    def __init__(
+        self,
+        path: Union[str, pathlib.Path],
+        max_entries: Optional[int] = None,
+        max_age: Optional[float] = None,
+        save_delay: Optional[float] = None,
+    ):
+        if max_entries is None:
+            max_entries = int(getenv("PAPER_URL_CACHE_MAX_ENTRIES", "10000"))
+        if max_age is None:
+            max_age = float(getenv("PAPER_URL_MAX_AGE_SECONDS", "86400"))
+        if save_delay is None:
+            save_delay = float(getenv("PAPER_URL_CACHE_SAVE_DELAY_SECONDS", "1"))
+        self.path = pathlib.Path(path)
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self.save_delay = save_delay
+        # Least recently used first
+        self.entries: "OrderedDict[str, Dict[str, object]]" = OrderedDict()
+        # Served without any request / revalidated with a 304 / downloaded (unknown, expired or changed)
+        self.hits = 0
+        self.revalidations = 0
+        self.misses = 0
+        self.evictions = 0
+        self._save_timer: Optional[asyncio.TimerHandle] = None
+        self._save_task: Optional[asyncio.Task] = None
+        self._load()
+
+    def _load(self):
+        if not self.path.exists():
+            return
+        try:
+            entries = json.loads(self.path.read_text())
+        except (OSError, ValueError) as e:
+            logging.error(f"Ignoring unreadable paper URL cache {self.path}: {e}")
+            return
+        self.entries.update(entries)
+        self._evict()
+
+    def save(self):
+        """Atomically writes the URL map to disk."""
+        self._write(json.dumps(self.entries))
+
+    def _write(self, payload: str):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_name(self.path.name + ".tmp")
+        tmp_path.write_text(payload)
+        os.replace(tmp_path, self.path)
+
+    def _schedule_save(self):
+        """Saves after `save_delay` seconds, folding in any changes made meanwhile."""
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.save()
+            return
+        if self._save_timer is None:
+            self._save_timer = loop.call_later(self.save_delay, self._start_save)
+
+    def _start_save(self):
+        self._save_timer = None
+        if self._save_task is not None and not self._save_task.done():
+            # A write is still in progress; save again once it is done
+            self._save_task.add_done_callback(lambda _: self._schedule_save())
+            return
+        # Serialized on the loop, where the entries are mutated; written on a worker thread
+        self._save_task = asyncio.ensure_future(asyncio.to_thread(self._write, json.dumps(self.entries)))
+        self._save_task.add_done_callback(self._log_save_error)
+
+    @staticmethod
+    def _log_save_error(task: asyncio.Task):
+        if not task.cancelled() and task.exception() is not None:
+            logging.error(f"Failed to save the paper URL cache: {task.exception()}")
+
+    async def flush(self):
+        """Writes any pending changes now, e.g. on shutdown."""
+        if self._save_task is not None:
+            await asyncio.gather(self._save_task, return_exceptions=True)
+        if self._save_timer is not None:
+            self._save_timer.cancel()
+            self._save_timer = None
+            await asyncio.to_thread(self._write, json.dumps(self.entries))
+
+    def get(self, url: str) -> Optional[Dict[str, object]]:
+        """The entry for `url` ({"hash", "etag", "last_modified", "validated_at"}), marking it as recently used."""
+        entry = self.entries.get(url)
+        if entry is not None:
+            self.entries.move_to_end(url)
+        return entry
+
+    def is_fresh(self, entry: Dict[str, object]) -> bool:
+        return time.time() - float(entry["validated_at"]) < self.max_age
+
+    def hit(self, url: str):
+        """Records that `url` was served from a fresh entry without any request."""
+        self.hits += 1
+
+    @staticmethod
+    def conditional_headers(entry: Dict[str, object]) -> Dict[str, str]:
+        """Request headers that make the server answer 304 if the URL still serves the cached PDF."""
+        headers = {}
+        if entry.get("etag"):
+            headers["If-None-Match"] = str(entry["etag"])
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = str(entry["last_modified"])
+        return headers
+
+    def put(self, url: str, paper_hash: str, etag: Optional[str], last_modified: Optional[str]):
+        """Records a download of `url`: it was unknown, expired or changed."""
+        self.misses += 1
+        self.entries[url] = {
+            "hash": paper_hash,
+            "etag": etag,
+            "last_modified": last_modified,
+            "validated_at": time.time(),
+        }
+        self.entries.move_to_end(url)
+        self._evict()
+        self._schedule_save()
+
+    def touch(self, url: str):
+        """Records a successful revalidation of `url`."""
+        self.revalidations += 1
+        self.entries[url]["validated_at"] = time.time()
+        self._schedule_save()
+
+    def discard(self, url: str):
+        """Forgets `url`, e.g. when revalidating it failed because it no longer serves the paper."""
+        if self.entries.pop(url, None) is not None:
+            self._schedule_save()
+
+    def _evict(self):
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self) -> Dict[str, object]:
+        lookups = self.hits + self.revalidations + self.misses
+        return {
+            "entries": len(self.entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "revalidations": self.revalidations,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            # Share of /load requests that skipped the download
+            "hit_rate": (self.hits + self.revalidations) / lookups if lookups else 0.0,
+        }
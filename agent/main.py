@@ -1,14 +1,16 @@
+import json
 import os
 from contextlib import asynccontextmanager
-from typing import Dict
+from typing import Dict, Optional
 
 from dotenv import load_dotenv
-from fastapi import FastAPI, Depends, HTTPException, Security
+from fastapi import FastAPI, Depends, HTTPException, Request, Response, Security
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, StreamingResponse
 from pydantic import BaseModel
 
 from agent.science_chat import ScienceChatOrchestrator
+from models import get_all_ttft_stats
 from models.chat import ChatClient
 
 # --- Models for API data validation ---
@@ -19,6 +21,8 @@ class ApiResponse(BaseModel):
     type: str
     content: str
     status: str = "success"
+    # Set for /load commands queued as background jobs
+    job_id: Optional[str] = None
 
 # --- Gloabl State and Lifespan Management ---
 state: Dict[str, ScienceChatOrchestrator] = {}
@@ -43,8 +47,15 @@ async def lifespan(app: FastAPI):
         chat_client=chat_client,
         api_base_url=os.getenv("API_BASE_URL", "http://localhost:8000")
     )
+    # /load commands run as background jobs; unfinished ones from the last run resume here
+    await state["orchestrator"].start_jobs()
     yield
     print("--- Shutting down ---")
+    await state["orchestrator"].stop_jobs()
+    await state["orchestrator"].url_cache.flush()
+    # Finish indexing, spill histories and compact RAG append logs so the next startup has nothing to replay
+    await chat_client.wait_for_background()
+    await chat_client.persist_all()
     state.clear()
 
 
@@ -83,20 +94,122 @@ async def chat_handler(
     return ApiResponse(**response)
 
 
-@app.get("/v1/images/{chat_uuid}/{paper_hash}/{image_name}")
-async def get_image(chat_uuid: str, paper_hash: str, image_name: str):
-    """Serves a specific image from the cache."""
+@app.post("/v1/chat/{chat_uuid}/stream")
+async def chat_stream_handler(
+    chat_uuid: str,
+    user_input: UserInput,
+    authenticated: bool = Depends(get_current_user)
+):
+    """
+    Streams the response for a chat message as Server-Sent Events.
+    Each event carries a JSON object: "delta" events with token fragments,
+    then a final "chat", "distillation" or "error" event.
+    """
     orchestrator = state["orchestrator"]
-    # Construct a safe path to the image
-    image_path = orchestrator.papers_dir / paper_hash / "images" / image_name
-    
-    if not image_path.is_file():
+
+    async def event_source():
+        async for event in orchestrator.process_input_stream(chat_uuid, user_input.text):
+            yield f"data: {json.dumps(event)}\n\n"
+
+    return StreamingResponse(
+        event_source(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.get("/v1/jobs/{job_id}")
+async def get_job(job_id: str, authenticated: bool = Depends(get_current_user)):
+    """
+    Status of a background /load job: "queued", "running", "done" or "failed",
+    the stage it is in (download, parse, distill, embed) with per-stage start and
+    finish times, and once finished its result, the same event /load returned before.
+    """
+    orchestrator = state["orchestrator"]
+    job = orchestrator.load_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    result = await orchestrator.job_result(job)
+    # A finished job whose paper has since been removed from the cache can't be served any more
+    status = "failed" if result is not None and result.get("type") == "error" else job["status"]
+    return {**job, "status": status, "result": result}
+
+
+@app.get("/v1/chat/{chat_uuid}/jobs")
+async def list_chat_jobs(chat_uuid: str, authenticated: bool = Depends(get_current_user)):
+    """Background /load jobs of a chat, oldest first. Results leave out the distilled text; get it from /v1/jobs/{id}."""
+    return state["orchestrator"].load_jobs.for_chat(chat_uuid)
+
+
+@app.get("/v1/stats/jobs")
+async def job_stats(authenticated: bool = Depends(get_current_user)):
+    """Number of load workers, jobs waiting for one, and jobs by status."""
+    return state["orchestrator"].load_jobs.stats()
+
+
+@app.get("/v1/stats/memory")
+async def memory_stats(authenticated: bool = Depends(get_current_user)):
+    """Estimated per-session and total memory held by chat histories and RAG indexes."""
+    return state["orchestrator"].chat_client.memory_stats()
+
+
+@app.get("/v1/stats/history")
+async def history_stats(authenticated: bool = Depends(get_current_user)):
+    """Per-session history window size, summarization and estimated tokens saved."""
+    return state["orchestrator"].chat_client.context_manager.history_stats()
+
+
+@app.get("/v1/stats/ttft")
+async def ttft_stats(authenticated: bool = Depends(get_current_user)):
+    """Per-model count, mean, p50 and p95 of recent streamed responses' time to first token, in seconds."""
+    return get_all_ttft_stats()
+
+
+@app.get("/v1/stats/papers")
+async def paper_stats(authenticated: bool = Depends(get_current_user)):
+    """Paper URL cache size and hit rate: /load requests that skipped downloading the PDF."""
+    return state["orchestrator"].url_cache.stats()
+
+
+# Paper images are content-addressed by paper hash and never change
+IMAGE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """If-None-Match evaluation with the weak comparison allowed for GET: W/ prefixes are ignored."""
+    if not if_none_match:
+        return False
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if tag == "*" or tag.removeprefix("W/") == etag:
+            return True
+    return False
+
+
+@app.get("/v1/images/{paper_hash}/{image_name}")
+async def get_image(paper_hash: str, image_name: str, request: Request, w: Optional[int] = None):
+    """
+    Serves a specific image from the cache, with a strong ETag and immutable
+    caching. Answers 304 when the client already has it. With `w`, the
+    smallest pre-generated variant at least `w` pixels wide is served instead,
+    if there is one.
+    """
+    orchestrator = state["orchestrator"]
+    # Names are validated by the store, so the path can't escape the cache dir
+    image = await orchestrator.image_store.lookup(paper_hash, image_name, w)
+    if image is None:
         raise HTTPException(status_code=404, detail="Image not found")
+    image_path, stat_result, etag = image
+
+    headers = {"ETag": etag, "Cache-Control": IMAGE_CACHE_CONTROL}
+    if _etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    return FileResponse(
+        image_path, headers=headers, media_type=orchestrator.image_store.media_type(image_name), stat_result=stat_result
+    )
 
-    # Prevent path traversal attacks by ensuring the path is within the cache dir
-    try:
-        image_path.resolve().relative_to(orchestrator.papers_dir.resolve())
-    except ValueError:
-        raise HTTPException(status_code=403, detail="Forbidden")
 
-    return FileResponse(image_path) 
\ No newline at end of file
+@app.get("/v1/images/{chat_uuid}/{paper_hash}/{image_name}")
+async def get_session_image(chat_uuid: str, paper_hash: str, image_name: str, request: Request, w: Optional[int] = None):
+    """Serves an image by the session-specific URL used in markdown rendered before image URLs dropped the session."""
+    return await get_image(paper_hash, image_name, request, w)
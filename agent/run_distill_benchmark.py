@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+"""
+Wall time of paper distillation versus paper length, single pass against
+map-reduce by section (see agent.distillation.PaperDistiller), using the
+in-process fake model provider.
+
+The fake provider charges `--input-tokens-per-second` for the prompt and
+writes `--response-ratio` output tokens per prompt token at
+`--tokens-per-second`, so a single pass over a long paper is dominated by one
+long generation while map-reduce generates section notes in parallel. All
+speeds are multiplied by `--speedup` to keep the run short; reported times are
+scaled back. Single passes over papers larger than the model's context window
+are reported as not fitting, since a real model would reject them.
+
+Usage:
+    python run_distill_benchmark.py [--lengths 5000,20000,50000,100000,200000] [--output results.json]
+"""
+import argparse
+import asyncio
+import json
+import os
+import pathlib
+import random
+import time
+from typing import Dict, List
+
+
+def synthetic_paper(rng: random.Random, tokens: int, section_tokens: int = 2500) -> str:
+    """Markdown paper of about `tokens` tokens, with a section heading every ~`section_tokens` tokens."""
+    vocabulary = [f"term{i}" for i in range(2000)]
+    sections = []
+    for s in range(max(1, tokens // section_tokens)):
+        paragraphs = []
+        # ~80 words of ~8 characters, about 160 tokens
+        for _ in range(section_tokens // 160):
+            paragraphs.append(" ".join(rng.choice(vocabulary) for _ in range(80)) + ".")
+        sections.append(f"## Section {s + 1}\n\n" + "\n\n".join(paragraphs))
+    return "# A synthetic paper\n\n" + "\n\n".join(sections)
+
+
+async def time_distillation(distiller, paper: str, provider) -> Dict[str, float]:
+    calls_before = provider.request_counts["chat"]
+    started = time.perf_counter()
+    await distiller.distill(paper)
+    return {"seconds": time.perf_counter() - started, "calls": provider.request_counts["chat"] - calls_before}
+
+
+async def run(args) -> Dict[str, object]:
+    import jinja2
+    from models import set_provider
+    from models.providers import FakeProvider, LatencyModel
+    from models.tools import context_limit, estimate_tokens
+    from agent.distillation import PaperDistiller
+
+    provider = FakeProvider(
+        latency=LatencyModel(args.latency_ms / 1000.0 / args.speedup, "lognormal"),
+        tokens_per_second=args.tokens_per_second * args.speedup,
+        input_tokens_per_second=args.input_tokens_per_second * args.speedup,
+        response_tokens=0,
+        response_ratio=args.response_ratio,
+        seed=args.seed,
+    )
+    set_provider(provider)
+
+    templates = jinja2.Environment(
+        loader=jinja2.FileSystemLoader(pathlib.Path(__file__).parent / "agent" / "prompts")
+    )
+    distillers = {
+        mode: PaperDistiller(args.model, templates, mode=mode, section_tokens=args.section_tokens)
+        for mode in ("single", "chunked")
+    }
+    limit = context_limit(args.model)
+
+    rng = random.Random(args.seed)
+    report = {
+        "model": args.model,
+        "context_tokens": limit,
+        "section_tokens": args.section_tokens,
+        "tokens_per_second": args.tokens_per_second,
+        "input_tokens_per_second": args.input_tokens_per_second,
+        "response_ratio": args.response_ratio,
+        "papers": [],
+    }
+    for length in args.lengths:
+        paper = synthetic_paper(rng, length)
+        paper_tokens = estimate_tokens(paper)
+        entry: Dict[str, object] = {"paper_tokens": paper_tokens}
+        for mode, distiller in distillers.items():
+            if mode == "single" and paper_tokens > limit:
+                entry[mode] = None
+                continue
+            result = await time_distillation(distiller, paper, provider)
+            result["seconds"] *= args.speedup
+            entry[mode] = result
+        report["papers"].append(entry)
+
+        single = entry["single"]
+        single_text = f"{single['seconds']:7.1f}s ({single['calls']} call)" if single else "  does not fit in context"
+        chunked = entry["chunked"]
+        print(f"{paper_tokens:>7} tokens  single {single_text}  chunked {chunked['seconds']:7.1f}s ({chunked['calls']} calls)")
+    return report
+
+
+def parse_lengths(value: str) -> List[int]:
+    return [int(length) for length in value.split(",")]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark single-pass vs map-reduce paper distillation.")
+    parser.add_argument("--lengths", type=parse_lengths, default=parse_lengths("5000,20000,50000,100000,200000"),
+                        help="Comma-separated paper lengths in tokens")
+    parser.add_argument("--model", default="grok-3-mini-high")
+    parser.add_argument("--section-tokens", type=int, default=8000)
+    parser.add_argument("--latency-ms", type=float, default=500.0, help="Mean time to first token")
+    parser.add_argument("--tokens-per-second", type=float, default=100.0, help="Output generation speed")
+    parser.add_argument("--input-tokens-per-second", type=float, default=5000.0, help="Prompt processing speed")
+    parser.add_argument("--response-ratio", type=float, default=0.15, help="Output tokens per prompt token")
+    parser.add_argument("--speedup", type=float, default=50.0, help="Divides every simulated duration")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write JSON results to this file instead of stdout")
+    args = parser.parse_args()
+
+    # Measure distillation itself, not the client-side request spacing
+    os.environ.setdefault("RATE_LIMIT_SECONDS", "0")
+
+    report = asyncio.run(run(args))
+    payload = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(payload)
+    else:
+        print(payload)
+
+
+if __name__ == "__main__":
+    main()
@@ -10,6 +10,8 @@ ASSISTANT_COLOR = "\033[92m"
 SYSTEM_COLOR = "\033[93m"
 ERROR_COLOR = "\033[91m"
 RESET_COLOR = "\033[0m"
+# How long to wait for a background /load job before giving up on it
+JOB_TIMEOUT_SECONDS = float(os.getenv("JOB_TIMEOUT_SECONDS", "3600"))
 
 def load_and_check_env():
     """Loads environment variables and checks for required ones."""
@@ -36,6 +38,28 @@ async def query_api(session, url, headers, payload):
                 "content": f"API request failed with status {response.status}: {error_text}"
             }
 
+async def wait_for_job(session, api_base_url, headers, job_id):
+    """Polls a background /load job, printing each stage, and returns its result event (an error after JOB_TIMEOUT_SECONDS)."""
+    stage = None
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + JOB_TIMEOUT_SECONDS
+    while True:
+        async with session.get(f"{api_base_url}/v1/jobs/{job_id}", headers=headers) as response:
+            if response.status == 404:
+                return {"type": "error", "content": f"Job {job_id} was not found on the server."}
+            if response.status != 200:
+                error_text = await response.text()
+                return {"type": "error", "content": f"Job status request failed with status {response.status}: {error_text}"}
+            job = await response.json()
+        if job["result"] is not None:
+            return job["result"]
+        if loop.time() >= deadline:
+            return {"type": "error", "content": f"Job {job_id} did not finish within {JOB_TIMEOUT_SECONDS:.0f}s (stuck at stage '{job['stage']}')."}
+        if job["stage"] != stage:
+            stage = job["stage"]
+            print(f"{SYSTEM_COLOR}Loading paper: {stage}...{RESET_COLOR}")
+        await asyncio.sleep(2)
+
 async def main():
     """Initializes and runs the interactive API client."""
     api_base_url, api_key = load_and_check_env()
@@ -67,6 +91,8 @@ async def main():
                 
                 payload = {"text": user_input}
                 result = await query_api(session, api_endpoint, headers, payload)
+                if result["type"] == "job":
+                    result = await wait_for_job(session, api_base_url, headers, result["job_id"])
                 
                 print(" " * 20, end='\r')
 
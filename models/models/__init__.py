@@ -1,9 +1,19 @@
-from openai import AsyncOpenAI, NOT_GIVEN
-from typing import Optional, List, Dict, Any
-import aiohttp
+from typing import Optional, List, Dict, Any, AsyncIterator, Awaitable, Callable, Deque, TypeVar
+from collections import deque
+from contextlib import asynccontextmanager
+import asyncio
+import logging
+import statistics
+import time
 from os import getenv
 
 from .semaphore import RLSemaphore
+from .batching import EmbeddingBatcher
+from .embedding_store import configure_embedding_store, get_embedding_store
+from .providers import RateLimitError, get_provider, set_provider
+from .tools import exponential_backoff
+
+T = TypeVar("T")
 
 # --- Model-specific Semaphores ---
 _SEMAPHORES: Dict[str, RLSemaphore] = {}
@@ -14,6 +24,64 @@ def get_semaphore(model: str) -> RLSemaphore:
         _SEMAPHORES[model] = RLSemaphore() # Parameters are now fetched inside
     return _SEMAPHORES[model]
 
+# --- Streaming Metrics ---
+# Recent time-to-first-token samples (seconds) per model.
+_TTFT_SAMPLES: Dict[str, Deque[float]] = {}
+_TTFT_MAX_SAMPLES = 1000
+
+def _record_ttft(model: str, seconds: float):
+    """Stores a time-to-first-token sample for a model."""
+    if model not in _TTFT_SAMPLES:
+        _TTFT_SAMPLES[model] = deque(maxlen=_TTFT_MAX_SAMPLES)
+    _TTFT_SAMPLES[model].append(seconds)
+
+def get_ttft_stats(model: str) -> Dict[str, float]:
+    """Returns count, mean, p50 and p95 of recent time-to-first-token samples for a model."""
+    samples = sorted(_TTFT_SAMPLES.get(model, ()))
+    if not samples:
+        return {"count": 0}
+    return {
+        "count": len(samples),
+        "mean": statistics.fmean(samples),
+        "p50": samples[len(samples) // 2],
+        "p95": samples[min(len(samples) - 1, int(len(samples) * 0.95))],
+    }
+
+def get_all_ttft_stats() -> Dict[str, Dict[str, float]]:
+    """get_ttft_stats for every model that has streamed a response."""
+    return {model: get_ttft_stats(model) for model in list(_TTFT_SAMPLES)}
+
+# --- Rate Limit Handling ---
+
+@asynccontextmanager
+async def _rate_limited(model: str, request: Callable[[], Awaitable[T]]) -> AsyncIterator[T]:
+    """
+    Runs a provider request under the model semaphore and yields its result with
+    the semaphore still held. A 429 slows the semaphore down and retries with
+    exponential backoff; a success lets it speed up again.
+    """
+    semaphore = get_semaphore(model)
+    max_retries = int(getenv("MAX_RATE_LIMIT_RETRIES", "5"))
+    for attempt in range(max_retries + 1):
+        async with semaphore:
+            try:
+                result = await request()
+            except RateLimitError:
+                semaphore.slowdown()
+                if attempt == max_retries:
+                    raise
+                logging.warning(f"Rate limited by {model}, retry {attempt + 1}/{max_retries}")
+            else:
+                semaphore.speedup()
+                yield result
+                return
+        await asyncio.sleep(exponential_backoff(attempt) * max(semaphore.min_interval, 0.05))
+
+async def _with_rate_limit_retries(model: str, request: Callable[[], Awaitable[T]]) -> T:
+    """Runs a provider request with _rate_limited, releasing the semaphore once it returns."""
+    async with _rate_limited(model, request) as result:
+        return result
+
 # --- API Functions ---
 
 async def chat_completions(
@@ -23,40 +91,88 @@ async def chat_completions(
     temperature: Optional[float] = None,
 ) -> str:
     """Get chat completions from the OpenAI-compatible API."""
-    async with get_semaphore(model):
-        api_key = getenv("SAVANT_ROUTER_API_KEY")
-        request_timeout = int(getenv("REQUEST_TIMEOUT", "1800"))
-        task_id = getenv("TASK_ID", None)
-        
-        client = AsyncOpenAI(api_key=api_key, base_url="https://router.savant.chat/api")
-        
-        extra_body = {"task_name": task_id} if task_id else {}
-
-        response = await client.chat.completions.create(
-            model=model,
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt},
-            ],
-            temperature=temperature if temperature is not None else NOT_GIVEN,
-            extra_body=extra_body,
-            timeout=request_timeout
-        )
-        return response.choices[0].message.content.strip()
+    messages = [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": user_prompt},
+    ]
+    response = await _with_rate_limit_retries(
+        model, lambda: get_provider().chat_completion(model, messages, temperature)
+    )
+    return response.strip()
+
+async def chat_completions_stream(
+    model: str,
+    system_prompt: str,
+    user_prompt: str,
+    temperature: Optional[float] = None,
+) -> AsyncIterator[str]:
+    """
+    Stream chat completion token deltas from the OpenAI-compatible API.
+    The model semaphore is held until the stream is exhausted or closed.
+    Rate-limited requests are retried only before the first token arrives.
+    """
+    messages = [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": user_prompt},
+    ]
+
+    async def open_stream():
+        # A 429 arrives before the first token, so only opening the stream is retried
+        started_at = time.perf_counter()
+        stream = get_provider().chat_completion_stream(model, messages, temperature)
+        first = await anext(stream, None)
+        if first is not None:
+            ttft = time.perf_counter() - started_at
+            _record_ttft(model, ttft)
+            logging.info(f"Time to first token for {model}: {ttft:.3f}s")
+        return stream, first
+
+    async with _rate_limited(model, open_stream) as (stream, first):
+        if first is None:
+            return
+        try:
+            yield first
+            async for delta in stream:
+                yield delta
+        except RateLimitError:
+            get_semaphore(model).slowdown()
+            raise
+        finally:
+            await stream.aclose()
 
 async def embeddings(model: str, texts: List[str]) -> List[List[float]]:
-    """Get embeddings for a list of texts from the VoyageAI API."""
-    async with get_semaphore(model):
-        api_key = getenv("VOYAGE_API_KEY")
-        request_timeout = int(getenv("REQUEST_TIMEOUT", "1800"))
-
-        client = AsyncOpenAI(api_key=api_key, base_url="https://api.voyageai.com/v1")
-        response = await client.embeddings.create(
-            model=model,
-            input=texts,
-            timeout=request_timeout
-        )
-        return [item.embedding for item in response.data]
+    """
+    Get embeddings for a list of texts from the VoyageAI API.
+    Texts found in the persistent embedding store are not sent to the API, and
+    concurrent calls for the same model are merged into batched API requests.
+    """
+    store = get_embedding_store()
+    if store is None:
+        return await get_embedding_batcher().embed(model, texts)
+
+    # The store takes file locks and does disk I/O, so it runs off the event loop
+    vectors = await asyncio.to_thread(store.get_many, model, texts)
+    missing = [i for i, vector in enumerate(vectors) if vector is None]
+    if missing:
+        missing_texts = list(dict.fromkeys(texts[i] for i in missing))
+        fetched = await get_embedding_batcher().embed(model, missing_texts)
+        await asyncio.to_thread(store.put_many, model, missing_texts, fetched)
+        by_text = dict(zip(missing_texts, fetched))
+        for i in missing:
+            vectors[i] = by_text[texts[i]]
+    return vectors
+
+async def _embeddings_request(model: str, texts: List[str]) -> List[List[float]]:
+    """Performs a single embeddings API call for a batch of texts."""
+    return await _with_rate_limit_retries(model, lambda: get_provider().embed(model, texts))
+
+_EMBEDDING_BATCHER: List[Optional[EmbeddingBatcher]] = [None]
+
+def get_embedding_batcher() -> EmbeddingBatcher:
+    """Creates the embedding batcher on first use, so its EMBEDDING_BATCH_* settings are read after .env is loaded."""
+    if _EMBEDDING_BATCHER[0] is None:
+        _EMBEDDING_BATCHER[0] = EmbeddingBatcher(_embeddings_request)
+    return _EMBEDDING_BATCHER[0]
 
 async def rerank(
     model: str,
@@ -65,22 +181,6 @@ async def rerank(
     top_k: Optional[int] = None,
 ) -> Dict[str, Any]:
     """Rerank documents based on a query using the VoyageAI API."""
-    async with get_semaphore(model):
-        api_key = getenv("VOYAGE_API_KEY")
-        request_timeout = int(getenv("REQUEST_TIMEOUT", "1800"))
-
-        async with aiohttp.ClientSession() as session:
-            payload = {
-                "query": query,
-                "documents": documents,
-                "model": model,
-                "top_k": top_k,
-                "return_documents": False,
-                "truncation": True,
-            }
-            headers = {
-                "Authorization": f"Bearer {api_key}",
-                "Content-Type": "application/json"
-            }
-            async with session.post("https://api.voyageai.com/v1/rerank", headers=headers, json=payload, timeout=request_timeout) as response:
-                return await response.json() 
\ No newline at end of file
+    return await _with_rate_limit_retries(
+        model, lambda: get_provider().rerank(model, query, documents, top_k)
+    )
\ No newline at end of file
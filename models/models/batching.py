@@ -0,0 +1,145 @@
+import asyncio
+import logging
+from os import getenv
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+from .tools import estimate_tokens
+
+EmbeddingRequestFn = Callable[[str, List[str]], Awaitable[List[List[float]]]]
+
+
+class _PendingBatch:
+    """Texts and waiting callers collected for one model within the current window."""
+
+    def __init__(self):
+        self.texts: List[str] = []
+        self.tokens = 0
+        # (future, start offset, count) for every caller in the batch
+        self.waiters: List[Tuple[asyncio.Future, int, int]] = []
+        self.timer: Optional[asyncio.TimerHandle] = None
+
+
+class EmbeddingBatcher:
+    """
+    Merges concurrent embedding requests for the same model into a single API call.
+
+    Requests are collected for up to `window` seconds, or until the batch reaches
+    `max_batch_size` texts or `max_batch_tokens` estimated tokens, whichever comes
+    first. Results are split back so every caller gets exactly its own vectors.
+    Requests larger than a batch are split into several batches.
+    """
+
+    def __init__(
+        self,
+        request_fn: EmbeddingRequestFn,
+        window: Optional[float] = None,
+        max_batch_size: Optional[int] = None,
+        max_batch_tokens: Optional[int] = None,
+    ):
+        if window is None:
+            window = float(getenv("EMBEDDING_BATCH_WINDOW_MS", "10")) / 1000.0
+        if max_batch_size is None:
+            max_batch_size = int(getenv("EMBEDDING_BATCH_MAX_SIZE", "128"))
+        if max_batch_tokens is None:
+            max_batch_tokens = int(getenv("EMBEDDING_BATCH_MAX_TOKENS", "100000"))
+
+        if max_batch_size < 1 or max_batch_tokens < 1:
+            raise ValueError("Batch limits must be positive.")
+
+        self.request_fn = request_fn
+        self.window = window
+        self.max_batch_size = max_batch_size
+        self.max_batch_tokens = max_batch_tokens
+        self._pending: Dict[str, _PendingBatch] = {}
+        # Batches being sent, referenced so their tasks are not garbage-collected mid-flight
+        self._sending: Set[asyncio.Task] = set()
+
+    async def embed(self, model: str, texts: List[str]) -> List[List[float]]:
+        """Embeds texts, sharing the underlying API call with concurrent callers."""
+        if not texts:
+            return []
+
+        futures = []
+        start = 0
+        while start < len(texts):
+            end = self._part_end(texts, start)
+            futures.append(self._enqueue(model, texts[start:end]))
+            start = end
+
+        results = await asyncio.gather(*futures)
+        return [vector for part in results for vector in part]
+
+    def _part_end(self, texts: List[str], start: int) -> int:
+        """Returns the end of the longest slice starting at `start` that fits in one batch."""
+        tokens = 0
+        end = start
+        while end < len(texts) and end - start < self.max_batch_size:
+            tokens += estimate_tokens(texts[end])
+            if tokens > self.max_batch_tokens and end > start:
+                break
+            end += 1
+        return end
+
+    def _enqueue(self, model: str, texts: List[str]) -> asyncio.Future:
+        """Adds a request that fits in one batch to the pending batch for the model."""
+        loop = asyncio.get_running_loop()
+        tokens = sum(estimate_tokens(text) for text in texts)
+
+        batch = self._pending.get(model)
+        if batch is not None and (
+            len(batch.texts) + len(texts) > self.max_batch_size
+            or batch.tokens + tokens > self.max_batch_tokens
+        ):
+            self._flush(model)
+            batch = None
+
+        if batch is None:
+            batch = _PendingBatch()
+            self._pending[model] = batch
+
+        future = loop.create_future()
+        batch.waiters.append((future, len(batch.texts), len(texts)))
+        batch.texts.extend(texts)
+        batch.tokens += tokens
+
+        if len(batch.texts) >= self.max_batch_size or batch.tokens >= self.max_batch_tokens:
+            self._flush(model)
+        elif batch.timer is None:
+            batch.timer = loop.call_later(self.window, self._flush, model)
+
+        return future
+
+    def _flush(self, model: str):
+        """Detaches the pending batch for the model and sends it in the background."""
+        batch = self._pending.pop(model, None)
+        if batch is None:
+            return
+        if batch.timer is not None:
+            batch.timer.cancel()
+        task = asyncio.ensure_future(self._send(model, batch))
+        self._sending.add(task)
+        task.add_done_callback(self._sending.discard)
+
+    async def _send(self, model: str, batch: _PendingBatch):
+        """Performs the API call for a batch and distributes the results."""
+        if len(batch.waiters) > 1:
+            logging.debug(f"Embedding batch for {model}: {len(batch.texts)} texts from {len(batch.waiters)} callers")
+        try:
+            vectors = await self.request_fn(model, batch.texts)
+            if len(vectors) != len(batch.texts):
+                raise ValueError(f"Expected {len(batch.texts)} embeddings, got {len(vectors)}")
+        except asyncio.CancelledError:
+            for future, _, _ in batch.waiters:
+                future.cancel()
+            raise
+        except BaseException as e:
+            for future, _, _ in batch.waiters:
+                if not future.done():
+                    future.set_exception(e)
+            if not isinstance(e, Exception):
+                raise
+            return
+
+        for future, offset, count in batch.waiters:
+            if not future.done():
+                future.set_result(vectors[offset:offset + count])
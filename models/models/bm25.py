@@ -0,0 +1,77 @@
+import heapq
+import math
+import re
+from collections import Counter
+from typing import Dict, Hashable, List, Sequence, Tuple, TypeVar
+
+T = TypeVar("T", bound=Hashable)
+
+_TOKEN_PATTERN = re.compile(r"\w+")
+# Rough bytes per posting (doc id and term frequency in a Python list)
+_POSTING_BYTES = 16
+
+
+def tokenize(text: str) -> List[str]:
+    return _TOKEN_PATTERN.findall(text.lower())
+
+
+class BM25Index:
+    """
+    Incremental in-memory inverted index scoring documents with Okapi BM25.
+    Document ids are insertion positions, matching the vector index ids.
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.postings: Dict[str, List[Tuple[int, int]]] = {}
+        self.doc_lengths: List[int] = []
+        self._total_length = 0
+        self._num_postings = 0
+
+    def __len__(self) -> int:
+        return len(self.doc_lengths)
+
+    def add(self, documents: Sequence[str]):
+        for document in documents:
+            doc_id = len(self.doc_lengths)
+            terms = tokenize(document)
+            for term, frequency in Counter(terms).items():
+                self.postings.setdefault(term, []).append((doc_id, frequency))
+                self._num_postings += 1
+            self.doc_lengths.append(len(terms))
+            self._total_length += len(terms)
+
+    def search(self, query: str, k: int) -> List[Tuple[float, int]]:
+        """Returns up to k (score, doc id) pairs with a positive score, best first."""
+        if not self.doc_lengths:
+            return []
+        num_docs = len(self.doc_lengths)
+        average_length = self._total_length / num_docs or 1.0
+        scores: Dict[int, float] = {}
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1.0 + (num_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+            for doc_id, frequency in postings:
+                norm = self.k1 * (1.0 - self.b + self.b * self.doc_lengths[doc_id] / average_length)
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * frequency * (self.k1 + 1.0) / (frequency + norm)
+        best = heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+        return [(score, doc_id) for doc_id, score in best]
+
+    def memory_bytes(self) -> int:
+        """Estimated memory held by postings and document lengths."""
+        return self._num_postings * _POSTING_BYTES + len(self.doc_lengths) * 8
+
+
+def reciprocal_rank_fusion(rankings: Sequence[Sequence[T]], k: int = 60) -> List[T]:
+    """
+    Fuses ranked lists by summing 1 / (k + rank) per item. Only ranks matter,
+    so lists with incomparable scores (BM25, cosine) can be combined.
+    """
+    scores: Dict[T, float] = {}
+    for ranking in rankings:
+        for rank, item in enumerate(ranking):
+            scores[item] = scores.get(item, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(scores, key=scores.__getitem__, reverse=True)
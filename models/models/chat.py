@@ -1,42 +1,124 @@
 import asyncio
+import logging
 import uuid
-from typing import List, Dict
+from os import getenv
+from typing import Any, List, Dict, AsyncIterator, Optional
 
 from .context import ChatContextManager
-from . import chat_completions
+from .session_cache import SessionCache
+from .session_store import get_session_store
+from . import chat_completions, chat_completions_stream
+
+# Rough per-message overhead of the dict and its strings, in bytes
+_MESSAGE_OVERHEAD_BYTES = 64
+
+
+def _history_bytes(history: List[Dict[str, str]]) -> int:
+    return sum(len(message.get("content", "")) + _MESSAGE_OVERHEAD_BYTES for message in history)
+
 
 class ChatClient:
     """
     A low-level client that manages multiple chat sessions, generates contexts,
     and interacts with the language model. It does not handle UI.
+
+    Chat histories are kept in a SessionCache bounded by `history_max_bytes`
+    (env CHAT_HISTORY_CACHE_MAX_BYTES, default 256 MiB) with the same idle TTL
+    as RAG sessions; evicted histories are spilled to the session store. Spills
+    and reloads run on worker threads, and a history being spilled is reloaded
+    only once it is on disk.
     """
-    def __init__(self):
-        self.context_manager = ChatContextManager()
-        self.chat_histories: Dict[str, List[Dict[str, str]]] = {}
+    def __init__(self, history_max_bytes: Optional[int] = None, idle_ttl: Optional[float] = None):
+        if history_max_bytes is None:
+            history_max_bytes = int(getenv("CHAT_HISTORY_CACHE_MAX_BYTES", str(256 * 1024**2)))
+        if idle_ttl is None:
+            idle_ttl = float(getenv("SESSION_IDLE_TTL_SECONDS", "3600"))
+        self.context_manager = ChatContextManager(idle_ttl=idle_ttl)
+        self.chat_histories: SessionCache[List[Dict[str, str]]] = SessionCache(
+            max_bytes=history_max_bytes,
+            idle_ttl=idle_ttl,
+            size_of=_history_bytes,
+            on_evict=self._spill_history,
+        )
+        # Histories being reloaded and evicted histories being written, by chat UUID
+        self._loading_histories: Dict[str, asyncio.Future] = {}
+        self._spilling_histories: Dict[str, asyncio.Future] = {}
 
-    def _get_or_create_history(self, chat_uuid: str) -> List[Dict[str, str]]:
-        """Retrieves or creates the chat history for a given UUID."""
-        if chat_uuid not in self.chat_histories:
-            self.chat_histories[chat_uuid] = []
-        return self.chat_histories[chat_uuid]
+    async def _get_or_create_history(self, chat_uuid: str) -> List[Dict[str, str]]:
+        """
+        Retrieves the chat history for a given UUID, reloading it if it was spilled, or creates it.
+        Concurrent calls for a chat share one reload, so no caller appends to a copy that is then replaced.
+        """
+        while True:
+            history = self.chat_histories.get(chat_uuid)
+            if history is not None:
+                return history
+            loading = self._loading_histories.get(chat_uuid)
+            if loading is None:
+                loading = asyncio.ensure_future(self._load_history(chat_uuid))
+                self._loading_histories[chat_uuid] = loading
+                loading.add_done_callback(lambda task: self._on_history_loaded(chat_uuid, task))
+            # Loops in case the reloaded history was evicted again before this caller got it
+            await asyncio.shield(loading)
 
-    def add_message_to_history(self, chat_uuid: str, message: Dict[str, str]):
-        """Adds a message to the chat history without generating a response."""
-        history = self._get_or_create_history(chat_uuid)
+    async def _load_history(self, chat_uuid: str) -> List[Dict[str, str]]:
+        spilling = self._spilling_histories.get(chat_uuid)
+        if spilling is not None:
+            await asyncio.wait([spilling])
+        store = get_session_store()
+        if store is None:
+            return []
+        return await asyncio.to_thread(store.load_history, chat_uuid) or []
+
+    def _on_history_loaded(self, chat_uuid: str, task: asyncio.Future):
+        del self._loading_histories[chat_uuid]
+        if task.cancelled():
+            return
+        if task.exception() is not None:
+            logging.error(f"Failed to reload the history of chat {chat_uuid}: {task.exception()}")
+            return
+        self.chat_histories.put(chat_uuid, task.result())
+
+    def _spill_history(self, chat_uuid: str, history: List[Dict[str, str]]):
+        store = get_session_store()
+        if store is None:
+            logging.warning(f"Evicting chat {chat_uuid} without a session store; its history is lost.")
+            return
+        task = asyncio.ensure_future(asyncio.to_thread(store.save_history, chat_uuid, list(history)))
+        self._spilling_histories[chat_uuid] = task
+        task.add_done_callback(lambda task: self._on_history_spilled(chat_uuid, task))
+
+    def _on_history_spilled(self, chat_uuid: str, task: asyncio.Future):
+        if self._spilling_histories.get(chat_uuid) is task:
+            del self._spilling_histories[chat_uuid]
+        if not task.cancelled() and task.exception() is not None:
+            logging.error(f"Failed to spill the history of chat {chat_uuid}: {task.exception()}")
+
+    async def _append_history(self, chat_uuid: str, message: Dict[str, str]) -> List[Dict[str, str]]:
+        # Looked up on every append: the history may have been spilled and reloaded meanwhile
+        history = await self._get_or_create_history(chat_uuid)
         history.append(message)
+        self.chat_histories.refresh(chat_uuid)
+        return history
+
+    async def add_message_to_history(self, chat_uuid: str, message: Dict[str, str]):
+        """Adds a message to the chat history without generating a response."""
+        await self._append_history(chat_uuid, message)
 
     async def get_response(self, chat_uuid: str, user_query: str, model: str) -> str:
         """
         Handles a single user query, gets a model response, and updates history.
         """
-        history = self._get_or_create_history(chat_uuid)
-        history.append({"role": "user", "content": user_query})
+        # Start embedding the query first, so retrieval overlaps with the rest of prompt construction
+        self.context_manager.prefetch_query(chat_uuid, user_query)
+        history = await self._append_history(chat_uuid, {"role": "user", "content": user_query})
 
         system_prompt = await self.context_manager.build_system_prompt(
             chat_uuid=chat_uuid,
             user_query=user_query,
             chat_history=history,
-            rag_top_k=3
+            rag_top_k=3,
+            model=model,
         )
 
         assistant_response = await chat_completions(
@@ -45,25 +127,98 @@ class ChatClient:
             user_prompt=user_query
         )
 
-        history.append({"role": "assistant", "content": assistant_response})
+        await self._record_exchange(chat_uuid, user_query, assistant_response)
+        return assistant_response
+
+    async def get_response_stream(self, chat_uuid: str, user_query: str, model: str) -> AsyncIterator[str]:
+        """
+        Like get_response, but yields the model response as token deltas.
+        History and the RAG index are updated once the stream completes.
+        """
+        # Start embedding the query first, so retrieval overlaps with the rest of prompt construction
+        self.context_manager.prefetch_query(chat_uuid, user_query)
+        history = await self._append_history(chat_uuid, {"role": "user", "content": user_query})
+
+        system_prompt = await self.context_manager.build_system_prompt(
+            chat_uuid=chat_uuid,
+            user_query=user_query,
+            chat_history=history,
+            rag_top_k=3,
+            model=model,
+        )
+
+        parts: List[str] = []
+        async for delta in chat_completions_stream(
+            model=model,
+            system_prompt=system_prompt,
+            user_prompt=user_query
+        ):
+            parts.append(delta)
+            yield delta
+
+        await self._record_exchange(chat_uuid, user_query, "".join(parts).strip())
+
+    async def _record_exchange(self, chat_uuid: str, user_query: str, assistant_response: str):
+        """Appends the assistant reply to history and schedules indexing of the exchange for RAG."""
+        await self._append_history(chat_uuid, {"role": "assistant", "content": assistant_response})
         
-        # Add the latest exchange to the RAG index for future reference
-        await self.context_manager.add_messages(
+        # Add the latest exchange to the RAG index for future reference. The
+        # response doesn't wait for it: the exchange is in the dialogue history anyway.
+        self.context_manager.add_messages_in_background(
             chat_uuid,
             [
                 {"role": "user", "content": user_query},
                 {"role": "assistant", "content": assistant_response},
             ]
         )
-        return assistant_response
 
-    async def add_document(self, chat_uuid: str, document_content: str):
+    async def add_document(self, chat_uuid: str, document_content: str, key: Optional[str] = None):
         """
         Adds a document to the RAG context of a specific chat session
-        without generating a response.
+        without generating a response. Sessions adding a document under the
+        same `key` share its vectors (see ChatSession.add_shared_document).
         """
         # We add the document with a 'system' role to distinguish it in the RAG store
-        await self.context_manager.add_messages(
+        await self.context_manager.add_document(
             chat_uuid,
-            [{"role": "system", "content": f"Reference document:\n{document_content}"}]
-        ) 
\ No newline at end of file
+            f"system: Reference document:\n{document_content}",
+            key=key,
+        )
+
+    def close_chat(self, chat_uuid: str):
+        """Forgets a chat's history and releases its RAG context."""
+        self.chat_histories.pop(chat_uuid)
+        self.context_manager.remove_session(chat_uuid)
+
+    async def wait_for_background(self):
+        """Waits for exchanges still being indexed in the background."""
+        await self.context_manager.wait_for_background()
+
+    async def persist_all(self):
+        """Writes every cached history and RAG session to the session store, e.g. on shutdown."""
+        await asyncio.gather(*self._spilling_histories.values(), return_exceptions=True)
+        store = get_session_store()
+        if store is not None:
+            for chat_uuid, history in self.chat_histories.items():
+                await asyncio.to_thread(store.save_history, chat_uuid, list(history))
+        await self.context_manager.snapshot_all()
+
+    def memory_stats(self) -> Dict[str, Any]:
+        """Estimated memory per chat (RAG context and history) and in total, in bytes."""
+        rag = self.context_manager.memory_stats()
+        history_sizes = self.chat_histories.sizes()
+        return {
+            "sessions": {
+                chat_uuid: {
+                    "rag_bytes": rag["sessions"].get(chat_uuid, 0),
+                    "history_bytes": history_sizes.get(chat_uuid, 0),
+                }
+                for chat_uuid in rag["sessions"].keys() | history_sizes.keys()
+            },
+            "rag": {key: value for key, value in rag.items() if key != "sessions"},
+            "history": {
+                "total_bytes": self.chat_histories.total_bytes,
+                "max_bytes": self.chat_histories.max_bytes,
+                "evictions": self.chat_histories.evictions,
+            },
+        } 
\ No newline at end of file
@@ -0,0 +1,182 @@
+import asyncio
+import re
+from concurrent.futures import ThreadPoolExecutor
+from os import getenv
+from typing import AsyncIterator, Iterator, List, Optional, Tuple
+
+_FENCE = re.compile(r"^\s*(```|~~~)")
+_HEADING = re.compile(r"^#{1,6}\s")
+# Fallback separators for blocks longer than a chunk, coarsest first. Each piece keeps its separator.
+_PIECE_PATTERNS = [re.compile(r"(?<=\n)"), re.compile(r"(?<=[.!?])\s+"), re.compile(r"(?<= )")]
+
+_END = object()
+
+
+class MarkdownChunker:
+    """
+    Splits markdown into chunks of at most `chunk_size` characters along its
+    structure: sections start new chunks, and paragraphs, lists, tables and
+    fenced code blocks are kept whole when they fit. Longer blocks fall back to
+    lines, sentences, words and finally fixed-size cuts. Consecutive chunks
+    share up to `chunk_overlap` characters of whole pieces.
+
+    Instances are stateless and shared by all sessions; `stream` runs the split
+    on a worker thread (from `executor`, or a shared pool) and yields chunks in
+    batches as they are produced.
+    """
+
+    def __init__(self, chunk_size: int, chunk_overlap: int, executor: Optional[ThreadPoolExecutor] = None):
+        if chunk_overlap >= chunk_size:
+            raise ValueError("chunk_overlap must be smaller than chunk_size")
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.executor = executor
+
+    def split_text(self, text: str) -> List[str]:
+        return list(self.iter_chunks(text))
+
+    def iter_chunks(self, text: str) -> Iterator[str]:
+        for chunk in self._iter_chunks(text):
+            if chunk:
+                yield chunk
+
+    def _iter_chunks(self, text: str) -> Iterator[str]:
+        # Units are (separator before, text); a chunk is their concatenation without the first separator
+        current: List[Tuple[str, str]] = []
+        size = 0
+        for is_heading, block in self._blocks(text):
+            # Start sections in a new chunk unless the current one is still small
+            if is_heading and size >= self.chunk_size // 4:
+                yield self._join(current)
+                current, size = [], 0
+            for unit in self._units(block):
+                unit_size = len(unit[1]) + (len(unit[0]) if current else 0)
+                if current and size + unit_size > self.chunk_size:
+                    yield self._join(current)
+                    current, size = self._overlap(current, len(unit[1]) + len(unit[0]))
+                    unit_size = len(unit[1]) + (len(unit[0]) if current else 0)
+                current.append(unit)
+                size += unit_size
+        if current:
+            yield self._join(current)
+
+    async def stream(self, text: str, batch_size: int = 32) -> AsyncIterator[List[str]]:
+        """Splits `text` off the event loop, yielding batches of up to `batch_size` chunks as they are ready."""
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue()
+
+        def produce():
+            try:
+                batch: List[str] = []
+                for chunk in self.iter_chunks(text):
+                    batch.append(chunk)
+                    if len(batch) >= batch_size:
+                        loop.call_soon_threadsafe(queue.put_nowait, batch)
+                        batch = []
+                if batch:
+                    loop.call_soon_threadsafe(queue.put_nowait, batch)
+                loop.call_soon_threadsafe(queue.put_nowait, _END)
+            except BaseException as e:
+                loop.call_soon_threadsafe(queue.put_nowait, e)
+
+        producer = loop.run_in_executor(self.executor or chunker_executor(), produce)
+        try:
+            while True:
+                item = await queue.get()
+                if item is _END:
+                    break
+                if isinstance(item, BaseException):
+                    raise item
+                yield item
+        finally:
+            await producer
+
+    def _blocks(self, text: str) -> Iterator[Tuple[bool, str]]:
+        """Yields (is_heading, block) for headings, fenced code blocks and blank-line separated paragraphs."""
+        lines: List[str] = []
+        in_fence = False
+        for line in text.splitlines():
+            if in_fence:
+                lines.append(line)
+                if _FENCE.match(line):
+                    in_fence = False
+                    yield False, "\n".join(lines)
+                    lines = []
+            elif _FENCE.match(line):
+                if lines:
+                    yield False, "\n".join(lines)
+                lines, in_fence = [line], True
+            elif _HEADING.match(line):
+                if lines:
+                    yield False, "\n".join(lines)
+                    lines = []
+                yield True, line
+            elif not line.strip():
+                if lines:
+                    yield False, "\n".join(lines)
+                    lines = []
+            else:
+                lines.append(line)
+        if lines:
+            yield False, "\n".join(lines)
+
+    def _units(self, block: str) -> Iterator[Tuple[str, str]]:
+        if len(block) <= self.chunk_size:
+            yield "\n\n", block
+            return
+        for i, piece in enumerate(self._pieces(block, 0)):
+            yield ("\n\n" if i == 0 else ""), piece
+
+    def _pieces(self, text: str, level: int) -> Iterator[str]:
+        """Splits an oversized block with progressively finer separators, keeping each separator."""
+        if len(text) <= self.chunk_size:
+            yield text
+            return
+        if level == len(_PIECE_PATTERNS):
+            for start in range(0, len(text), self.chunk_size):
+                yield text[start:start + self.chunk_size]
+            return
+        pattern = _PIECE_PATTERNS[level]
+        position = 0
+        for match in pattern.finditer(text):
+            if match.end() > position:
+                yield from self._pieces(text[position:match.end()], level + 1)
+                position = match.end()
+        if position < len(text):
+            yield from self._pieces(text[position:], level + 1)
+
+    def _overlap(self, units: List[Tuple[str, str]], next_size: int) -> Tuple[List[Tuple[str, str]], int]:
+        """
+        Trailing whole units of the previous chunk that fit in chunk_overlap, to
+        start the next one. Units are only kept while the next unit (of
+        `next_size` characters with its separator) still fits after them.
+        """
+        kept: List[Tuple[str, str]] = []
+        size = 0
+        limit = min(self.chunk_overlap, self.chunk_size - next_size)
+        for separator, text in reversed(units):
+            if size + len(text) + len(separator) > limit:
+                break
+            kept.append((separator, text))
+            size += len(text) + len(separator)
+        kept.reverse()
+        if kept:
+            # The first unit of a chunk has no separator before it
+            size -= len(kept[0][0])
+        return kept, size
+
+    @staticmethod
+    def _join(units: List[Tuple[str, str]]) -> str:
+        return "".join(separator + text if i else text for i, (separator, text) in enumerate(units)).strip()
+
+
+_CHUNKER_EXECUTOR: List[Optional[ThreadPoolExecutor]] = [None]
+
+
+def chunker_executor() -> ThreadPoolExecutor:
+    """Thread pool shared by all chunkers, sized by the CHUNKER_THREADS env var (default 2)."""
+    if _CHUNKER_EXECUTOR[0] is None:
+        _CHUNKER_EXECUTOR[0] = ThreadPoolExecutor(
+            max_workers=int(getenv("CHUNKER_THREADS", "2")), thread_name_prefix="chunker"
+        )
+    return _CHUNKER_EXECUTOR[0]
@@ -1,57 +1,531 @@
 import asyncio
+import contextlib
 import logging
-from typing import List, Dict, Optional, Any
+from os import getenv
+from typing import List, Dict, Optional, Any, AsyncIterator, Callable, Set, Tuple
 
-import faiss
 import numpy as np
-from langchain.text_splitter import RecursiveCharacterTextSplitter
 
-from . import embeddings, rerank
+from . import chat_completions, embeddings, rerank
+from .bm25 import BM25Index, reciprocal_rank_fusion
+from .chunking import MarkdownChunker, chunker_executor
+from .history import HistoryWindow, format_message
+from .session_cache import SessionCache
+from .segments import SegmentRegistry, VectorSegment, document_key, get_segment_registry
+from .session_store import SessionStore, get_session_store
+from .tools import context_limit, estimate_tokens
+from .vector_index import VectorIndex
 
 # --- Constants ---
 EMBEDDING_DIM = 1024  # As per VoyageAI documentation for voyage-3 model
 RAG_CHUNK_SIZE = 4096    # Characters
 RAG_CHUNK_OVERLAP = 256  # Characters
+RAG_EMBED_BATCH_CHUNKS = 32  # Chunks sent to the embedder while splitting continues
+RETRIEVAL_MODES = ("vector", "hybrid")
+
+# (vector index, keyword index, chunks, number of chunks visible to the read) per searchable source
+ReadView = List[Tuple[VectorIndex, BM25Index, List[str], int]]
+
+_CHUNKER: List[Optional[MarkdownChunker]] = [None]
+
+
+def get_chunker() -> MarkdownChunker:
+    """The chunker shared by all sessions; it splits on the shared chunker thread pool."""
+    if _CHUNKER[0] is None:
+        _CHUNKER[0] = MarkdownChunker(RAG_CHUNK_SIZE, RAG_CHUNK_OVERLAP, executor=chunker_executor())
+    return _CHUNKER[0]
+
+PROMPT_TEMPLATE = """You are an expert AI assistant.
+Use the following context from previous discussions and documents to answer the user's question.
+If the context is not relevant, ignore it and rely on the dialogue history.
+
+--- RELEVANT CONTEXT (RAG) ---
+{rag_context}
+------------------------------
+
+--- DIALOGUE HISTORY ---
+{chat_history}
+----------------------
+"""
+PROMPT_BASE_TOKENS = estimate_tokens(PROMPT_TEMPLATE.format(rag_context="", chat_history=""))
+# Separator between retrieved chunks in the prompt
+RAG_SEPARATOR = "\n\n"
 
 class ChatSession:
     """
     Manages the context for a single, isolated chat session.
-    This includes an in-memory FAISS index for RAG.
+    This includes an in-memory FAISS index for RAG, which switches from exact to
+    approximate search as it grows (see VectorIndex).
+
+    The private index holds only this chat's messages. Documents are added as
+    shared segments, keyed by content (or an explicit key such as a paper hash)
+    and refcounted in a SegmentRegistry, so sessions loading the same paper hold
+    one copy of its vectors and chunks. Searches merge results across both.
+
+    "vector" retrieval mode (env RAG_RETRIEVAL_MODE, the default) always
+    reranks vector results. In the opt-in "hybrid" mode a local BM25 index over
+    the same chunks is searched while the query is embedded, and keyword and
+    vector rankings are fused. The remote reranker is only called when they
+    disagree: when less than `rerank_agreement` (env RAG_RERANK_AGREEMENT,
+    default 0.6) of their top-k results overlap. Hybrid is faster but returns
+    somewhat different results, and stays opt-in until its relevance has been
+    evaluated.
+
+    Once the history window holds more than `summary_trigger_tokens` (env
+    SUMMARY_TRIGGER_TOKENS, default 8000; 0 disables), older turns are
+    summarized in the background by `summary_model` (env SUMMARY_MODEL, default
+    grok-3-mini), keeping the newest SUMMARY_KEEP_TOKENS (default 3000)
+    verbatim. The summary replaces those turns in the prompt; their raw text
+    stays searchable through RAG.
+
+    With a SessionStore, every addition is appended to the session's log on disk
+    and compacted into a snapshot every `store.snapshot_every` entries. Store
+    writes run on a worker thread, one at a time and in order.
+
+    Texts are embedded concurrently but written through a per-session queue:
+    embeddings that complete in the same event loop iteration are applied with a
+    single `index.add`, and chunk ids are assigned at that point, so vectors,
+    chunk texts and BM25 documents always share ids. Retrieval searches a read
+    view fixed when it starts and ignores chunks written while it awaits.
     """
 
-    def __init__(self):
-        self.text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=RAG_CHUNK_SIZE,
-            chunk_overlap=RAG_CHUNK_OVERLAP,
-            length_function=len,
-        )
+    def __init__(
+        self,
+        index_strategy: Optional[str] = None,
+        registry: Optional[SegmentRegistry] = None,
+        chat_uuid: Optional[str] = None,
+        store: Optional[SessionStore] = None,
+        retrieval_mode: Optional[str] = None,
+        rerank_agreement: Optional[float] = None,
+        summary_model: Optional[str] = None,
+        summary_trigger_tokens: Optional[int] = None,
+        summary_keep_tokens: Optional[int] = None,
+    ):
+        if summary_model is None:
+            summary_model = getenv("SUMMARY_MODEL", "grok-3-mini")
+        if summary_trigger_tokens is None:
+            summary_trigger_tokens = int(getenv("SUMMARY_TRIGGER_TOKENS", "8000"))
+        if summary_keep_tokens is None:
+            summary_keep_tokens = int(getenv("SUMMARY_KEEP_TOKENS", "3000"))
+        if retrieval_mode is None:
+            retrieval_mode = getenv("RAG_RETRIEVAL_MODE", "vector")
+        if rerank_agreement is None:
+            rerank_agreement = float(getenv("RAG_RERANK_AGREEMENT", "0.6"))
+        if retrieval_mode not in RETRIEVAL_MODES:
+            raise ValueError(f"Unknown retrieval mode '{retrieval_mode}', expected one of {RETRIEVAL_MODES}")
+        self.index_strategy = index_strategy
         # The FAISS index for vector search
-        self.index = faiss.IndexFlatL2(EMBEDDING_DIM)
+        self.index = VectorIndex(EMBEDDING_DIM, strategy=index_strategy)
         # A simple list to store the actual text chunks corresponding to the vectors
         self.chunk_store: List[str] = []
+        # Keyword index over chunk_store, with the same ids as the FAISS index
+        self.bm25 = BM25Index()
+        # Embedded texts waiting to be written by _flush_writes, with futures resolved once written
+        self._pending_writes: List[Tuple[List[str], np.ndarray, asyncio.Future]] = []
+        self.retrieval_mode = retrieval_mode
+        self.rerank_agreement = rerank_agreement
+        self.registry = registry if registry is not None else get_segment_registry()
+        self.shared_segments: Dict[str, VectorSegment] = {}
+        self.chat_uuid = chat_uuid
+        self.store = store
+        self._log_entries = 0
+        # Serializes store writes, so log entries keep their order and snapshots see no concurrent append
+        self._store_lock = asyncio.Lock()
+        # Log appends started by _flush_writes
+        self._logging: Set[asyncio.Future] = set()
+        # Number of in-flight operations; busy sessions are never evicted
+        self.active = 0
+        # Query embeddings started ahead of retrieval, with the timer that drops them if unused
+        # (see prefetch_query_embedding)
+        self._prefetched_queries: Dict[str, Tuple[asyncio.Future, asyncio.TimerHandle]] = {}
+        self.prefetch_ttl = float(getenv("RAG_PREFETCH_TTL_SECONDS", "30"))
+        # Token-counted dialogue history, maintained incrementally across turns
+        self.history_window = HistoryWindow()
+        self.summary_model = summary_model
+        self.summary_trigger_tokens = summary_trigger_tokens
+        self.summary_keep_tokens = summary_keep_tokens
+        self._compaction_task: Optional[asyncio.Future] = None
+        # Segments recorded on disk but not attached yet (restored sessions attach them on first use)
+        self._pending_segment_keys: List[str] = []
 
-    async def add_text(self, text: str):
+    @classmethod
+    def restore(
+        cls,
+        chat_uuid: str,
+        store: SessionStore,
+        index_strategy: Optional[str] = None,
+        registry: Optional[SegmentRegistry] = None,
+    ) -> "ChatSession":
+        """
+        Rebuilds a session from its snapshot and append log without re-embedding
+        anything. Blocking; run it on a thread.
+        """
+        session = cls(index_strategy, registry, chat_uuid, store)
+        session.index, session.chunk_store, session._pending_segment_keys, session._log_entries = (
+            store.load_session(chat_uuid, EMBEDDING_DIM, strategy=index_strategy)
+        )
+        session.bm25.add(session.chunk_store)
+        return session
+
+    @property
+    def ntotal(self) -> int:
+        """Number of vectors searchable from this session, private and shared."""
+        return self.index.ntotal + sum(segment.index.ntotal for segment in self.shared_segments.values())
+
+    def memory_bytes(self) -> int:
+        """
+        Estimated memory held by the session: its private index and chunk texts,
+        plus an equal share of each attached shared segment.
+        """
+        private = (
+            self.index.memory_bytes()
+            + self.bm25.memory_bytes()
+            + sum(len(chunk) for chunk in self.chunk_store)
+            + self.history_window.memory_bytes()
+        )
+        shared = sum(
+            segment.memory_bytes() // max(segment.refcount, 1) for segment in self.shared_segments.values()
+        )
+        return private + shared
+
+    async def _split_and_embed(self, text: str) -> Tuple[List[str], Optional[np.ndarray]]:
         """
-        Splits text into chunks, creates embeddings, and adds them to the FAISS index.
+        Splits text off the event loop and embeds each batch of chunks as soon as
+        it is produced, so embedding overlaps with splitting the rest.
         """
-        chunks = self.text_splitter.split_text(text)
+        chunks: List[str] = []
+        pending: List[asyncio.Future] = []
+        try:
+            async for batch in get_chunker().stream(text, batch_size=RAG_EMBED_BATCH_CHUNKS):
+                chunks.extend(batch)
+                pending.append(asyncio.ensure_future(embeddings(model="voyage-3", texts=batch)))
+            batches = await asyncio.gather(*pending)
+        except BaseException:
+            for future in pending:
+                future.cancel()
+            raise
         if not chunks:
             logging.warning(f"Text splitting resulted in 0 chunks for a text of length {len(text)}. Not adding to RAG index.")
+            return chunks, None
+        return chunks, np.array([vector for batch in batches for vector in batch], dtype="float32")
+
+    async def add_text(self, text: str):
+        """
+        Splits text into chunks, creates embeddings, and adds them to the session's private FAISS index.
+        """
+        chunks, vectors = await self._split_and_embed(text)
+        if vectors is None:
+            return
+
+        loop = asyncio.get_running_loop()
+        written = loop.create_future()
+        self._pending_writes.append((chunks, vectors, written))
+        if len(self._pending_writes) == 1:
+            # Runs after the other tasks woken in this iteration, so their writes join the batch
+            loop.call_soon(self._flush_writes)
+        await written
+
+    def _flush_writes(self):
+        """Writes all pending chunks with one index insert, assigning consecutive ids."""
+        writes, self._pending_writes = self._pending_writes, []
+        if not writes:
+            return
+        chunks = [chunk for write_chunks, _, _ in writes for chunk in write_chunks]
+        vectors = np.concatenate([write_vectors for _, write_vectors, _ in writes])
+        try:
+            start = len(self.chunk_store)
+            if self.index.ntotal != start or len(self.bm25) != start:
+                raise RuntimeError(
+                    f"RAG index of chat {self.chat_uuid} is out of sync: {self.index.ntotal} vectors, "
+                    f"{len(self.bm25)} keyword documents, {start} chunks"
+                )
+            self.index.add(vectors)
+            self.chunk_store.extend(chunks)
+            self.bm25.add(chunks)
+            logging.info(
+                f"Added {len(chunks)} chunks from {len(writes)} texts to the RAG index. "
+                f"Total chunks in store: {self.index.ntotal}"
+            )
+        except Exception as e:
+            self._resolve_writes(writes, e)
             return
+        if self.store is None:
+            self._resolve_writes(writes)
+            return
+        # The chunks are searchable now; their writers wait until they are on disk too
+        task = asyncio.ensure_future(self._log(self.store.append_chunks, self.chat_uuid, start, chunks, vectors))
+        self._logging.add(task)
+        task.add_done_callback(lambda task: self._on_logged(task, writes))
+
+    def _on_logged(self, task: asyncio.Future, writes: List[Tuple[List[str], np.ndarray, asyncio.Future]]):
+        self._logging.discard(task)
+        error = task.exception() if not task.cancelled() else asyncio.CancelledError()
+        self._resolve_writes(writes, error)
+
+    @staticmethod
+    def _resolve_writes(writes: List[Tuple[List[str], np.ndarray, asyncio.Future]], error: Optional[BaseException] = None):
+        for _, _, written in writes:
+            if written.done():
+                continue
+            if error is not None:
+                written.set_exception(error)
+            else:
+                written.set_result(None)
+
+    async def add_shared_document(self, text: str, key: Optional[str] = None):
+        """
+        Attaches the shared segment for a document, building it if no session holds it yet.
+        `key` defaults to the SHA-256 of the text.
+        """
+        if key is None:
+            key = document_key(text)
+        await self._attach_pending_segments()
+        if key in self.shared_segments:
+            return
+
+        async def build() -> VectorSegment:
+            if self.store is not None:
+                saved = await asyncio.to_thread(
+                    self.store.load_segment, key, EMBEDDING_DIM, strategy=self.index_strategy
+                )
+                if saved is not None:
+                    return saved
+            chunks, vectors = await self._split_and_embed(text)
+            index = VectorIndex(EMBEDDING_DIM, strategy=self.index_strategy)
+            if vectors is not None:
+                index.add(vectors)
+            logging.info(f"Built shared segment {key[:12]} with {len(chunks)} chunks.")
+            segment = VectorSegment(key, index, chunks)
+            if self.store is not None:
+                await asyncio.to_thread(self.store.save_segment, segment)
+            return segment
+
+        segment = await self.registry.acquire(key, build)
+        if key in self.shared_segments:
+            # Attached concurrently by another call on this session
+            self.registry.release(segment)
+            return
+        self.shared_segments[key] = segment
+        logging.info(f"Attached shared segment {key[:12]} (refcount {segment.refcount}).")
+        if self.store is not None:
+            await self._log(self.store.append_segment, self.chat_uuid, key)
+
+    async def _attach_pending_segments(self):
+        """Attaches the shared segments of a restored session, loading them from disk if needed."""
+        while self._pending_segment_keys:
+            key = self._pending_segment_keys.pop(0)
+            if key in self.shared_segments:
+                continue
+
+            async def load(key: str = key) -> VectorSegment:
+                segment = await asyncio.to_thread(
+                    self.store.load_segment, key, EMBEDDING_DIM, strategy=self.index_strategy
+                )
+                if segment is None:
+                    raise FileNotFoundError(f"Shared segment {key} is missing from the session store")
+                return segment
+
+            try:
+                segment = await self.registry.acquire(key, load)
+            except FileNotFoundError as e:
+                logging.error(f"Could not restore a shared segment for chat {self.chat_uuid}: {e}")
+                continue
+            if key in self.shared_segments:
+                self.registry.release(segment)
+            else:
+                self.shared_segments[key] = segment
+
+    async def _log(self, append: Callable[..., None], *args):
+        """
+        Runs a store log append on a worker thread after the session's earlier
+        store writes, snapshotting every `store.snapshot_every` entries.
+        """
+        async with self._store_lock:
+            await asyncio.to_thread(append, *args)
+            self._log_entries += 1
+            if self._log_entries >= self.store.snapshot_every:
+                await self._write_snapshot()
+
+    async def snapshot(self):
+        """Writes the session's private index, chunks and segment keys to the store, compacting its log."""
+        if self.store is None:
+            return
+        async with self._store_lock:
+            await self._write_snapshot()
+
+    async def _write_snapshot(self):
+        # Copied on the event loop, so writes applied while the thread runs don't tear the snapshot.
+        # Their log entries wait for the store lock and are skipped on replay if the snapshot has them.
+        index_data = self.index.serialize()
+        chunks = self.chunk_store[:self.index.ntotal]
+        segment_keys = list(self.shared_segments) + self._pending_segment_keys
+        await asyncio.to_thread(self.store.write_snapshot, self.chat_uuid, index_data, chunks, segment_keys)
+        self._log_entries = 0
+
+    @property
+    def has_unsnapshotted_changes(self) -> bool:
+        return self._log_entries > 0
+
+    def close(self):
+        """Releases the session's shared segments and drops pending query prefetches."""
+        for query in list(self._prefetched_queries):
+            self._drop_prefetch(query)
+        for segment in self.shared_segments.values():
+            self.registry.release(segment)
+        self.shared_segments.clear()
+
+    def _read_view(self) -> ReadView:
+        """
+        The private index and shared segments with the number of chunks each holds
+        now. Chunk lists only grow, so ids below that count stay valid for the
+        whole retrieval while writes continue.
+        """
+        view = [(self.index, self.bm25, self.chunk_store, len(self.chunk_store))]
+        view += [
+            (segment.index, segment.bm25, segment.chunks, len(segment.chunks))
+            for segment in self.shared_segments.values()
+        ]
+        return view
+
+    def _search(self, query_embedding: np.ndarray, search_k: int, view: ReadView) -> List[str]:
+        """Top `search_k` chunks of `view` merged by score across the private index and shared segments."""
+        scored: List[Tuple[float, str]] = []
+        for index, _, chunks, visible in view:
+            if visible == 0:
+                continue
+            # Chunks written after the view was taken are skipped, so ask for enough to make up for them
+            k = min(search_k + index.ntotal - visible, index.ntotal)
+            scores, ids = index.search(query_embedding, k=k)
+            # Approximate indexes may return -1 when they find fewer than k neighbours
+            scored.extend((float(score), chunks[i]) for score, i in zip(scores[0], ids[0]) if 0 <= i < visible)
+
+        scored.sort(key=lambda item: item[0], reverse=self.index.higher_is_better)
+        return [chunk for _, chunk in scored[:search_k]]
 
-        embedding_vectors = await embeddings(model="voyage-3", texts=chunks)
-        self.index.add(np.array(embedding_vectors, dtype="float32"))
-        self.chunk_store.extend(chunks)
-        logging.info(f"Added {len(chunks)} chunks to the RAG index. Total chunks in store: {self.index.ntotal}")
+    def _keyword_search(self, query: str, search_k: int, view: ReadView) -> List[str]:
+        """Top `search_k` chunks of `view` by BM25 score across the private index and shared segments."""
+        scored: List[Tuple[float, str]] = []
+        for _, bm25, chunks, visible in view:
+            k = search_k + len(bm25) - visible
+            scored.extend((score, chunks[i]) for score, i in bm25.search(query, k) if i < visible)
+        scored.sort(key=lambda item: item[0], reverse=True)
+        return [chunk for _, chunk in scored[:search_k]]
+
+    def _needs_rerank(self, vector_docs: List[str], keyword_docs: List[str], top_k: int) -> bool:
+        """True when vector and keyword top-k results overlap too little to trust the fused order."""
+        agreement = len(set(vector_docs[:top_k]) & set(keyword_docs[:top_k])) / top_k
+        logging.info(f"Hybrid retrieval: vector/keyword top-{top_k} agreement {agreement:.2f}.")
+        return agreement < self.rerank_agreement
+
+    @property
+    def may_have_context(self) -> bool:
+        """False only when retrieval is certain to find nothing."""
+        return self.ntotal > 0 or bool(self._pending_segment_keys)
+
+    def prefetch_query_embedding(self, query: str):
+        """
+        Starts embedding a query now, so a later retrieve_rag_context for it
+        doesn't wait as long. The session is pinned against eviction until the
+        embedding is used, or dropped after `prefetch_ttl` seconds (env
+        RAG_PREFETCH_TTL_SECONDS, default 30) if retrieval never asks for it.
+        """
+        if query in self._prefetched_queries:
+            return
+        task = asyncio.ensure_future(embeddings(model="voyage-3", texts=[query]))
+        timer = asyncio.get_running_loop().call_later(self.prefetch_ttl, self._drop_prefetch, query)
+        self._prefetched_queries[query] = (task, timer)
+        self.active += 1
+
+    def _take_prefetch(self, query: str) -> Optional[asyncio.Future]:
+        """Removes a prefetched query embedding, unpinning the session, and returns its task."""
+        entry = self._prefetched_queries.pop(query, None)
+        if entry is None:
+            return None
+        task, timer = entry
+        timer.cancel()
+        self.active -= 1
+        return task
+
+    def _drop_prefetch(self, query: str):
+        task = self._take_prefetch(query)
+        if task is not None:
+            task.cancel()
+            # Retrieve the exception of a failed prefetch so it isn't reported as never retrieved
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+            logging.info(f"Dropped an unused query embedding prefetch for chat {self.chat_uuid}.")
+
+    def maybe_compact_history(self):
+        """Starts summarizing older turns in the background if the history window has grown past the trigger."""
+        if (
+            self.summary_trigger_tokens <= 0
+            or self._compaction_task is not None
+            or self.history_window.total_tokens <= self.summary_trigger_tokens
+        ):
+            return
+        self._compaction_task = asyncio.ensure_future(self._compact_history())
+
+    async def _compact_history(self):
+        window = self.history_window
+        generation = window.generation
+        end_index, lines = window.compaction_candidates(self.summary_keep_tokens)
+        if not lines:
+            self._compaction_task = None
+            return
+
+        user_prompt = (
+            (f"Summary so far:\n{window.summary}\n\n" if window.summary else "")
+            + "New conversation turns:\n" + "\n".join(lines)
+            + "\n\nWrite an updated summary of the whole conversation so far."
+        )
+        self.active += 1
+        try:
+            summary = await chat_completions(
+                model=self.summary_model,
+                system_prompt=(
+                    "You compress chat transcripts. Write a concise summary that keeps every fact, "
+                    "decision, open question, name, number and reference the user may rely on later."
+                ),
+                user_prompt=user_prompt,
+            )
+            if window.apply_summary(summary, end_index, generation):
+                logging.info(
+                    f"Summarized {len(lines)} older messages for chat {self.chat_uuid}: "
+                    f"{window.summarized_tokens} history tokens now take {window.summary_tokens}."
+                )
+        except Exception as e:
+            logging.error(f"Failed to summarize the history of chat {self.chat_uuid}: {e}")
+        finally:
+            self.active -= 1
+            self._compaction_task = None
 
     async def retrieve_rag_context(self, query: str, top_k: int = 5) -> str:
         """
         Retrieves the most relevant text chunks from the session's history using RAG.
         """
-        if self.index.ntotal == 0:
-            return ""
+        return RAG_SEPARATOR.join(await self.retrieve_rag_chunks(query, top_k))
+
+    async def retrieve_rag_chunks(self, query: str, top_k: int = 5) -> List[str]:
+        """
+        Like retrieve_rag_context, but returns the chunks, most relevant first.
+        """
+        embedding_task = self._take_prefetch(query)
+        await self._attach_pending_segments()
+        view = self._read_view()
+        visible_total = sum(visible for _, _, _, visible in view)
+        if visible_total == 0:
+            if embedding_task is not None:
+                embedding_task.cancel()
+            return []
 
-        query_embedding_list = await embeddings(model="voyage-3", texts=[query])
+        hybrid = self.retrieval_mode == "hybrid"
+        # Search more candidates to give the reranker a better selection
+        search_k = min(top_k * 5, visible_total)
+
+        # Run the keyword search while the query embedding is in flight
+        if embedding_task is None:
+            embedding_task = asyncio.ensure_future(embeddings(model="voyage-3", texts=[query]))
+        keyword_docs = self._keyword_search(query, search_k, view) if hybrid else []
+        query_embedding_list = await embedding_task
         query_embedding = np.array(query_embedding_list, dtype="float32")
 
         # --- Defensive check to prevent FAISS segfault ---
@@ -62,24 +536,28 @@ class ChatSession:
                 f"Please check the 'EMBEDDING_DIM' constant in context.py against the 'voyage-3' model's output."
             )
             # Return empty context instead of crashing the server
-            return ""
+            return []
         # --- End of defensive check ---
 
-        # Search more candidates to give the reranker a better selection
-        search_k = min(top_k * 5, self.index.ntotal)
-        logging.info(f"FAISS search: Performing search for {search_k} nearest neighbors.")
-        _, indices = self.index.search(query_embedding, k=search_k)
-        
-        candidate_docs = [self.chunk_store[i] for i in indices[0]]
-        logging.info(f"FAISS search: Found {len(candidate_docs)} initial candidates.")
+        logging.info(f"FAISS search: Performing search for {search_k} nearest neighbors across {len(view)} indexes.")
+        vector_docs = self._search(query_embedding, search_k, view)
+        logging.info(f"FAISS search: Found {len(vector_docs)} initial candidates.")
+        if hybrid:
+            candidate_docs = reciprocal_rank_fusion([vector_docs, keyword_docs])[:search_k]
+        else:
+            candidate_docs = vector_docs
 
         if not candidate_docs:
-            return ""
+            return []
 
         # If we have fewer candidates than top_k, no need to rerank.
         if len(candidate_docs) <= top_k:
             logging.info(f"Skipping reranker as the number of candidates ({len(candidate_docs)}) is not greater than top_k ({top_k}).")
-            return "\n\n".join(candidate_docs)
+            return candidate_docs
+
+        if hybrid and not self._needs_rerank(vector_docs, keyword_docs, top_k):
+            logging.info("Skipping reranker as vector and keyword results agree.")
+            return candidate_docs[:top_k]
 
         # Rerank the documents to improve relevance
         logging.info(f"Reranking: Sending {len(candidate_docs)} candidates to the reranker.")
@@ -96,44 +574,198 @@ class ChatSession:
         final_docs = [candidate_docs[result["index"]] for result in reranked_results]
         logging.info(f"Reranking: Received {len(final_docs)} documents after reranking.")
 
-        return "\n\n".join(final_docs)
+        return final_docs
 
 
 class ChatContextManager:
     """
     Manages multiple ChatSession instances, each identified by a unique chat_uuid.
     Provides a high-level interface to build the final prompt context.
+
+    When a session store is configured (see configure_session_store), sessions
+    are persisted and restored lazily on first access, so startup cost does not
+    depend on how many sessions exist on disk.
+
+    Sessions are kept in a SessionCache bounded by `max_bytes` (env
+    SESSION_CACHE_MAX_BYTES, default 2 GiB) and evicted after `idle_ttl`
+    seconds without use (env SESSION_IDLE_TTL_SECONDS, default 3600). Evicted
+    sessions are snapshotted to the store and reloaded on their next access.
+    Restores and spills run on worker threads; a session being spilled is
+    reloaded only once its snapshot is written.
     """
     
-    def __init__(self):
-        self.sessions: Dict[str, ChatSession] = {}
+    def __init__(self, max_bytes: Optional[int] = None, idle_ttl: Optional[float] = None):
+        if max_bytes is None:
+            max_bytes = int(getenv("SESSION_CACHE_MAX_BYTES", str(2 * 1024**3)))
+        if idle_ttl is None:
+            idle_ttl = float(getenv("SESSION_IDLE_TTL_SECONDS", "3600"))
+        self.sessions: SessionCache[ChatSession] = SessionCache(
+            max_bytes=max_bytes,
+            idle_ttl=idle_ttl,
+            size_of=ChatSession.memory_bytes,
+            on_evict=self._spill_session,
+            can_evict=lambda session: session.active == 0,
+        )
+        self._background_tasks: Set[asyncio.Future] = set()
+        # Sessions being restored and evicted sessions being snapshotted, by chat UUID
+        self._loading: Dict[str, asyncio.Future] = {}
+        self._spilling: Dict[str, asyncio.Future] = {}
 
-    def _get_or_create_session(self, chat_uuid: str) -> ChatSession:
+    async def _get_or_create_session(self, chat_uuid: str) -> ChatSession:
         """
-        Retrieves an existing session or creates a new one if it doesn't exist.
+        Retrieves an existing session, restores it from disk, or creates a new one.
+        Concurrent calls for a chat share one restore.
         """
-        if chat_uuid not in self.sessions:
-            self.sessions[chat_uuid] = ChatSession()
-        return self.sessions[chat_uuid]
+        while True:
+            session = self.sessions.get(chat_uuid)
+            if session is not None:
+                return session
+            loading = self._loading.get(chat_uuid)
+            if loading is None:
+                loading = asyncio.ensure_future(self._load_session(chat_uuid))
+                self._loading[chat_uuid] = loading
+                loading.add_done_callback(lambda task: self._on_session_loaded(chat_uuid, task))
+            # Shielded: a cancelled caller must not cancel the restore other callers wait for.
+            # Loops in case the restored session was evicted again before this caller could pin it.
+            await asyncio.shield(loading)
+
+    async def _load_session(self, chat_uuid: str) -> ChatSession:
+        spilling = self._spilling.get(chat_uuid)
+        if spilling is not None:
+            await asyncio.wait([spilling])
+        store = get_session_store()
+        if store is not None and await asyncio.to_thread(store.has_session, chat_uuid):
+            return await asyncio.to_thread(ChatSession.restore, chat_uuid, store)
+        return ChatSession(chat_uuid=chat_uuid, store=store)
+
+    def _on_session_loaded(self, chat_uuid: str, task: asyncio.Future):
+        del self._loading[chat_uuid]
+        if task.cancelled():
+            return
+        if task.exception() is not None:
+            logging.error(f"Failed to restore chat session {chat_uuid}: {task.exception()}")
+            return
+        self.sessions.put(chat_uuid, task.result())
+
+    @contextlib.asynccontextmanager
+    async def _use_session(self, chat_uuid: str) -> AsyncIterator[ChatSession]:
+        """Pins a session against eviction while an operation runs, then re-measures it."""
+        session = await self._get_or_create_session(chat_uuid)
+        session.active += 1
+        try:
+            yield session
+        finally:
+            session.active -= 1
+            self.sessions.refresh(chat_uuid)
+
+    def _spill_session(self, chat_uuid: str, session: ChatSession):
+        if session.store is None:
+            logging.warning(f"Evicting chat {chat_uuid} without a session store; its RAG context is lost.")
+        elif session.has_unsnapshotted_changes:
+            # The log alone is durable; a snapshot makes the reload a cheap mmap
+            task = asyncio.ensure_future(session.snapshot())
+            self._spilling[chat_uuid] = task
+            task.add_done_callback(lambda task: self._on_spilled(chat_uuid, session, task))
+            return
+        session.close()
+
+    def _on_spilled(self, chat_uuid: str, session: ChatSession, task: asyncio.Future):
+        if self._spilling.get(chat_uuid) is task:
+            del self._spilling[chat_uuid]
+        session.close()
+        if not task.cancelled() and task.exception() is not None:
+            logging.error(f"Failed to snapshot evicted chat {chat_uuid}: {task.exception()}")
 
     async def add_messages(self, chat_uuid: str, messages: List[Dict[str, str]]):
         """
         Adds a list of messages to the specified chat's RAG context.
         """
-        session = self._get_or_create_session(chat_uuid)
-        # Process all messages concurrently for efficiency
-        tasks = []
-        for message in messages:
-            text_to_add = f"{message.get('role', 'user')}: {message.get('content', '')}"
-            tasks.append(session.add_text(text_to_add))
-        await asyncio.gather(*tasks)
+        async with self._use_session(chat_uuid) as session:
+            # Embed all messages concurrently; the session's write queue batches their inserts
+            tasks = []
+            for message in messages:
+                tasks.append(session.add_text(format_message(message)))
+            await asyncio.gather(*tasks)
 
-    async def add_document(self, chat_uuid: str, document_content: str):
+    def add_messages_in_background(self, chat_uuid: str, messages: List[Dict[str, str]]):
         """
-        Adds raw document content to the specified chat's RAG context.
+        Schedules add_messages without waiting for the embeddings, e.g. to index
+        an exchange after its response has been returned.
         """
-        session = self._get_or_create_session(chat_uuid)
-        await session.add_text(document_content)
+        task = asyncio.ensure_future(self.add_messages(chat_uuid, messages))
+        self._background_tasks.add(task)
+        task.add_done_callback(self._on_background_done)
+
+    def _on_background_done(self, task: asyncio.Future):
+        self._background_tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logging.error(f"Failed to add messages to the RAG index: {task.exception()}")
+
+    async def wait_for_background(self):
+        """Waits for messages scheduled with add_messages_in_background to be indexed."""
+        while self._background_tasks:
+            await asyncio.gather(*self._background_tasks, return_exceptions=True)
+
+    def prefetch_query(self, chat_uuid: str, user_query: str):
+        """
+        Starts embedding a user query as soon as it arrives, so build_system_prompt
+        overlaps retrieval with the rest of the turn's bookkeeping. Sessions not in
+        memory are skipped rather than restored here.
+        """
+        session = self.sessions.get(chat_uuid)
+        if session is not None and session.may_have_context:
+            session.prefetch_query_embedding(user_query)
+
+    async def add_document(self, chat_uuid: str, document_content: str, key: Optional[str] = None):
+        """
+        Adds document content to the specified chat's RAG context as a shared segment.
+        Sessions adding the same `key` (e.g. a paper hash) share one copy of its vectors.
+        """
+        async with self._use_session(chat_uuid) as session:
+            await session.add_shared_document(document_content, key=key)
+
+    def remove_session(self, chat_uuid: str):
+        """
+        Drops a chat session, releasing its references to shared segments and deleting its persisted state.
+        """
+        session = self.sessions.pop(chat_uuid)
+        if session is not None:
+            session.close()
+        store = get_session_store()
+        if store is not None:
+            store.delete_session(chat_uuid)
+
+    async def snapshot_all(self):
+        """
+        Snapshots every session with logged changes, so the next startup replays no logs.
+        """
+        await asyncio.gather(*self._spilling.values(), return_exceptions=True)
+        for session in self.sessions.values():
+            if session.has_unsnapshotted_changes:
+                await session.snapshot()
+
+    def history_stats(self) -> Dict[str, Dict[str, int]]:
+        """Per-session history window and summarization figures, including estimated tokens saved."""
+        return {
+            chat_uuid: {
+                "window_messages": len(session.history_window.lines),
+                "window_tokens": session.history_window.total_tokens,
+                "summarized_messages": session.history_window.summarized_messages,
+                "summary_tokens": session.history_window.summary_tokens,
+                "tokens_saved": session.history_window.tokens_saved,
+            }
+            for chat_uuid, session in self.sessions.items()
+        }
+
+    def memory_stats(self) -> Dict[str, Any]:
+        """Per-session and total RAG memory estimates in bytes, with the cache budget."""
+        return {
+            "sessions": self.sessions.sizes(),
+            "total_bytes": self.sessions.total_bytes,
+            "max_bytes": self.sessions.max_bytes,
+            "shared_segment_bytes": get_segment_registry().memory_bytes(),
+            "evictions": self.sessions.evictions,
+        }
 
     async def build_system_prompt(
         self,
@@ -141,50 +773,52 @@ class ChatContextManager:
         user_query: str,
         chat_history: List[Dict[str, str]],
         rag_top_k: int = 3,
-        max_context_chars: int = 128000,
+        model: Optional[str] = None,
+        max_context_tokens: Optional[int] = None,
     ) -> str:
         """
         Builds the final system prompt by combining RAG context and chat history.
-        Ensures the total length does not exceed the specified maximum.
-        """
-        session = self._get_or_create_session(chat_uuid)
 
-        # 1. Retrieve RAG context
-        rag_context = await session.retrieve_rag_context(user_query, top_k=rag_top_k)
+        The prompt is sized in (estimated) tokens: at most `max_context_tokens`
+        (env PROMPT_MAX_TOKENS, default 32000) and never more than `model`'s
+        context window minus the user prompt and RESPONSE_RESERVE_TOKENS (default
+        4096). History takes priority and is cut at message boundaries; RAG
+        chunks fill the remaining space.
+        """
+        if max_context_tokens is None:
+            max_context_tokens = int(getenv("PROMPT_MAX_TOKENS", "32000"))
+        reserve_tokens = int(getenv("RESPONSE_RESERVE_TOKENS", "4096"))
+        budget = min(max_context_tokens, context_limit(model) - reserve_tokens - estimate_tokens(user_query))
+        budget -= PROMPT_BASE_TOKENS
 
-        # 2. Format chat history
-        history_str = "\n".join(
-            [f"{msg.get('role', 'user')}: {msg.get('content', '')}" for msg in chat_history]
-        )
+        async with self._use_session(chat_uuid) as session:
+            # 1. Update the history window while the query embedding is in flight
+            session.history_window.sync(chat_history)
+            session.maybe_compact_history()
 
-        # 3. Assemble the prompt template
-        prompt_template = """You are an expert AI assistant.
-Use the following context from previous discussions and documents to answer the user's question.
-If the context is not relevant, ignore it and rely on the dialogue history.
+            # 2. Retrieve RAG context
+            rag_chunks = await session.retrieve_rag_chunks(user_query, top_k=rag_top_k)
 
---- RELEVANT CONTEXT (RAG) ---
-{rag_context}
-------------------------------
+            # 3. Prioritize chat history, then RAG context
+            history_str, history_tokens = session.history_window.render(max(budget, 0))
 
---- DIALOGUE HISTORY ---
-{chat_history}
-----------------------
-"""
-
-        # 4. Fill the template and manage length
-        base_prompt_len = len(prompt_template.format(rag_context="", chat_history=""))
-        remaining_space = max_context_chars - base_prompt_len
-
-        # Prioritize chat history, then RAG context
-        if len(history_str) > remaining_space:
-            history_str = history_str[-remaining_space:] # Truncate from the beginning
-            rag_context = "" # No space left for RAG
-        else:
-            rag_space = remaining_space - len(history_str)
-            if len(rag_context) > rag_space:
-                rag_context = rag_context[:rag_space] # Truncate RAG context
-        
-        return prompt_template.format(
+        rag_context = self._fit_chunks(rag_chunks, budget - history_tokens)
+        return PROMPT_TEMPLATE.format(
             rag_context=rag_context,
             chat_history=history_str
-        ) 
\ No newline at end of file
+        )
+
+    @staticmethod
+    def _fit_chunks(chunks: List[str], budget: int) -> str:
+        """Joins whole chunks, most relevant first, while they fit in `budget` tokens."""
+        selected: List[str] = []
+        for chunk in chunks:
+            tokens = estimate_tokens(chunk) + 1
+            if tokens > budget:
+                if not selected and budget > 0:
+                    # Better a truncated best chunk than no context at all
+                    selected.append(chunk[:budget * 4])
+                break
+            selected.append(chunk)
+            budget -= tokens
+        return RAG_SEPARATOR.join(selected)
@@ -1,39 +1,364 @@
 import asyncio
 import base64
+import hashlib
 import logging
 import os
 import pathlib
-from typing import Optional
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterator, List, Optional, Tuple
 
 import aiohttp
+import ijson
+from aiohttp import web
 from dotenv import load_dotenv
 
 load_dotenv()
 
 DATALAB_API_KEY = os.getenv("DATALAB_API_KEY")
-DATALAB_API_BASE = "https://www.datalab.to/api/v1"
+DATALAB_API_BASE = os.getenv("DATALAB_API_BASE", "https://www.datalab.to/api/v1")
+# Bytes read from a response per parser step
+RESPONSE_CHUNK_BYTES = 64 * 1024
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
+class PollSchedule:
+    """
+    Delays between polls of a Datalab job's check URL.
+
+    The first poll waits for `first_poll_fraction` of the expected processing
+    time, estimated from the page count and the seconds per page observed on
+    previous jobs. Until `window_end` times the expected time, polls are then
+    `window_fraction` of it apart, and after that the delay grows by `factor`.
+    Delays are kept between `initial_delay` (env DATALAB_POLL_INITIAL_SECONDS,
+    default 0.5) and `max_delay` (env DATALAB_POLL_MAX_SECONDS, default 10).
+    Small papers are picked up quickly and large ones are not polled hundreds
+    of times.
+
+    Page counts are estimated from the file size until Datalab reports them;
+    both rates are exponential moving averages over completed jobs.
+    """
+
+    def __init__(
+        self,
+        initial_delay: Optional[float] = None,
+        max_delay: Optional[float] = None,
+        factor: float = 1.5,
+        first_poll_fraction: float = 0.7,
+        window_fraction: float = 0.1,
+        window_end: float = 1.5,
+        seconds_per_page: float = 1.0,
+        bytes_per_page: float = 100_000,
+        smoothing: float = 0.3,
+    ):
+        if initial_delay is None:
+            initial_delay = float(os.getenv("DATALAB_POLL_INITIAL_SECONDS", "0.5"))
+        if max_delay is None:
+            max_delay = float(os.getenv("DATALAB_POLL_MAX_SECONDS", "10"))
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        self.factor = factor
+        self.first_poll_fraction = first_poll_fraction
+        self.window_fraction = window_fraction
+        self.window_end = window_end
+        self.seconds_per_page = seconds_per_page
+        self.bytes_per_page = bytes_per_page
+        self.smoothing = smoothing
+
+    def estimate_pages(self, file_size: int, max_pages: int) -> int:
+        return max(1, min(max_pages, round(file_size / self.bytes_per_page)))
+
+    def expected_seconds(self, pages: int) -> float:
+        return pages * self.seconds_per_page
+
+    def delays(self, expected_seconds: float) -> Iterator[float]:
+        waited = max(self.initial_delay, self.first_poll_fraction * expected_seconds)
+        yield waited
+        delay = min(self.max_delay, max(self.initial_delay, self.window_fraction * expected_seconds))
+        while waited < self.window_end * expected_seconds:
+            yield delay
+            waited += delay
+        while True:
+            delay = min(self.max_delay, delay * self.factor)
+            yield delay
+
+    def observe(self, file_size: int, pages: int, elapsed: float):
+        """Updates the per-page rates from a completed job."""
+        if pages <= 0:
+            return
+        self.seconds_per_page += self.smoothing * (elapsed / pages - self.seconds_per_page)
+        self.bytes_per_page += self.smoothing * (file_size / pages - self.bytes_per_page)
+
+
+class DatalabCallbackReceiver:
+    """
+    Local HTTP endpoint for Datalab's completion webhook (configured in the
+    Datalab dashboard to point at `path` on this host). Jobs waiting in
+    process_pdf_with_datalab are woken when their request_id is posted, instead
+    of waiting for their next poll. Posts without the expected `secret` (env
+    DATALAB_WEBHOOK_SECRET) are rejected.
+
+    In case a callback is lost, jobs are still polled every `fallback_delay`
+    seconds (env DATALAB_CALLBACK_FALLBACK_SECONDS, default 60).
+    """
+
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        path: str = "/datalab/callback",
+        secret: Optional[str] = None,
+        fallback_delay: Optional[float] = None,
+    ):
+        if fallback_delay is None:
+            fallback_delay = float(os.getenv("DATALAB_CALLBACK_FALLBACK_SECONDS", "60"))
+        self.host = host
+        self.port = port
+        self.path = path
+        self.secret = secret
+        self.fallback_delay = fallback_delay
+        self._waiters: Dict[str, asyncio.Future] = {}
+        # Callbacks that arrived before their job was waited on, most recent last
+        self._completed: "OrderedDict[str, None]" = OrderedDict()
+        self._runner: Optional[web.AppRunner] = None
+        self.callbacks = 0
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_post(self.path, self._handle)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        logger.info(f"Listening for Datalab callbacks on {self.host}:{self.port}{self.path}")
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    def expect(self, request_id: str) -> asyncio.Future:
+        """A future resolved when Datalab reports `request_id` complete."""
+        future = asyncio.get_running_loop().create_future()
+        if request_id in self._completed:
+            del self._completed[request_id]
+            future.set_result(None)
+        else:
+            self._waiters[request_id] = future
+        return future
+
+    def discard(self, request_id: str):
+        self._waiters.pop(request_id, None)
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        try:
+            data = await request.json()
+        except ValueError:
+            return web.json_response({"error": "invalid JSON"}, status=400)
+        if self.secret and data.get("webhook_secret") != self.secret:
+            return web.json_response({"error": "invalid secret"}, status=403)
+        request_id = data.get("request_id")
+        if not request_id:
+            return web.json_response({"error": "missing request_id"}, status=400)
+        self.callbacks += 1
+        future = self._waiters.pop(request_id, None)
+        if future is None:
+            self._completed[request_id] = None
+            while len(self._completed) > 1000:
+                self._completed.popitem(last=False)
+        elif not future.done():
+            future.set_result(None)
+        return web.json_response({"success": True})
+
+
+class ImageWriter:
+    """
+    Decodes base64 images and writes them to `output_dir` on a thread pool,
+    with at most `workers` images (env DATALAB_IMAGE_WORKERS, default 4) being
+    decoded or written at once. `add` waits while all workers are busy, so
+    images are kept in memory only until their turn comes.
+
+    Images are deduplicated by a hash of their content: a repeat of an image
+    already seen (e.g. a logo on every page) is not written again, and
+    `rewrite_references` points the markdown at the first copy instead.
+    """
+
+    def __init__(self, output_dir: pathlib.Path, workers: Optional[int] = None):
+        if workers is None:
+            workers = int(os.getenv("DATALAB_IMAGE_WORKERS", "4"))
+        self.output_dir = output_dir
+        self._slots = asyncio.Semaphore(workers)
+        self._executor = image_executor()
+        self._pending: List[asyncio.Future] = []
+        self._by_digest: Dict[str, str] = {}
+        # Name of each duplicate image -> name of the copy that was written
+        self.duplicates: Dict[str, str] = {}
+        self.written = 0
+        self.failed = 0
+
+    async def add(self, name: str, data: str):
+        digest = hashlib.sha256(data.encode("ascii", "replace")).hexdigest()
+        original = self._by_digest.get(digest)
+        if original is not None:
+            self.duplicates[name] = original
+            return
+        self._by_digest[digest] = name
+        await self._slots.acquire()
+        future = asyncio.get_running_loop().run_in_executor(self._executor, self._save, name, data)
+        future.add_done_callback(lambda _: self._slots.release())
+        self._pending.append(future)
+
+    def _save(self, name: str, data: str) -> bool:
+        try:
+            (self.output_dir / name).write_bytes(base64.b64decode(data))
+            return True
+        except Exception as e:
+            logger.error(f"Failed to decode or save image {name}: {e}")
+            return False
+
+    async def finish(self):
+        """Waits until every image is written."""
+        for saved in await asyncio.gather(*self._pending):
+            if saved:
+                self.written += 1
+            else:
+                self.failed += 1
+        self._pending = []
+
+    def rewrite_references(self, markdown: str) -> str:
+        for name, original in self.duplicates.items():
+            markdown = markdown.replace(f"]({name})", f"]({original})")
+        return markdown
+
+
+async def _read_response(response: aiohttp.ClientResponse, images: Optional[ImageWriter] = None) -> dict:
+    """
+    Parses a Datalab JSON response incrementally as it is downloaded. The
+    top-level scalar fields (status, success, error, markdown, page_count, ...)
+    are returned; entries of the "images" object are handed to `images` one at
+    a time, so the base64 images never have to be in memory all at once.
+    Other nested fields are skipped.
+    """
+    data = {}
+    image_name = None
+    async for prefix, event, value in ijson.parse_async(response.content, buf_size=RESPONSE_CHUNK_BYTES, use_float=True):
+        if prefix == "images" and event == "map_key":
+            image_name = value
+        elif event == "string" and image_name is not None and prefix.startswith("images."):
+            if images is not None:
+                await images.add(image_name, value)
+            image_name = None
+        elif prefix and "." not in prefix and event in ("string", "number", "boolean", "null"):
+            data[prefix] = value
+    return data
+
+
+_POLL_SCHEDULE = PollSchedule()
+_CALLBACK_RECEIVER: List[Optional[DatalabCallbackReceiver]] = [None]
+_IMAGE_EXECUTOR: List[Optional[ThreadPoolExecutor]] = [None]
+
+
+def get_poll_schedule() -> PollSchedule:
+    """The schedule shared by all jobs, so processing rates learned on one apply to the next."""
+    return _POLL_SCHEDULE
+
+
+async def get_callback_receiver() -> Optional[DatalabCallbackReceiver]:
+    """The callback receiver, started on first use if DATALAB_CALLBACK_PORT is set, otherwise None."""
+    if _CALLBACK_RECEIVER[0] is None and os.getenv("DATALAB_CALLBACK_PORT"):
+        receiver = DatalabCallbackReceiver(
+            host=os.getenv("DATALAB_CALLBACK_HOST", "0.0.0.0"),
+            port=int(os.getenv("DATALAB_CALLBACK_PORT")),
+            path=os.getenv("DATALAB_CALLBACK_PATH", "/datalab/callback"),
+            secret=os.getenv("DATALAB_WEBHOOK_SECRET"),
+        )
+        await receiver.start()
+        _CALLBACK_RECEIVER[0] = receiver
+    return _CALLBACK_RECEIVER[0]
+
+
+def image_executor() -> ThreadPoolExecutor:
+    """Thread pool shared by all image writers, sized by the DATALAB_IMAGE_WORKERS env var (default 4)."""
+    if _IMAGE_EXECUTOR[0] is None:
+        _IMAGE_EXECUTOR[0] = ThreadPoolExecutor(
+            max_workers=int(os.getenv("DATALAB_IMAGE_WORKERS", "4")), thread_name_prefix="datalab-images"
+        )
+    return _IMAGE_EXECUTOR[0]
+
+
+async def _wait_for_result(
+    session: aiohttp.ClientSession,
+    check_url: str,
+    headers: Dict[str, str],
+    delays: Iterator[float],
+    timeout: float,
+    completion: Optional[asyncio.Future],
+    images: Optional[ImageWriter] = None,
+) -> Tuple[Optional[dict], int]:
+    """
+    Polls `check_url` after each of `delays` until the job is complete, or
+    earlier when `completion` (a callback) resolves. Returns the final response
+    (None on timeout) and the number of polls made; its images are passed to
+    `images` while it is being read.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    polls = 0
+    callback_pending = completion is not None
+    for delay in delays:
+        delay = min(delay, deadline - loop.time())
+        if delay < 0:
+            break
+        if callback_pending:
+            # Poll now if the callback arrives, otherwise after `delay` as a fallback
+            if not completion.done():
+                try:
+                    await asyncio.wait_for(asyncio.shield(completion), delay)
+                except asyncio.TimeoutError:
+                    pass
+            callback_pending = not completion.done()
+        else:
+            await asyncio.sleep(delay)
+        polls += 1
+        async with session.get(check_url, headers=headers) as check_response:
+            check_response.raise_for_status()
+            data = await _read_response(check_response, images)
+        if data.get("status") == "complete":
+            return data, polls
+        logger.info(f"Still processing... (poll {polls})")
+    return None, polls
+
+
 async def process_pdf_with_datalab(
     pdf_path: str | pathlib.Path,
     output_dir: str | pathlib.Path,
     use_llm: bool = True,
     max_pages: int = 100,
     api_key: Optional[str] = None,
+    schedule: Optional[PollSchedule] = None,
+    callback_receiver: Optional[DatalabCallbackReceiver] = None,
+    timeout: Optional[float] = None,
 ) -> Optional[str]:
     """
     Processes a PDF file using the Datalab.to Marker API, saves the output,
     and returns the markdown content.
 
+    Results are polled on an adaptive schedule (see PollSchedule). With a
+    callback receiver (by default one is started when DATALAB_CALLBACK_PORT is
+    set), the job is fetched as soon as Datalab's webhook reports it complete
+    and polling only runs every `fallback_delay` seconds in case it is lost.
+
     Args:
         pdf_path: Path to the input PDF file.
         output_dir: Path to the directory where output markdown and images will be saved.
         use_llm: Whether to use an LLM for enhanced accuracy. Defaults to True.
         max_pages: Maximum number of pages to process. Defaults to 100.
         api_key: Datalab.to API key. If not provided, it's read from the DATALAB_API_KEY env var.
+        schedule: Polling schedule. Defaults to the shared one returned by get_poll_schedule().
+        callback_receiver: Webhook receiver to wait on. Defaults to get_callback_receiver().
+        timeout: Seconds to wait for processing. Defaults to the DATALAB_TIMEOUT_SECONDS env var, or 1500.
 
     Returns:
         The markdown content of the processed PDF, or None if an error occurred.
@@ -52,70 +377,82 @@ async def process_pdf_with_datalab(
 
     output_dir.mkdir(parents=True, exist_ok=True)
 
+    if schedule is None:
+        schedule = get_poll_schedule()
+    if callback_receiver is None:
+        callback_receiver = await get_callback_receiver()
+    if timeout is None:
+        timeout = float(os.getenv("DATALAB_TIMEOUT_SECONDS", "1500"))
+    file_size = pdf_path.stat().st_size
+
     url = f"{DATALAB_API_BASE}/marker"
     headers = {"X-Api-Key": api_key}
 
-    form_data = aiohttp.FormData()
-    form_data.add_field('file', pdf_path.read_bytes(), filename=pdf_path.name, content_type='application/pdf')
-    form_data.add_field('use_llm', str(use_llm))
-    form_data.add_field('max_pages', str(max_pages))
-    form_data.add_field('output_format', 'markdown')
-
     async with aiohttp.ClientSession() as session:
         try:
-            # Initial request
+            # Initial request. The file object is streamed from disk in chunks rather than read into memory.
             logger.info(f"Uploading {pdf_path.name} to Datalab.to for processing...")
-            async with session.post(url, data=form_data, headers=headers) as response:
-                response.raise_for_status()
-                initial_data = await response.json()
+            with open(pdf_path, 'rb') as pdf_file:
+                form_data = aiohttp.FormData()
+                form_data.add_field('file', pdf_file, filename=pdf_path.name, content_type='application/pdf')
+                form_data.add_field('use_llm', str(use_llm))
+                form_data.add_field('max_pages', str(max_pages))
+                form_data.add_field('output_format', 'markdown')
+                async with session.post(url, data=form_data, headers=headers) as response:
+                    response.raise_for_status()
+                    initial_data = await response.json()
 
             if not initial_data.get("success"):
                 logger.error(f"API request failed: {initial_data.get('error')}")
                 return None
 
             check_url = initial_data["request_check_url"]
-            logger.info(f"File uploaded. Polling for results at {check_url}")
-
-            # Polling for results
-            max_polls = 300
-            for i in range(max_polls):
-                await asyncio.sleep(5)  # Wait 5 seconds between polls
-                async with session.get(check_url, headers=headers) as check_response:
-                    check_response.raise_for_status()
-                    data = await check_response.json()
-
-                    if data.get("status") == "complete":
-                        logger.info("Processing complete.")
-                        if data.get("success"):
-                            markdown_content = data.get("markdown", "")
-                            
-                            # Save markdown to file
-                            article_path = output_dir / "article.md"
-                            article_path.write_text(markdown_content, encoding='utf-8')
-                            logger.info(f"Markdown content saved to {article_path}")
-
-                            # Save images
-                            images = data.get("images", {})
-                            if images:
-                                logger.info(f"Saving {len(images)} images...")
-                                for img_name, img_data in images.items():
-                                    img_path = output_dir / img_name
-                                    try:
-                                        img_bytes = base64.b64decode(img_data)
-                                        img_path.write_bytes(img_bytes)
-                                        logger.info(f"Saved image {img_name}")
-                                    except Exception as e:
-                                        logger.error(f"Failed to decode or save image {img_name}: {e}")
-                            
-                            return markdown_content
-                        else:
-                            logger.error(f"Processing failed: {data.get('error')}")
-                            return None
-                    else:
-                        logger.info(f"Still processing... (poll {i+1}/{max_polls})")
-
-            logger.error("Polling timed out after 300 attempts.")
-            return None
+            request_id = initial_data.get("request_id")
+            started = time.monotonic()
+
+            completion = None
+            if callback_receiver is not None and request_id:
+                completion = callback_receiver.expect(request_id)
+                # The webhook does the waiting; polls are only a fallback if it is lost
+                delays = iter(lambda: callback_receiver.fallback_delay, None)
+                logger.info(f"File uploaded. Waiting for the completion callback of {request_id}")
+            else:
+                pages = schedule.estimate_pages(file_size, max_pages)
+                delays = schedule.delays(schedule.expected_seconds(pages))
+                logger.info(f"File uploaded (~{pages} pages). Polling for results at {check_url}")
+
+            # Images are decoded and written in the background while the result is downloaded
+            images = ImageWriter(output_dir)
+            try:
+                data, polls = await _wait_for_result(session, check_url, headers, delays, timeout, completion, images)
+            finally:
+                if completion is not None:
+                    callback_receiver.discard(request_id)
+                await images.finish()
+            elapsed = time.monotonic() - started
+            if data is None:
+                logger.error(f"Processing timed out after {elapsed:.0f}s and {polls} polls.")
+                return None
+
+            logger.info(f"Processing complete after {elapsed:.1f}s and {polls} polls.")
+            if data.get("success"):
+                if data.get("page_count"):
+                    schedule.observe(file_size, int(data["page_count"]), elapsed)
+                markdown_content = images.rewrite_references(data.get("markdown", ""))
+
+                # Save markdown to file
+                article_path = output_dir / "article.md"
+                article_path.write_text(markdown_content, encoding='utf-8')
+                logger.info(f"Markdown content saved to {article_path}")
+
+                if images.written or images.failed or images.duplicates:
+                    logger.info(f"Saved {images.written} images ({len(images.duplicates)} duplicates skipped, "
+                                f"{images.failed} failed)")
+
+                return markdown_content
+            else:
+                logger.error(f"Processing failed: {data.get('error')}")
+                return None
 
         except aiohttp.ClientError as e:
             logger.error(f"An HTTP error occurred: {e}")
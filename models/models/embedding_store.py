@@ -0,0 +1,201 @@
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import pathlib
+import re
+import threading
+from typing import Dict, List, Optional, Sequence, Union
+
+import numpy as np
+
+KEY_BYTES = 65  # 64 hex chars of SHA-256 + newline
+SUPPORTED_DTYPES = ("float16", "float32")
+
+
+def text_key(text: str) -> str:
+    """Content address of a text: SHA-256 hex digest of its UTF-8 bytes."""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class _ModelShard:
+    """
+    Append-only vector file for one model, memory-mapped for reads.
+
+    Layout inside the store directory:
+      <model>.meta.json  - {"dim": ..., "dtype": ...}
+      <model>.vec        - raw row-major vectors, one row per key
+      <model>.keys       - one SHA-256 hex digest per line, same order as rows
+
+    Reads and writes are serialized by a thread lock within the process (they
+    run on worker threads) and by a file lock across processes.
+    """
+
+    def __init__(self, directory: pathlib.Path, model: str, dtype: str):
+        safe_name = re.sub(r"[^A-Za-z0-9._-]", "_", model)
+        self.meta_path = directory / f"{safe_name}.meta.json"
+        self.vec_path = directory / f"{safe_name}.vec"
+        self.keys_path = directory / f"{safe_name}.keys"
+        self.dtype = np.dtype(dtype)
+        self.dim: Optional[int] = None
+        self.rows: Dict[str, int] = {}
+        self._keys_offset = 0
+        self._mmap: Optional[np.memmap] = None
+        self._lock = threading.Lock()
+
+        self._load_meta()
+
+    def _load_meta(self):
+        """Picks up the dimension and dtype once the shard has been created (by any process)."""
+        if self.dim is None and self.meta_path.exists():
+            meta = json.loads(self.meta_path.read_text())
+            self.dim = int(meta["dim"])
+            self.dtype = np.dtype(meta["dtype"])
+
+    def _sync_keys(self):
+        """Reads keys appended since the last sync (possibly by another process)."""
+        if not self.keys_path.exists() or self.dim is None:
+            return
+        row_bytes = self.dim * self.dtype.itemsize
+        complete_rows = self.vec_path.stat().st_size // row_bytes if self.vec_path.exists() else 0
+        with open(self.keys_path, "rb") as f:
+            f.seek(self._keys_offset)
+            data = f.read()
+        usable = len(data) - len(data) % KEY_BYTES
+        for start in range(0, usable, KEY_BYTES):
+            row = (self._keys_offset + start) // KEY_BYTES
+            if row >= complete_rows:
+                # A writer crashed between the vector and key append; ignore the tail.
+                usable = start
+                break
+            self.rows[data[start:start + 64].decode("ascii")] = row
+        self._keys_offset += usable
+
+    def _vectors(self, min_rows: int) -> np.ndarray:
+        """Returns a memory map covering at least `min_rows` rows."""
+        if self._mmap is None or self._mmap.shape[0] < min_rows:
+            total_rows = self.vec_path.stat().st_size // (self.dim * self.dtype.itemsize)
+            self._mmap = np.memmap(self.vec_path, dtype=self.dtype, mode="r", shape=(total_rows, self.dim))
+        return self._mmap
+
+    def get(self, keys: Sequence[str]) -> List[Optional[np.ndarray]]:
+        with self._lock:
+            return self._get(keys)
+
+    def _get(self, keys: Sequence[str]) -> List[Optional[np.ndarray]]:
+        if any(key not in self.rows for key in keys):
+            # Other processes may have appended since we last looked.
+            self._load_meta()
+            self._sync_keys()
+        rows = [self.rows.get(key) for key in keys]
+        found = [row for row in rows if row is not None]
+        if not found:
+            return [None] * len(keys)
+        vectors = self._vectors(max(found) + 1)
+        return [None if row is None else np.asarray(vectors[row], dtype=np.float32) for row in rows]
+
+    def put(self, keys: Sequence[str], vectors: np.ndarray):
+        with self._lock:
+            self._put(keys, vectors)
+
+    def _put(self, keys: Sequence[str], vectors: np.ndarray):
+        with open(self.keys_path, "ab") as keys_file:
+            # Serialize writers across processes; rows and keys must stay aligned.
+            fcntl.flock(keys_file, fcntl.LOCK_EX)
+            try:
+                self._load_meta()
+                if self.dim is None:
+                    self.dim = int(vectors.shape[1])
+                    self.meta_path.write_text(json.dumps({"dim": self.dim, "dtype": self.dtype.name}))
+                if vectors.shape[1] != self.dim:
+                    raise ValueError(f"Embedding dimension {vectors.shape[1]} does not match store dimension {self.dim}")
+
+                self._sync_keys()
+                new = [(key, vector) for key, vector in zip(keys, vectors) if key not in self.rows]
+                if not new:
+                    return
+                row_bytes = self.dim * self.dtype.itemsize
+                first_row = self._keys_offset // KEY_BYTES
+                block = np.ascontiguousarray(np.stack([vector for _, vector in new]), dtype=self.dtype)
+                with open(self.vec_path, "r+b" if self.vec_path.exists() else "wb") as vec_file:
+                    vec_file.seek(first_row * row_bytes)
+                    vec_file.write(block.tobytes())
+                    vec_file.truncate()
+                # Drop any torn key line left by a crashed writer before appending.
+                keys_file.truncate(self._keys_offset)
+                keys_file.write("".join(f"{key}\n" for key, _ in new).encode("ascii"))
+                keys_file.flush()
+                for offset, (key, _) in enumerate(new):
+                    self.rows[key] = first_row + offset
+                self._keys_offset += len(new) * KEY_BYTES
+            finally:
+                fcntl.flock(keys_file, fcntl.LOCK_UN)
+
+
+class EmbeddingStore:
+    """
+    Persistent, content-addressed embedding cache keyed by (model, SHA-256 of text).
+    Vectors are stored as float16 or float32 in memory-mapped files, so identical
+    chunks are embedded once no matter which session or process asks for them.
+    Methods block on file locks and disk I/O; call them from a worker thread.
+    """
+
+    def __init__(self, directory: Union[str, pathlib.Path], dtype: str = "float16"):
+        if dtype not in SUPPORTED_DTYPES:
+            raise ValueError(f"Unsupported embedding store dtype '{dtype}', expected one of {SUPPORTED_DTYPES}")
+        self.directory = pathlib.Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.dtype = dtype
+        self._shards: Dict[str, _ModelShard] = {}
+        self._shards_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _shard(self, model: str) -> _ModelShard:
+        with self._shards_lock:
+            if model not in self._shards:
+                self._shards[model] = _ModelShard(self.directory, model, self.dtype)
+            return self._shards[model]
+
+    def get_many(self, model: str, texts: Sequence[str]) -> List[Optional[List[float]]]:
+        """Returns the cached vector for each text, or None where it is not cached."""
+        vectors = self._shard(model).get([text_key(text) for text in texts])
+        found = sum(vector is not None for vector in vectors)
+        with self._shards_lock:
+            self.hits += found
+            self.misses += len(texts) - found
+        return [None if vector is None else vector.tolist() for vector in vectors]
+
+    def put_many(self, model: str, texts: Sequence[str], vectors: Sequence[Sequence[float]]):
+        """Stores vectors for texts. Texts that are already cached are skipped."""
+        if not texts:
+            return
+        try:
+            self._shard(model).put([text_key(text) for text in texts], np.asarray(vectors, dtype=np.float32))
+        except (OSError, ValueError) as e:
+            logging.warning(f"Failed to write embeddings for {model} to the store: {e}")
+
+
+_EMBEDDING_STORE: List[Optional[EmbeddingStore]] = [None]
+
+
+def configure_embedding_store(directory: Union[str, pathlib.Path, None], dtype: Optional[str] = None) -> Optional[EmbeddingStore]:
+    """
+    Enables the persistent embedding store at `directory` (or disables it when None).
+    The dtype defaults to the EMBEDDING_CACHE_DTYPE env var, or float16.
+    """
+    if directory is None:
+        _EMBEDDING_STORE[0] = None
+        return None
+    dtype = dtype or os.getenv("EMBEDDING_CACHE_DTYPE", "float16")
+    _EMBEDDING_STORE[0] = EmbeddingStore(directory, dtype=dtype)
+    logging.info(f"Embedding store configured: {directory} ({dtype})")
+    return _EMBEDDING_STORE[0]
+
+
+def get_embedding_store() -> Optional[EmbeddingStore]:
+    """Returns the configured store, creating it from EMBEDDING_CACHE_DIR on first use."""
+    if _EMBEDDING_STORE[0] is None and os.getenv("EMBEDDING_CACHE_DIR"):
+        configure_embedding_store(os.getenv("EMBEDDING_CACHE_DIR"))
+    return _EMBEDDING_STORE[0]
@@ -0,0 +1,148 @@
+from collections import deque
+from os import getenv
+from typing import Deque, Dict, List, Optional, Tuple
+
+from .tools import estimate_tokens
+
+SUMMARY_PREFIX = "summary of the earlier conversation: "
+
+
+def format_message(message: Dict[str, str]) -> str:
+    return f"{message.get('role', 'user')}: {message.get('content', '')}"
+
+
+class HistoryWindow:
+    """
+    Rolling window over a chat's dialogue history, formatted and token-counted
+    incrementally.
+
+    `sync` consumes only the messages appended since the previous call, and the
+    oldest messages fall out once the window holds more than `max_tokens` (env
+    PROMPT_MAX_TOKENS, default 32000). `render` selects whole messages from the
+    newest backwards, so prompt building costs O(window), not O(history).
+
+    Older messages can be replaced by a summary (see `compaction_candidates` and
+    `apply_summary`), which `render` puts first. `tokens_saved` accumulates, per
+    rendered prompt, the history tokens the summary avoided sending.
+    """
+
+    def __init__(self, max_tokens: Optional[int] = None):
+        if max_tokens is None:
+            max_tokens = int(getenv("PROMPT_MAX_TOKENS", "32000"))
+        self.max_tokens = max_tokens
+        self.lines: Deque[str] = deque()
+        self.line_tokens: Deque[int] = deque()
+        self.total_tokens = 0
+        self._chars = 0
+        # Messages consumed from the history list, and the last of them, to detect rewrites
+        self.consumed = 0
+        self._last: Optional[Dict[str, str]] = None
+        # History index of the message in lines[0]
+        self.first_index = 0
+        # Bumped on reset, so summaries of a previous history are discarded
+        self.generation = 0
+        self.dropped = 0
+
+        self.summary = ""
+        self.summary_tokens = 0
+        self.summarized_messages = 0
+        self.summarized_tokens = 0
+        self.tokens_saved = 0
+
+    def sync(self, history: List[Dict[str, str]]):
+        """Brings the window up to date with `history`, which normally only grows between calls."""
+        if self.consumed and (len(history) < self.consumed or history[self.consumed - 1] is not self._last):
+            # A different or rewritten history (e.g. reloaded after eviction): start over
+            self.reset()
+        for i in range(self.consumed, len(history)):
+            line = format_message(history[i])
+            # +1 for the newline joining it to the next message
+            tokens = estimate_tokens(line) + 1
+            self.lines.append(line)
+            self.line_tokens.append(tokens)
+            self.total_tokens += tokens
+            self._chars += len(line)
+        if len(history) > self.consumed:
+            self.consumed = len(history)
+            self._last = history[-1]
+        while self.total_tokens > self.max_tokens and len(self.lines) > 1:
+            self._pop_oldest()
+            self.dropped += 1
+
+    def _pop_oldest(self) -> int:
+        self._chars -= len(self.lines.popleft())
+        tokens = self.line_tokens.popleft()
+        self.total_tokens -= tokens
+        self.first_index += 1
+        return tokens
+
+    def reset(self):
+        self.lines.clear()
+        self.line_tokens.clear()
+        self.total_tokens = 0
+        self._chars = 0
+        self.consumed = 0
+        self._last = None
+        self.first_index = 0
+        self.generation += 1
+        self.dropped = 0
+        self.summary = ""
+        self.summary_tokens = 0
+        self.summarized_messages = 0
+        self.summarized_tokens = 0
+
+    def compaction_candidates(self, keep_tokens: int) -> Tuple[int, List[str]]:
+        """
+        The oldest messages that can be summarized while keeping at least
+        `keep_tokens` of recent messages verbatim. Returns the history index
+        just past them, and their formatted lines.
+        """
+        lines: List[str] = []
+        remaining = self.total_tokens
+        for line, tokens in zip(self.lines, self.line_tokens):
+            if remaining - tokens < keep_tokens:
+                break
+            lines.append(line)
+            remaining -= tokens
+        return self.first_index + len(lines), lines
+
+    def apply_summary(self, summary: str, end_index: int, generation: int) -> bool:
+        """
+        Replaces the messages before history index `end_index` with `summary`
+        (which must cover any previous summary too). Returns False if the window
+        was reset since the candidates were taken.
+        """
+        if generation != self.generation:
+            return False
+        while self.lines and self.first_index < end_index:
+            self.summarized_tokens += self._pop_oldest()
+            self.summarized_messages += 1
+        self.summary = summary
+        self.summary_tokens = estimate_tokens(SUMMARY_PREFIX + summary) + 1
+        return True
+
+    def render(self, max_tokens: int) -> Tuple[str, int]:
+        """
+        Returns the summary (if any) and the newest whole messages that fit in
+        `max_tokens`, oldest first, and their token count. Messages are never cut in half.
+        """
+        selected: List[str] = []
+        used = 0
+        for line, tokens in zip(reversed(self.lines), reversed(self.line_tokens)):
+            if used + tokens > max_tokens:
+                break
+            selected.append(line)
+            used += tokens
+
+        if self.summary and used + self.summary_tokens <= max_tokens:
+            selected.append(SUMMARY_PREFIX + self.summary)
+            # Without the summary, as much of the summarized history as fits would have been sent
+            would_have_sent = min(self.summarized_tokens, max_tokens - used)
+            self.tokens_saved += max(0, would_have_sent - self.summary_tokens)
+            used += self.summary_tokens
+
+        selected.reverse()
+        return "\n".join(selected), used
+
+    def memory_bytes(self) -> int:
+        return self._chars + len(self.summary)
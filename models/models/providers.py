@@ -0,0 +1,304 @@
+import asyncio
+import functools
+import hashlib
+import logging
+import random
+import re
+from os import getenv
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+import aiohttp
+import numpy as np
+import openai
+from openai import AsyncOpenAI, NOT_GIVEN
+
+from .tools import estimate_tokens
+
+
+class RateLimitError(Exception):
+    """Raised by providers when the backend rejects a request with HTTP 429."""
+    pass
+
+
+class Provider:
+    """
+    Backend for the model API functions in `models`. Concurrency limiting,
+    rate-limit retries, batching and caching are handled by the callers, so a
+    provider only has to perform a single request.
+    """
+
+    async def chat_completion(self, model: str, messages: List[Dict[str, str]], temperature: Optional[float]) -> str:
+        raise NotImplementedError
+
+    def chat_completion_stream(self, model: str, messages: List[Dict[str, str]], temperature: Optional[float]) -> AsyncIterator[str]:
+        raise NotImplementedError
+
+    async def embed(self, model: str, texts: List[str]) -> List[List[float]]:
+        raise NotImplementedError
+
+    async def rerank(self, model: str, query: str, documents: List[str], top_k: Optional[int]) -> Dict[str, Any]:
+        raise NotImplementedError
+
+
+class RemoteProvider(Provider):
+    """The hosted APIs: an OpenAI-compatible router for chat and VoyageAI for embeddings and reranking."""
+
+    def _chat_client(self) -> AsyncOpenAI:
+        return AsyncOpenAI(
+            api_key=getenv("SAVANT_ROUTER_API_KEY"),
+            base_url=getenv("SAVANT_ROUTER_BASE_URL", "https://router.savant.chat/api"),
+        )
+
+    def _chat_kwargs(self, model: str, messages: List[Dict[str, str]], temperature: Optional[float]) -> Dict[str, Any]:
+        task_id = getenv("TASK_ID", None)
+        return dict(
+            model=model,
+            messages=messages,
+            temperature=temperature if temperature is not None else NOT_GIVEN,
+            extra_body={"task_name": task_id} if task_id else {},
+            timeout=int(getenv("REQUEST_TIMEOUT", "1800")),
+        )
+
+    async def chat_completion(self, model, messages, temperature):
+        try:
+            response = await self._chat_client().chat.completions.create(
+                **self._chat_kwargs(model, messages, temperature)
+            )
+        except openai.RateLimitError as e:
+            raise RateLimitError(str(e)) from e
+        return response.choices[0].message.content
+
+    async def chat_completion_stream(self, model, messages, temperature):
+        try:
+            stream = await self._chat_client().chat.completions.create(
+                **self._chat_kwargs(model, messages, temperature), stream=True
+            )
+        except openai.RateLimitError as e:
+            raise RateLimitError(str(e)) from e
+        async for chunk in stream:
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if delta:
+                yield delta
+
+    async def embed(self, model, texts):
+        client = AsyncOpenAI(
+            api_key=getenv("VOYAGE_API_KEY"),
+            base_url=getenv("VOYAGE_API_BASE_URL", "https://api.voyageai.com/v1"),
+        )
+        try:
+            response = await client.embeddings.create(
+                model=model,
+                input=texts,
+                timeout=int(getenv("REQUEST_TIMEOUT", "1800"))
+            )
+        except openai.RateLimitError as e:
+            raise RateLimitError(str(e)) from e
+        return [item.embedding for item in response.data]
+
+    async def rerank(self, model, query, documents, top_k):
+        api_key = getenv("VOYAGE_API_KEY")
+        request_timeout = int(getenv("REQUEST_TIMEOUT", "1800"))
+        base_url = getenv("VOYAGE_API_BASE_URL", "https://api.voyageai.com/v1")
+
+        async with aiohttp.ClientSession() as session:
+            payload = {
+                "query": query,
+                "documents": documents,
+                "model": model,
+                "top_k": top_k,
+                "return_documents": False,
+                "truncation": True,
+            }
+            headers = {
+                "Authorization": f"Bearer {api_key}",
+                "Content-Type": "application/json"
+            }
+            async with session.post(f"{base_url}/rerank", headers=headers, json=payload, timeout=request_timeout) as response:
+                if response.status == 429:
+                    raise RateLimitError(await response.text())
+                return await response.json()
+
+
+class LatencyModel:
+    """
+    Samples simulated request latencies in seconds.
+
+    Distributions: "constant" (always `mean`), "uniform" (0..2*mean),
+    "exponential" (mean `mean`) and "lognormal" (median `mean`, shape `sigma`).
+    """
+
+    DISTRIBUTIONS = ("constant", "uniform", "exponential", "lognormal")
+
+    def __init__(self, mean: float = 0.05, distribution: str = "lognormal", sigma: float = 0.5):
+        if distribution not in self.DISTRIBUTIONS:
+            raise ValueError(f"Unknown latency distribution '{distribution}', expected one of {self.DISTRIBUTIONS}")
+        if mean < 0:
+            raise ValueError("Latency mean must be non-negative.")
+        self.mean = mean
+        self.distribution = distribution
+        self.sigma = sigma
+
+    def sample(self, rng: random.Random) -> float:
+        if self.mean == 0 or self.distribution == "constant":
+            return self.mean
+        if self.distribution == "uniform":
+            return rng.uniform(0, 2 * self.mean)
+        if self.distribution == "exponential":
+            return rng.expovariate(1.0 / self.mean)
+        return rng.lognormvariate(np.log(self.mean), self.sigma)
+
+
+_WORD_PATTERN = re.compile(r"\w+")
+
+
+@functools.lru_cache(maxsize=65536)
+def _word_vector(word: str, dim: int) -> np.ndarray:
+    seed = int.from_bytes(hashlib.sha256(word.encode("utf-8")).digest()[:8], "little")
+    return np.random.default_rng(seed).standard_normal(dim).astype(np.float32)
+
+
+def fake_embedding(text: str, dim: int = 1024) -> List[float]:
+    """
+    Deterministic, unit-length bag-of-words embedding. Texts sharing words get
+    similar vectors, so retrieval quality on synthetic data is meaningful.
+    """
+    vector = np.zeros(dim, dtype=np.float32)
+    for word in _WORD_PATTERN.findall(text.lower()):
+        vector += _word_vector(word, dim)
+    norm = np.linalg.norm(vector)
+    if norm == 0:
+        vector = _word_vector("", dim)
+        norm = np.linalg.norm(vector)
+    return (vector / norm).tolist()
+
+
+class FakeProvider(Provider):
+    """
+    In-process stand-in for the remote APIs, for offline load testing.
+
+    Every request waits for a latency sampled from `latency`, then fails with
+    RateLimitError with probability `rate_limit_rate`. Chat responses are
+    deterministic pseudo-text of `response_tokens` tokens, plus `response_ratio`
+    times the prompt's tokens (to mimic tasks like distillation whose output
+    grows with the input), delivered at `tokens_per_second`; embeddings come
+    from `fake_embedding`; reranking scores documents by embedding similarity.
+    All randomness derives from `seed`.
+    """
+
+    def __init__(
+        self,
+        latency: Optional[LatencyModel] = None,
+        rate_limit_rate: float = 0.0,
+        tokens_per_second: float = 200.0,
+        input_tokens_per_second: float = 1_000_000.0,
+        response_tokens: int = 200,
+        response_ratio: float = 0.0,
+        embedding_dim: int = 1024,
+        seed: int = 0,
+    ):
+        if not 0.0 <= rate_limit_rate < 1.0:
+            raise ValueError("rate_limit_rate must be in [0, 1).")
+        self.latency = latency or LatencyModel()
+        self.rate_limit_rate = rate_limit_rate
+        self.tokens_per_second = tokens_per_second
+        self.input_tokens_per_second = input_tokens_per_second
+        self.response_tokens = response_tokens
+        self.response_ratio = response_ratio
+        self.embedding_dim = embedding_dim
+        self.rng = random.Random(seed)
+        self.request_counts: Dict[str, int] = {"chat": 0, "embed": 0, "rerank": 0, "rate_limited": 0}
+
+    @classmethod
+    def from_env(cls) -> "FakeProvider":
+        """Builds a fake provider from FAKE_PROVIDER_* environment variables."""
+        return cls(
+            latency=LatencyModel(
+                mean=float(getenv("FAKE_PROVIDER_LATENCY_MS", "50")) / 1000.0,
+                distribution=getenv("FAKE_PROVIDER_LATENCY_DIST", "lognormal"),
+                sigma=float(getenv("FAKE_PROVIDER_LATENCY_SIGMA", "0.5")),
+            ),
+            rate_limit_rate=float(getenv("FAKE_PROVIDER_429_RATE", "0")),
+            tokens_per_second=float(getenv("FAKE_PROVIDER_TOKENS_PER_SECOND", "200")),
+            response_tokens=int(getenv("FAKE_PROVIDER_RESPONSE_TOKENS", "200")),
+            response_ratio=float(getenv("FAKE_PROVIDER_RESPONSE_RATIO", "0")),
+            embedding_dim=int(getenv("FAKE_PROVIDER_EMBEDDING_DIM", "1024")),
+            seed=int(getenv("FAKE_PROVIDER_SEED", "0")),
+        )
+
+    async def _request(self, kind: str, input_tokens: int = 0):
+        """Simulates request latency and rate limiting."""
+        self.request_counts[kind] += 1
+        delay = self.latency.sample(self.rng) + input_tokens / self.input_tokens_per_second
+        await asyncio.sleep(delay)
+        if self.rng.random() < self.rate_limit_rate:
+            self.request_counts["rate_limited"] += 1
+            raise RateLimitError(f"Simulated 429 for {kind} request")
+
+    def _response_words(self, messages: List[Dict[str, str]], input_tokens: int) -> List[str]:
+        prompt = "\n".join(message["content"] for message in messages)
+        seed = int.from_bytes(hashlib.sha256(prompt.encode("utf-8")).digest()[:8], "little")
+        vocabulary = _WORD_PATTERN.findall(prompt) or ["lorem", "ipsum"]
+        rng = random.Random(seed)
+        count = self.response_tokens + int(self.response_ratio * input_tokens)
+        return [rng.choice(vocabulary) for _ in range(count)]
+
+    async def chat_completion(self, model, messages, temperature):
+        input_tokens = sum(estimate_tokens(message["content"]) for message in messages)
+        await self._request("chat", input_tokens)
+        words = self._response_words(messages, input_tokens)
+        if self.tokens_per_second > 0:
+            await asyncio.sleep(len(words) / self.tokens_per_second)
+        return " ".join(words)
+
+    async def chat_completion_stream(self, model, messages, temperature):
+        input_tokens = sum(estimate_tokens(message["content"]) for message in messages)
+        await self._request("chat", input_tokens)
+        interval = 1.0 / self.tokens_per_second if self.tokens_per_second > 0 else 0.0
+        for i, word in enumerate(self._response_words(messages, input_tokens)):
+            if interval:
+                await asyncio.sleep(interval)
+            yield word if i == 0 else f" {word}"
+
+    async def embed(self, model, texts):
+        await self._request("embed", sum(estimate_tokens(text) for text in texts))
+        return [fake_embedding(text, self.embedding_dim) for text in texts]
+
+    async def rerank(self, model, query, documents, top_k):
+        await self._request("rerank", estimate_tokens(query) + sum(estimate_tokens(d) for d in documents))
+        query_vector = np.array(fake_embedding(query, self.embedding_dim))
+        scores = [float(np.dot(query_vector, fake_embedding(d, self.embedding_dim))) for d in documents]
+        order = sorted(range(len(documents)), key=lambda i: scores[i], reverse=True)
+        if top_k is not None:
+            order = order[:top_k]
+        return {
+            "object": "list",
+            "data": [{"index": i, "relevance_score": scores[i]} for i in order],
+            "model": model,
+        }
+
+
+_PROVIDER: List[Optional[Provider]] = [None]
+
+
+def set_provider(provider: Optional[Provider]):
+    """Overrides the provider used by the `models` API functions (None restores the default)."""
+    _PROVIDER[0] = provider
+
+
+def get_provider() -> Provider:
+    """
+    Returns the active provider. Unless set explicitly, it is chosen by the
+    MODELS_PROVIDER env var: "remote" (default) or "fake".
+    """
+    if _PROVIDER[0] is None:
+        kind = getenv("MODELS_PROVIDER", "remote").lower()
+        if kind == "fake":
+            logging.info("Using the in-process fake model provider.")
+            _PROVIDER[0] = FakeProvider.from_env()
+        elif kind == "remote":
+            _PROVIDER[0] = RemoteProvider()
+        else:
+            raise ValueError(f"Unknown MODELS_PROVIDER '{kind}', expected 'remote' or 'fake'")
+    return _PROVIDER[0]
@@ -0,0 +1,89 @@
+import asyncio
+import hashlib
+import logging
+from typing import Awaitable, Callable, Dict, List
+
+from .bm25 import BM25Index
+from .vector_index import VectorIndex
+
+
+def document_key(text: str) -> str:
+    """Content address of a document: SHA-256 hex digest of its UTF-8 bytes."""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class VectorSegment:
+    """
+    The chunks of one document together with their vector and BM25 indexes.
+    Segments are shared read-only between chat sessions through a SegmentRegistry.
+    """
+
+    def __init__(self, key: str, index: VectorIndex, chunks: List[str]):
+        self.key = key
+        self.index = index
+        self.chunks = chunks
+        self.bm25 = BM25Index()
+        self.bm25.add(chunks)
+        self.refcount = 0
+        self._text_bytes = sum(len(chunk.encode("utf-8")) for chunk in chunks)
+
+    def memory_bytes(self) -> int:
+        """Estimated memory held by the segment's indexes and chunk texts."""
+        return self.index.memory_bytes() + self.bm25.memory_bytes() + self._text_bytes
+
+
+class SegmentRegistry:
+    """
+    Refcounted, content-keyed store of shared VectorSegments. Concurrent requests
+    for a segment that is still being built wait for the single in-flight build.
+    A segment is dropped as soon as its last session releases it.
+    """
+
+    def __init__(self):
+        self.segments: Dict[str, VectorSegment] = {}
+        self._building: Dict[str, asyncio.Future] = {}
+
+    async def acquire(self, key: str, build: Callable[[], Awaitable[VectorSegment]]) -> VectorSegment:
+        """Returns the segment for `key`, building it with `build` if nobody holds it yet."""
+        while key not in self.segments:
+            if key in self._building:
+                # Shield so a cancelled waiter doesn't cancel the build for everyone else
+                await asyncio.shield(self._building[key])
+                continue
+
+            future = asyncio.get_running_loop().create_future()
+            self._building[key] = future
+            try:
+                segment = await build()
+            except BaseException as e:
+                future.set_exception(e)
+                # The builder re-raises; waiters retrieve the exception through shield
+                future.exception()
+                raise
+            finally:
+                del self._building[key]
+            self.segments[key] = segment
+            future.set_result(segment)
+
+        segment = self.segments[key]
+        segment.refcount += 1
+        return segment
+
+    def release(self, segment: VectorSegment):
+        """Drops one reference to the segment, freeing it when none remain."""
+        segment.refcount -= 1
+        if segment.refcount <= 0 and self.segments.get(segment.key) is segment:
+            del self.segments[segment.key]
+            logging.info(f"Released shared segment {segment.key[:12]} ({len(segment.chunks)} chunks)")
+
+    def memory_bytes(self) -> int:
+        """Estimated memory held by all live segments."""
+        return sum(segment.memory_bytes() for segment in self.segments.values())
+
+
+_SEGMENT_REGISTRY = SegmentRegistry()
+
+
+def get_segment_registry() -> SegmentRegistry:
+    """Returns the process-wide registry shared by all chat sessions."""
+    return _SEGMENT_REGISTRY
@@ -14,6 +14,8 @@ class RLSemaphore(Semaphore):
         if min_interval < 0:
             raise ValueError("Rate limit interval 'min_interval' must be non-negative.")
         self.min_interval = min_interval
+        # speedup() never goes below the configured interval
+        self.base_interval = min_interval
         self.rate_limit_lock = Lock()
         self.last_allowed_start_time = -float('inf')
         self.error_tolerance = error_tolerance
@@ -44,4 +46,4 @@ class RLSemaphore(Semaphore):
         self.min_interval *= self.slowdown_factor
 
     def speedup(self):
-        self.min_interval *= self.speedup_factor 
\ No newline at end of file
+        self.min_interval = max(self.base_interval, self.min_interval * self.speedup_factor)
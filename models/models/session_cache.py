@@ -0,0 +1,118 @@
+import logging
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Generic, Iterator, List, Optional, Tuple, TypeVar
+
+V = TypeVar("V")
+
+
+class SessionCache(Generic[V]):
+    """
+    Per-chat state keyed by chat UUID, bounded by a memory budget.
+
+    Entries idle for longer than `idle_ttl` seconds are evicted, then the least
+    recently used ones until the total size is within `max_bytes`. Evicted
+    values are passed to `on_evict` (which spills them to disk). Entries for
+    which `can_evict` returns False (e.g. in use by a request) and the most
+    recently used entry are never evicted.
+
+    Sizes come from `size_of` and are re-measured whenever an entry is accessed
+    or `refresh`ed, so callers should refresh after mutating a value.
+    """
+
+    def __init__(
+        self,
+        max_bytes: int,
+        idle_ttl: float,
+        size_of: Callable[[V], int],
+        on_evict: Callable[[str, V], None],
+        can_evict: Callable[[V], bool] = lambda value: True,
+    ):
+        self.max_bytes = max_bytes
+        self.idle_ttl = idle_ttl
+        self.size_of = size_of
+        self.on_evict = on_evict
+        self.can_evict = can_evict
+        # Least recently used first
+        self._entries: "OrderedDict[str, V]" = OrderedDict()
+        self._sizes: Dict[str, int] = {}
+        self._last_access: Dict[str, float] = {}
+        self.total_bytes = 0
+        self.evictions = 0
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: str) -> Optional[V]:
+        """Returns the entry, marking it as recently used, or None."""
+        if key not in self._entries:
+            return None
+        self._touch(key)
+        return self._entries[key]
+
+    def put(self, key: str, value: V):
+        self._entries[key] = value
+        self._touch(key)
+        self.evict()
+
+    def pop(self, key: str) -> Optional[V]:
+        """Removes an entry without spilling it."""
+        if key not in self._entries:
+            return None
+        self.total_bytes -= self._sizes.pop(key)
+        del self._last_access[key]
+        return self._entries.pop(key)
+
+    def refresh(self, key: str):
+        """Re-measures an entry after it changed and enforces the budget."""
+        if key in self._entries:
+            self._touch(key)
+            self.evict()
+
+    def values(self) -> List[V]:
+        return list(self._entries.values())
+
+    def items(self) -> Iterator[Tuple[str, V]]:
+        return iter(list(self._entries.items()))
+
+    def sizes(self) -> Dict[str, int]:
+        """Last measured size in bytes of every entry."""
+        return dict(self._sizes)
+
+    def _touch(self, key: str):
+        self._entries.move_to_end(key)
+        self._last_access[key] = time.monotonic()
+        size = self.size_of(self._entries[key])
+        self.total_bytes += size - self._sizes.get(key, 0)
+        self._sizes[key] = size
+
+    def evict(self):
+        """Evicts idle entries, then least recently used ones until within budget."""
+        now = time.monotonic()
+        candidates = list(self._entries)[:-1]
+        for key in candidates:
+            if now - self._last_access[key] <= self.idle_ttl:
+                # Entries are in access order, so the rest are newer
+                break
+            self._evict(key, "idle")
+        for key in candidates:
+            if self.total_bytes <= self.max_bytes:
+                break
+            if key in self._entries:
+                self._evict(key, "over budget")
+
+    def _evict(self, key: str, reason: str):
+        value = self._entries[key]
+        if not self.can_evict(value):
+            return
+        size = self._sizes[key]
+        self.pop(key)
+        self.evictions += 1
+        logging.info(f"Evicting session {key} ({reason}, {size} bytes); {self.total_bytes} bytes remain cached.")
+        try:
+            self.on_evict(key, value)
+        except Exception as e:
+            logging.error(f"Failed to spill evicted session {key}: {e}", exc_info=True)
@@ -0,0 +1,226 @@
+import base64
+import json
+import logging
+import os
+import pathlib
+import shutil
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+import numpy as np
+
+from .segments import VectorSegment, document_key
+from .vector_index import VectorIndex
+
+_LOG_NAME = "log.jsonl"
+_INDEX_NAME = "index.faiss"
+_CHUNKS_NAME = "chunks.json"
+_META_NAME = "meta.json"
+_HISTORY_NAME = "history.json"
+
+
+def _snapshot_names(generation: Optional[int]) -> Tuple[str, str]:
+    """Index and chunks file names of a snapshot generation (None for snapshots written before generations)."""
+    if generation is None:
+        return _INDEX_NAME, _CHUNKS_NAME
+    return f"index-{generation}.faiss", f"chunks-{generation}.json"
+
+
+def _write_json(path: pathlib.Path, payload: Any):
+    tmp_path = path.with_name(path.name + ".tmp")
+    tmp_path.write_text(json.dumps(payload), encoding="utf-8")
+    os.replace(tmp_path, path)
+
+
+class SessionStore:
+    """
+    On-disk state of chat sessions, so RAG indexes survive restarts without
+    re-embedding.
+
+    Each session directory holds a snapshot (FAISS index, chunk texts and the
+    keys of attached shared segments) plus an append log of chunks and segment
+    attachments since that snapshot. Snapshot files are numbered by generation
+    and the meta file names the current one, so replacing the meta file
+    switches snapshots atomically. Log entries record the index position they
+    start at, so replaying after a crash between writing a snapshot and
+    truncating the log is idempotent. Shared segments are saved once per key.
+    Chat histories evicted from memory are spilled next to the session's index.
+
+    Nothing is read at startup: sessions are restored on first access, with
+    their snapshot index memory-mapped.
+    """
+
+    def __init__(self, directory: Union[str, pathlib.Path], snapshot_every: Optional[int] = None):
+        if snapshot_every is None:
+            snapshot_every = int(os.getenv("RAG_SNAPSHOT_EVERY", "64"))
+        self.directory = pathlib.Path(directory)
+        self.snapshot_every = snapshot_every
+        (self.directory / "sessions").mkdir(parents=True, exist_ok=True)
+        (self.directory / "segments").mkdir(parents=True, exist_ok=True)
+
+    def _session_dir(self, chat_uuid: str) -> pathlib.Path:
+        # Hashed so arbitrary chat ids from URLs can't escape the store directory
+        return self.directory / "sessions" / document_key(chat_uuid)
+
+    def _segment_dir(self, key: str) -> pathlib.Path:
+        return self.directory / "segments" / document_key(key)
+
+    def has_session(self, chat_uuid: str) -> bool:
+        return self._session_dir(chat_uuid).is_dir()
+
+    def append_chunks(self, chat_uuid: str, start: int, chunks: List[str], vectors: np.ndarray):
+        """Logs chunks added to a session's private index at position `start`."""
+        vectors = np.ascontiguousarray(vectors, dtype="float32")
+        self._append(chat_uuid, {
+            "start": start,
+            "chunks": chunks,
+            "vectors": base64.b64encode(vectors.tobytes()).decode("ascii"),
+        })
+
+    def append_segment(self, chat_uuid: str, key: str):
+        """Logs that a session attached the shared segment `key`."""
+        self._append(chat_uuid, {"segment": key})
+
+    def _append(self, chat_uuid: str, entry: Dict[str, Any]):
+        session_dir = self._session_dir(chat_uuid)
+        session_dir.mkdir(exist_ok=True)
+        with open(session_dir / _LOG_NAME, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry) + "\n")
+
+    def write_snapshot(self, chat_uuid: str, index_data: np.ndarray, chunks: List[str], segment_keys: List[str]):
+        """
+        Writes a full snapshot of a session and clears its append log. `index_data`
+        is the private index from VectorIndex.serialize and `chunks` its chunks.
+        Blocking; run it on a thread.
+        """
+        session_dir = self._session_dir(chat_uuid)
+        session_dir.mkdir(exist_ok=True)
+        meta_path = session_dir / _META_NAME
+        previous = json.loads(meta_path.read_text(encoding="utf-8")).get("generation", 0) if meta_path.exists() else 0
+        generation = previous + 1
+        index_name, chunks_name = _snapshot_names(generation)
+        VectorIndex.save_serialized(index_data, session_dir / index_name)
+        _write_json(session_dir / chunks_name, chunks)
+        # The meta file is written last: replacing it switches to the new snapshot
+        _write_json(meta_path, {
+            "chat_uuid": chat_uuid,
+            "generation": generation,
+            "ntotal": len(chunks),
+            "segments": segment_keys,
+        })
+        (session_dir / _LOG_NAME).unlink(missing_ok=True)
+        for stale in (set(_snapshot_names(None)) | set(_snapshot_names(previous))) - {index_name, chunks_name}:
+            (session_dir / stale).unlink(missing_ok=True)
+        logging.info(f"Wrote RAG snapshot for chat {chat_uuid} ({len(chunks)} vectors).")
+
+    def load_session(self, chat_uuid: str, dim: int, **index_kwargs) -> Tuple[VectorIndex, List[str], List[str], int]:
+        """
+        Restores a session from its snapshot and append log.
+        Returns the private index, its chunks, the attached segment keys and the number of replayed log entries.
+        """
+        session_dir = self._session_dir(chat_uuid)
+        meta_path = session_dir / _META_NAME
+        if meta_path.exists():
+            meta = json.loads(meta_path.read_text(encoding="utf-8"))
+            index_name, chunks_name = _snapshot_names(meta.get("generation"))
+            index = VectorIndex.load(session_dir / index_name, dim, **index_kwargs)
+            chunks = json.loads((session_dir / chunks_name).read_text(encoding="utf-8"))
+            if not meta["ntotal"] == index.ntotal == len(chunks):
+                raise ValueError(
+                    f"RAG snapshot of chat {chat_uuid} is inconsistent: meta says {meta['ntotal']} vectors, "
+                    f"index has {index.ntotal}, chunks file has {len(chunks)}"
+                )
+            segment_keys = list(meta["segments"])
+        else:
+            index = VectorIndex(dim, **index_kwargs)
+            chunks, segment_keys = [], []
+
+        replayed = 0
+        for entry in self._read_log(session_dir / _LOG_NAME):
+            replayed += 1
+            if "segment" in entry:
+                if entry["segment"] not in segment_keys:
+                    segment_keys.append(entry["segment"])
+                continue
+            # Skip what the snapshot already contains
+            skip = index.ntotal - entry["start"]
+            if skip >= len(entry["chunks"]):
+                continue
+            vectors = np.frombuffer(base64.b64decode(entry["vectors"]), dtype="float32").reshape(-1, dim)
+            index.add(vectors[max(skip, 0):])
+            chunks.extend(entry["chunks"][max(skip, 0):])
+
+        logging.info(f"Restored RAG index for chat {chat_uuid}: {index.ntotal} vectors, "
+                     f"{len(segment_keys)} shared segments, {replayed} log entries replayed.")
+        return index, chunks, segment_keys, replayed
+
+    def _read_log(self, path: pathlib.Path) -> List[Dict[str, Any]]:
+        """Reads complete log entries, truncating a torn final line left by a crash."""
+        if not path.exists():
+            return []
+        entries = []
+        good_bytes = 0
+        with open(path, "rb") as f:
+            for line in f:
+                try:
+                    entries.append(json.loads(line))
+                except ValueError:
+                    break
+                good_bytes += len(line)
+        if good_bytes < path.stat().st_size:
+            logging.warning(f"Truncating torn RAG append log {path} at byte {good_bytes}.")
+            with open(path, "r+b") as f:
+                f.truncate(good_bytes)
+        return entries
+
+    def save_history(self, chat_uuid: str, history: List[Dict[str, str]]):
+        session_dir = self._session_dir(chat_uuid)
+        session_dir.mkdir(exist_ok=True)
+        _write_json(session_dir / _HISTORY_NAME, history)
+
+    def load_history(self, chat_uuid: str) -> Optional[List[Dict[str, str]]]:
+        path = self._session_dir(chat_uuid) / _HISTORY_NAME
+        if not path.exists():
+            return None
+        return json.loads(path.read_text(encoding="utf-8"))
+
+    def delete_session(self, chat_uuid: str):
+        shutil.rmtree(self._session_dir(chat_uuid), ignore_errors=True)
+
+    def save_segment(self, segment: VectorSegment):
+        """Saves a shared segment unless one with the same key is already on disk."""
+        segment_dir = self._segment_dir(segment.key)
+        if (segment_dir / _META_NAME).exists():
+            return
+        segment_dir.mkdir(exist_ok=True)
+        segment.index.save(segment_dir / _INDEX_NAME)
+        _write_json(segment_dir / _CHUNKS_NAME, segment.chunks)
+        _write_json(segment_dir / _META_NAME, {"key": segment.key, "ntotal": segment.index.ntotal})
+
+    def load_segment(self, key: str, dim: int, **index_kwargs) -> Optional[VectorSegment]:
+        """Loads a saved shared segment (memory-mapped), or returns None if there is none."""
+        segment_dir = self._segment_dir(key)
+        if not (segment_dir / _META_NAME).exists():
+            return None
+        index = VectorIndex.load(segment_dir / _INDEX_NAME, dim, **index_kwargs)
+        chunks = json.loads((segment_dir / _CHUNKS_NAME).read_text(encoding="utf-8"))
+        return VectorSegment(key, index, chunks)
+
+
+_SESSION_STORE: List[Optional[SessionStore]] = [None]
+
+
+def configure_session_store(directory: Union[str, pathlib.Path, None]) -> Optional[SessionStore]:
+    """Enables (or, with None, disables) persistence of chat session RAG indexes under `directory`."""
+    if directory is None:
+        _SESSION_STORE[0] = None
+        return None
+    _SESSION_STORE[0] = SessionStore(directory)
+    logging.info(f"Session store configured: {directory}")
+    return _SESSION_STORE[0]
+
+
+def get_session_store() -> Optional[SessionStore]:
+    """Returns the configured session store, falling back to the RAG_SESSION_DIR env var."""
+    if _SESSION_STORE[0] is None and os.getenv("RAG_SESSION_DIR"):
+        configure_session_store(os.getenv("RAG_SESSION_DIR"))
+    return _SESSION_STORE[0]
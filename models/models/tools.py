@@ -1,7 +1,15 @@
 import json
-from typing import Any, Dict, Tuple
+from os import getenv
+from typing import Any, Dict, Optional, Tuple
 import re
 
+# Context windows, in tokens, of the chat models used here
+MODEL_CONTEXT_TOKENS: Dict[str, int] = {
+    "grok-3": 131072,
+    "grok-3-mini": 131072,
+    "grok-3-mini-high": 131072,
+}
+
 def parse_json_from_text(text: str) -> Dict[str, Any]:
     """
     Extract the last JSON object or array from arbitrary text in linear time.
@@ -64,6 +72,30 @@ def exponential_backoff(n_try:int) -> int:
     return 2 ** n_try
 
 
+def estimate_tokens(text: str) -> int:
+    """
+    Cheap token count estimate (~4 characters per token for English text).
+    Good enough for batching and budgeting, not for billing.
+    """
+    return len(text) // 4 + 1
+
+
+def context_limit(model: Optional[str]) -> int:
+    """
+    Context window of `model` in tokens. The MODEL_CONTEXT_TOKENS env var
+    ("model=tokens,model=tokens") overrides the built-in table; unknown models
+    get DEFAULT_CONTEXT_TOKENS (default 32768).
+    """
+    limits = dict(MODEL_CONTEXT_TOKENS)
+    for entry in getenv("MODEL_CONTEXT_TOKENS", "").split(","):
+        name, _, tokens = entry.partition("=")
+        if name.strip() and tokens.strip():
+            limits[name.strip()] = int(tokens)
+    if model in limits:
+        return limits[model]
+    return int(getenv("DEFAULT_CONTEXT_TOKENS", "32768"))
+
+
 def extract_metadata(text: str) -> Dict[str, Any]:
     """
     Extract metadata from markdown text.
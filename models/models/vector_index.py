@@ -0,0 +1,277 @@
+import asyncio
+import logging
+import math
+import os
+import pathlib
+from os import getenv
+from typing import Optional, Tuple, Union
+
+import faiss
+import numpy as np
+
+STRATEGIES = ("flat", "auto")
+ANN_KINDS = ("hnsw", "ivfpq")
+METRICS = ("l2", "cosine")
+STORAGES = ("float32", "float16", "sq8")
+
+_SCALAR_QUANTIZERS = {
+    "float16": faiss.ScalarQuantizer.QT_fp16,
+    "sq8": faiss.ScalarQuantizer.QT_8bit,
+}
+
+
+def _index_bytes(index: faiss.Index) -> int:
+    """Estimates the memory held by an index's vector codes and graph links."""
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexHNSW):
+        links = index.ntotal * index.hnsw.nb_neighbors(0) * 4
+        return _index_bytes(index.storage) + links
+    if isinstance(index, faiss.IndexRefine):
+        return _index_bytes(index.base_index) + _index_bytes(index.refine_index)
+    if isinstance(index, faiss.IndexIVF):
+        return index.ntotal * (index.code_size + 8)
+    return index.ntotal * getattr(index, "code_size", index.d * 4)
+
+
+class VectorIndex:
+    """
+    FAISS index for a chat session that starts as an exact flat index and,
+    with the "auto" strategy, switches to an approximate one (HNSW, or IVF-PQ
+    with exact re-ranking of candidates) once it grows past `ann_threshold`
+    vectors.
+
+    With the "cosine" metric vectors are L2-normalized and searched by inner
+    product, so search returns similarities (higher is better) instead of L2
+    distances. `storage` selects how vectors are kept: float32, float16 or 8-bit
+    scalar quantization (SQ8). SQ8 needs training, so vectors are held exactly
+    until `sq8_train_size` have arrived.
+
+    Rebuilds (SQ8 training, ANN construction) run on a worker thread from a copy
+    of the vectors; the current index keeps serving searches and accepting
+    inserts until the new index has caught up and is swapped in. Vector ids are
+    insertion positions throughout.
+
+    Indexes can be saved to and loaded from disk; a memory-mapped index is read
+    in place and only copied into memory on the first insert.
+    """
+
+    def __init__(
+        self,
+        dim: int,
+        strategy: Optional[str] = None,
+        ann_kind: Optional[str] = None,
+        ann_threshold: Optional[int] = None,
+        metric: Optional[str] = None,
+        storage: Optional[str] = None,
+        sq8_train_size: int = 1000,
+        hnsw_m: int = 32,
+        hnsw_ef_search: int = 64,
+        ivf_nprobe: int = 16,
+        pq_subquantizers: int = 64,
+        refine_k_factor: float = 4.0,
+    ):
+        if strategy is None:
+            strategy = getenv("RAG_INDEX_STRATEGY", "auto")
+        if ann_kind is None:
+            ann_kind = getenv("RAG_ANN_KIND", "hnsw")
+        if ann_threshold is None:
+            ann_threshold = int(getenv("RAG_ANN_THRESHOLD", "20000"))
+        if metric is None:
+            metric = getenv("RAG_INDEX_METRIC", "cosine")
+        if storage is None:
+            storage = getenv("RAG_INDEX_STORAGE", "float32")
+
+        if strategy not in STRATEGIES:
+            raise ValueError(f"Unknown index strategy '{strategy}', expected one of {STRATEGIES}")
+        if ann_kind not in ANN_KINDS:
+            raise ValueError(f"Unknown ANN index kind '{ann_kind}', expected one of {ANN_KINDS}")
+        if metric not in METRICS:
+            raise ValueError(f"Unknown index metric '{metric}', expected one of {METRICS}")
+        if storage not in STORAGES:
+            raise ValueError(f"Unknown index storage '{storage}', expected one of {STORAGES}")
+        if ann_kind == "ivfpq" and dim % pq_subquantizers != 0:
+            raise ValueError(f"Dimension {dim} is not divisible by {pq_subquantizers} PQ subquantizers")
+
+        self.d = dim
+        self.strategy = strategy
+        self.ann_kind = ann_kind
+        self.ann_threshold = ann_threshold
+        self.metric = metric
+        self.storage = storage
+        self.sq8_train_size = sq8_train_size
+        self.hnsw_m = hnsw_m
+        self.hnsw_ef_search = hnsw_ef_search
+        self.ivf_nprobe = ivf_nprobe
+        self.pq_subquantizers = pq_subquantizers
+        self.refine_k_factor = refine_k_factor
+
+        self.faiss_metric = faiss.METRIC_INNER_PRODUCT if metric == "cosine" else faiss.METRIC_L2
+        # Until trained, SQ8 storage is staged in an exact float32 index
+        self.needs_training = storage == "sq8"
+        self.index: faiss.Index = (
+            self._exact_flat() if self.needs_training else self._storage_flat(None)
+        )
+        self.is_approximate = False
+        self.is_mapped = False
+        self._build_task: Optional[asyncio.Future] = None
+
+    @classmethod
+    def load(cls, path: Union[str, pathlib.Path], dim: int, mmap: bool = True, **kwargs) -> "VectorIndex":
+        """Loads an index written by `save`, memory-mapping its vectors unless `mmap` is False."""
+        vector_index = cls(dim, **kwargs)
+        flags = faiss.IO_FLAG_MMAP_IFC | faiss.IO_FLAG_READ_ONLY if mmap else 0
+        index = faiss.read_index(str(path), flags)
+        if index.d != dim:
+            raise ValueError(f"Index at {path} has dimension {index.d}, expected {dim}")
+        vector_index.index = index
+        vector_index.is_approximate = isinstance(
+            faiss.downcast_index(index), (faiss.IndexHNSW, faiss.IndexRefine, faiss.IndexIVF)
+        )
+        # SQ8 indexes saved before training are still staged in a float32 flat index
+        vector_index.needs_training = vector_index.storage == "sq8" and isinstance(
+            faiss.downcast_index(index), faiss.IndexFlat
+        )
+        vector_index.is_mapped = mmap
+        return vector_index
+
+    def save(self, path: Union[str, pathlib.Path]):
+        """Atomically writes the current index to `path`."""
+        tmp_path = f"{path}.tmp"
+        faiss.write_index(self.index, tmp_path)
+        os.replace(tmp_path, path)
+
+    def serialize(self) -> np.ndarray:
+        """
+        A copy of the current index in the on-disk format, which `save_serialized`
+        can write from another thread while this index keeps changing.
+        """
+        return faiss.serialize_index(self.index)
+
+    @staticmethod
+    def save_serialized(data: np.ndarray, path: Union[str, pathlib.Path]):
+        """Atomically writes an index returned by `serialize` to `path`."""
+        tmp_path = f"{path}.tmp"
+        data.tofile(tmp_path)
+        os.replace(tmp_path, path)
+
+    @property
+    def ntotal(self) -> int:
+        return self.index.ntotal
+
+    @property
+    def higher_is_better(self) -> bool:
+        """True when search scores are similarities (cosine) rather than distances (L2)."""
+        return self.metric == "cosine"
+
+    def memory_bytes(self) -> int:
+        """Estimated memory used by the stored vectors and index structures."""
+        return _index_bytes(self.index)
+
+    def add(self, vectors: np.ndarray):
+        """Adds a (n, d) float32 array. May schedule a background rebuild of the index."""
+        if self.is_mapped:
+            # Memory-mapped codes are read-only views; take an owned copy before writing
+            self.index = faiss.deserialize_index(faiss.serialize_index(self.index))
+            self.is_mapped = False
+        self.index.add(self._prepare(vectors))
+        if self._should_build():
+            self._start_build()
+
+    def search(self, queries: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Returns (scores, ids) for the k nearest neighbours of each query. Scores are
+        similarities for "cosine" and squared distances for "l2". Missing results have id -1.
+        """
+        return self.index.search(self._prepare(queries), k)
+
+    def _prepare(self, vectors: np.ndarray) -> np.ndarray:
+        vectors = np.array(vectors, dtype="float32", order="C", copy=True)
+        if self.metric == "cosine":
+            faiss.normalize_L2(vectors)
+        return vectors
+
+    def _exact_flat(self) -> faiss.Index:
+        if self.faiss_metric == faiss.METRIC_INNER_PRODUCT:
+            return faiss.IndexFlatIP(self.d)
+        return faiss.IndexFlatL2(self.d)
+
+    def _storage_flat(self, training_vectors: Optional[np.ndarray]) -> faiss.Index:
+        """Flat index using the configured storage, trained on `training_vectors` if it needs it."""
+        if self.storage == "float32":
+            return self._exact_flat()
+        index = faiss.IndexScalarQuantizer(self.d, _SCALAR_QUANTIZERS[self.storage], self.faiss_metric)
+        if not index.is_trained:
+            index.train(training_vectors)
+        return index
+
+    def _should_build(self) -> bool:
+        if self._build_task is not None:
+            return False
+        if self.needs_training and self.index.ntotal >= self.sq8_train_size:
+            return True
+        return (
+            self.strategy == "auto"
+            and not self.is_approximate
+            and self.index.ntotal >= self.ann_threshold
+        )
+
+    def _start_build(self):
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None
+
+        approximate = self.strategy == "auto" and self.index.ntotal >= self.ann_threshold
+        snapshot = self.index.reconstruct_n(0, self.index.ntotal)
+        if loop is None:
+            self._swap_in(self._build(snapshot, approximate), len(snapshot), approximate)
+            return
+
+        kind = self.ann_kind if approximate else f"{self.storage} flat"
+        logging.info(f"Building {kind} index in the background for {len(snapshot)} vectors.")
+        self._build_task = loop.run_in_executor(None, self._build, snapshot, approximate)
+        self._build_task.add_done_callback(lambda task: self._on_built(task, len(snapshot), approximate))
+
+    def _on_built(self, task: asyncio.Future, snapshot_size: int, approximate: bool):
+        self._build_task = None
+        if task.cancelled():
+            return
+        if task.exception() is not None:
+            logging.error(f"Failed to rebuild the vector index, keeping the current one: {task.exception()}")
+            self.strategy = "flat"
+            self.needs_training = False
+            return
+        self._swap_in(task.result(), snapshot_size, approximate)
+        if self._should_build():
+            self._start_build()
+
+    def _swap_in(self, new_index: faiss.Index, snapshot_size: int, approximate: bool):
+        """Adds vectors inserted during the build, then replaces the current index."""
+        if self.index.ntotal > snapshot_size:
+            new_index.add(self.index.reconstruct_n(snapshot_size, self.index.ntotal - snapshot_size))
+        self.index = new_index
+        self.needs_training = False
+        self.is_approximate = approximate
+        logging.info(f"Swapped in rebuilt vector index with {new_index.ntotal} vectors.")
+
+    def _build(self, vectors: np.ndarray, approximate: bool) -> faiss.Index:
+        """Builds (and trains, if needed) the replacement index. Runs on a worker thread."""
+        if not approximate:
+            index = self._storage_flat(vectors)
+        elif self.ann_kind == "hnsw":
+            if self.storage == "float32":
+                index = faiss.IndexHNSWFlat(self.d, self.hnsw_m, self.faiss_metric)
+            else:
+                index = faiss.IndexHNSWSQ(self.d, _SCALAR_QUANTIZERS[self.storage], self.hnsw_m, self.faiss_metric)
+                index.train(vectors)
+            index.hnsw.efSearch = self.hnsw_ef_search
+        else:
+            nlist = max(1, int(math.sqrt(len(vectors))))
+            ivfpq = faiss.IndexIVFPQ(self._exact_flat(), self.d, nlist, self.pq_subquantizers, 8, self.faiss_metric)
+            ivfpq.nprobe = self.ivf_nprobe
+            ivfpq.train(vectors)
+            # PQ codes alone lose too much recall; re-rank PQ candidates exactly.
+            index = faiss.IndexRefine(ivfpq, self._storage_flat(vectors))
+            index.k_factor = self.refine_k_factor
+        index.add(vectors)
+        return index
@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+"""
+Checks MarkdownChunker on a large synthetic markdown document: every chunk
+must be at most `chunk_size` characters, for several chunk sizes and overlaps,
+and no text may be lost. Exits non-zero on a violation.
+
+Usage:
+    python run_chunker_check.py [--size-mb 1.2] [--seed 0]
+"""
+import argparse
+import random
+import sys
+import time
+
+from models.chunking import MarkdownChunker
+
+SETTINGS = [(4096, 256), (1000, 200), (1000, 0), (512, 500), (200, 50)]
+
+
+def synthetic_markdown(rng: random.Random, size: int) -> str:
+    """Headings, paragraphs, lists, code blocks, very long lines and unbroken words, to ~`size` characters."""
+    words = [f"word{i}" for i in range(500)]
+    parts = []
+    total = 0
+    while total < size:
+        kind = rng.random()
+        if kind < 0.1:
+            part = "#" * rng.randint(1, 4) + " " + " ".join(rng.choices(words, k=5))
+        elif kind < 0.2:
+            part = "\n".join(f"- {' '.join(rng.choices(words, k=rng.randint(3, 30)))}" for _ in range(rng.randint(2, 10)))
+        elif kind < 0.3:
+            body = "\n".join("    " + " ".join(rng.choices(words, k=rng.randint(1, 12))) for _ in range(rng.randint(3, 80)))
+            part = f"```python\n{body}\n```"
+        elif kind < 0.35:
+            part = "x" * rng.randint(100, 10_000)
+        else:
+            sentences = [" ".join(rng.choices(words, k=rng.randint(5, 40))) + "." for _ in range(rng.randint(1, 60))]
+            part = " ".join(sentences)
+        parts.append(part)
+        total += len(part) + 2
+    return "\n\n".join(parts)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check MarkdownChunker's chunk size bound.")
+    parser.add_argument("--size-mb", type=float, default=1.2)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    text = synthetic_markdown(random.Random(args.seed), int(args.size_mb * 1_000_000))
+    expected = "".join(text.split())
+    failed = False
+    for chunk_size, chunk_overlap in SETTINGS:
+        chunker = MarkdownChunker(chunk_size, chunk_overlap)
+        started = time.perf_counter()
+        chunks = chunker.split_text(text)
+        elapsed = time.perf_counter() - started
+        longest = max(len(chunk) for chunk in chunks)
+        oversized = sum(1 for chunk in chunks if len(chunk) > chunk_size)
+        # Without overlap the chunks must add up to the document, whitespace aside
+        lost = chunk_overlap == 0 and "".join("".join(chunks).split()) != expected
+        status = "ok" if not oversized and not lost else "FAIL"
+        failed = failed or status == "FAIL"
+        print(f"size {chunk_size:>5} overlap {chunk_overlap:>4}: {len(chunks):>6} chunks, longest {longest:>5}, "
+              f"oversized {oversized}, {'text lost, ' if lost else ''}{elapsed * 1000:.0f} ms  {status}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -66,7 +66,7 @@ async def main():
         user_query=new_user_query,
         chat_history=recent_chat_history,
         rag_top_k=3,
-        max_context_chars=128000
+        max_context_tokens=32000
     )
 
     # 4. Print the result
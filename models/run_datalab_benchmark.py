@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+"""
+End-to-end benchmark of process_pdf_with_datalab against a local fake Datalab
+server, comparing how results are picked up:
+
+  fixed     the previous behaviour, a poll every 5 seconds
+  adaptive  PollSchedule: first poll near the expected finish, then backoff
+  callback  the server posts to a DatalabCallbackReceiver when a job completes
+
+The fake server derives a page count from the upload size and takes
+`--seconds-per-page` per page (with jitter) to "process" it. All durations are
+multiplied by `--time-scale` so the run is quick, and reported unscaled (so
+real local HTTP round trips show up magnified by 1 / time-scale in overheads).
+
+Usage:
+    python run_datalab_benchmark.py [--jobs 20] [--time-scale 0.02] [--output results.json]
+"""
+import argparse
+import asyncio
+import json
+import os
+import pathlib
+import random
+import statistics
+import tempfile
+import time
+import uuid
+from typing import Dict, List, Optional
+
+from aiohttp import ClientSession, web
+
+BYTES_PER_PAGE = 80_000
+
+
+class FakeDatalab:
+    """Marker endpoint that completes jobs after a page-proportional delay and counts check requests."""
+
+    def __init__(self, seconds_per_page: float, rng: random.Random, callback_url: Optional[str] = None):
+        self.seconds_per_page = seconds_per_page
+        self.rng = rng
+        self.callback_url = callback_url
+        self.base_url = ""
+        self.jobs: Dict[str, Dict[str, float]] = {}
+        self.checks = 0
+        self._tasks = set()
+
+    def app(self) -> web.Application:
+        app = web.Application(client_max_size=1024**3)
+        app.router.add_post("/marker", self.submit)
+        app.router.add_get("/marker/{request_id}", self.check)
+        return app
+
+    async def submit(self, request: web.Request) -> web.Response:
+        form = await request.post()
+        size = len(form["file"].file.read())
+        pages = max(1, min(int(form.get("max_pages", 100)), size // BYTES_PER_PAGE))
+        duration = pages * self.seconds_per_page * self.rng.uniform(0.7, 1.3)
+        request_id = uuid.uuid4().hex
+        self.jobs[request_id] = {"pages": pages, "done_at": time.monotonic() + duration, "duration": duration}
+        if self.callback_url:
+            task = asyncio.ensure_future(self._callback(request_id, duration))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        return web.json_response({
+            "success": True,
+            "error": None,
+            "request_id": request_id,
+            "request_check_url": f"{self.base_url}/marker/{request_id}",
+        })
+
+    async def check(self, request: web.Request) -> web.Response:
+        self.checks += 1
+        job = self.jobs[request.match_info["request_id"]]
+        if time.monotonic() < job["done_at"]:
+            return web.json_response({"status": "processing"})
+        return web.json_response({
+            "status": "complete",
+            "success": True,
+            "markdown": "# Paper\n\n" + "Text. " * 100,
+            "images": {},
+            "page_count": job["pages"],
+        })
+
+    async def _callback(self, request_id: str, delay: float):
+        await asyncio.sleep(delay)
+        async with ClientSession() as session:
+            await session.post(self.callback_url, json={"request_id": request_id, "webhook_secret": "benchmark"})
+
+
+async def run_mode(mode: str, page_counts: List[int], args, workdir: pathlib.Path) -> Dict[str, object]:
+    import models.datalab as datalab
+
+    scale = args.time_scale
+    receiver = None
+    callback_url = None
+    if mode == "callback":
+        receiver = datalab.DatalabCallbackReceiver(
+            "127.0.0.1", args.port + 1, secret="benchmark", fallback_delay=60 * scale
+        )
+        await receiver.start()
+        callback_url = f"http://127.0.0.1:{args.port + 1}{receiver.path}"
+
+    server = FakeDatalab(args.seconds_per_page * scale, random.Random(args.seed), callback_url)
+    server.base_url = f"http://127.0.0.1:{args.port}"
+    runner = web.AppRunner(server.app())
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", args.port).start()
+    datalab.DATALAB_API_BASE = server.base_url
+
+    if mode == "fixed":
+        schedule = datalab.PollSchedule(initial_delay=5 * scale, max_delay=5 * scale, factor=1.0, first_poll_fraction=0.0)
+    else:
+        # Starts from the default priors and learns the fake server's rates as jobs complete
+        schedule = datalab.PollSchedule(initial_delay=0.5 * scale, max_delay=10 * scale, seconds_per_page=1.0 * scale)
+
+    overheads, latencies, polls = [], [], []
+    try:
+        for i, pages in enumerate(page_counts):
+            pdf_path = workdir / f"{mode}-{i}.pdf"
+            pdf_path.write_bytes(b"\0" * (pages * BYTES_PER_PAGE))
+            checks_before = server.checks
+            started = time.monotonic()
+            markdown = await datalab.process_pdf_with_datalab(
+                pdf_path, workdir / f"{mode}-{i}", api_key="benchmark",
+                schedule=schedule, callback_receiver=receiver, timeout=3600 * scale,
+            )
+            latency = time.monotonic() - started
+            if markdown is None:
+                raise RuntimeError(f"Job {i} failed in {mode} mode")
+            job = list(server.jobs.values())[-1]
+            latencies.append(latency / scale)
+            overheads.append((latency - job["duration"]) / scale)
+            polls.append(server.checks - checks_before)
+    finally:
+        await runner.cleanup()
+        if receiver is not None:
+            await receiver.stop()
+
+    return {
+        "mean_latency_s": statistics.fmean(latencies),
+        "mean_overhead_s": statistics.fmean(overheads),
+        "p95_overhead_s": sorted(overheads)[min(len(overheads) - 1, int(len(overheads) * 0.95))],
+        "mean_polls": statistics.fmean(polls),
+        "total_polls": sum(polls),
+    }
+
+
+async def run(args) -> Dict[str, object]:
+    rng = random.Random(args.seed)
+    page_counts = [rng.randint(args.min_pages, args.max_pages) for _ in range(args.jobs)]
+    report = {
+        "jobs": args.jobs,
+        "pages": page_counts,
+        "seconds_per_page": args.seconds_per_page,
+        "time_scale": args.time_scale,
+        "modes": {},
+    }
+    with tempfile.TemporaryDirectory() as workdir:
+        for mode in ("fixed", "adaptive", "callback"):
+            stats = await run_mode(mode, page_counts, args, pathlib.Path(workdir))
+            report["modes"][mode] = stats
+            print(f"{mode:<9} latency {stats['mean_latency_s']:6.1f}s  overhead mean {stats['mean_overhead_s']:5.2f}s "
+                  f"p95 {stats['p95_overhead_s']:5.2f}s  polls/job {stats['mean_polls']:5.1f}")
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark Datalab result polling against a fake server.")
+    parser.add_argument("--jobs", type=int, default=20)
+    parser.add_argument("--min-pages", type=int, default=3)
+    parser.add_argument("--max-pages", type=int, default=60)
+    parser.add_argument("--seconds-per-page", type=float, default=1.0, help="Simulated processing time per page")
+    parser.add_argument("--time-scale", type=float, default=0.02, help="Multiplier applied to every duration")
+    parser.add_argument("--port", type=int, default=8790)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write JSON results to this file instead of stdout")
+    args = parser.parse_args()
+
+    # The fake server needs no real key, and the receiver is passed explicitly
+    os.environ.pop("DATALAB_CALLBACK_PORT", None)
+
+    report = asyncio.run(run(args))
+    payload = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(payload)
+    else:
+        print(payload)
+
+
+if __name__ == "__main__":
+    main()
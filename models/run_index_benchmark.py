@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+"""
+Recall/latency/memory benchmark for the ChatSession vector index strategies,
+metrics and storage types on synthetic 1024-d unit vectors. Exact float32
+search is the ground truth.
+
+Usage:
+    python run_index_benchmark.py [--sizes 10000 50000] [--queries 200]
+                                  [--configs flat-cosine hnsw ...] [--output results.json]
+"""
+import argparse
+import json
+import statistics
+import time
+
+import faiss
+import numpy as np
+
+from models.context import EMBEDDING_DIM
+from models.vector_index import VectorIndex
+
+
+def synthetic_vectors(n: int, dim: int, rng: np.random.Generator, centers: np.ndarray) -> np.ndarray:
+    """Clustered unit vectors, closer to real (normalized) embeddings than uniform noise."""
+    labels = rng.integers(0, len(centers), size=n)
+    vectors = (centers[labels] + 0.3 * rng.standard_normal((n, dim))).astype("float32")
+    faiss.normalize_L2(vectors)
+    return vectors
+
+
+def build(config: dict, data: np.ndarray) -> tuple:
+    """Builds an index synchronously (no event loop) and returns it with the build time."""
+    index = VectorIndex(EMBEDDING_DIM, **config)
+    started = time.perf_counter()
+    index.add(data)
+    return index, time.perf_counter() - started
+
+
+def measure(index: VectorIndex, queries: np.ndarray, k: int, truth: np.ndarray) -> dict:
+    latencies = []
+    hits = 0
+    for i, query in enumerate(queries):
+        started = time.perf_counter()
+        _, ids = index.search(query[None, :], k)
+        latencies.append(time.perf_counter() - started)
+        hits += len(set(ids[0]) & set(truth[i]))
+    latencies.sort()
+    return {
+        "memory_bytes": index.memory_bytes(),
+        "serialized_bytes": len(faiss.serialize_index(index.index)),
+        "recall_at_k": hits / (len(queries) * k),
+        "query_ms_mean": statistics.fmean(latencies) * 1000,
+        "query_ms_p50": latencies[len(latencies) // 2] * 1000,
+        "query_ms_p95": latencies[int(len(latencies) * 0.95)] * 1000,
+    }
+
+
+CONFIGS = {
+    "flat-l2": {"strategy": "flat", "metric": "l2"},
+    "flat-cosine": {"strategy": "flat", "metric": "cosine"},
+    "flat-cosine-f16": {"strategy": "flat", "metric": "cosine", "storage": "float16"},
+    "flat-cosine-sq8": {"strategy": "flat", "metric": "cosine", "storage": "sq8", "sq8_train_size": 0},
+    "hnsw": {"strategy": "auto", "ann_kind": "hnsw", "ann_threshold": 0, "metric": "cosine"},
+    "hnsw-f16": {"strategy": "auto", "ann_kind": "hnsw", "ann_threshold": 0, "metric": "cosine", "storage": "float16"},
+    "hnsw-sq8": {"strategy": "auto", "ann_kind": "hnsw", "ann_threshold": 0, "metric": "cosine", "storage": "sq8"},
+    "ivfpq": {"strategy": "auto", "ann_kind": "ivfpq", "ann_threshold": 0, "metric": "cosine"},
+}
+GROUND_TRUTH = "flat-cosine"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark ChatSession vector index strategies.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 50000])
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=15)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--configs", nargs="+", choices=list(CONFIGS), default=list(CONFIGS))
+    parser.add_argument("--output", help="Write JSON results to this file instead of stdout")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    centers = rng.standard_normal((256, EMBEDDING_DIM)).astype("float32")
+    results = {"dim": EMBEDDING_DIM, "k": args.k, "queries": args.queries, "runs": []}
+
+    for size in args.sizes:
+        data = synthetic_vectors(size, EMBEDDING_DIM, rng, centers)
+        queries = synthetic_vectors(args.queries, EMBEDDING_DIM, rng, centers)
+        truth_index, _ = build(CONFIGS[GROUND_TRUTH], data)
+        _, truth = truth_index.search(queries, args.k)
+        baseline_bytes = truth_index.memory_bytes()
+        for name in args.configs:
+            index, build_s = build(CONFIGS[name], data)
+            run = {"size": size, "index": name, "build_s": build_s}
+            run.update(measure(index, queries, args.k, truth))
+            run["memory_ratio"] = baseline_bytes / run["memory_bytes"]
+            results["runs"].append(run)
+            print(f"{size:>8} {name:<16} build {build_s:6.2f}s  recall@{args.k} {run['recall_at_k']:.3f}  "
+                  f"p50 {run['query_ms_p50']:.3f}ms  p95 {run['query_ms_p95']:.3f}ms  "
+                  f"mem {run['memory_bytes'] / 2**20:7.1f}MiB ({run['memory_ratio']:.1f}x smaller)")
+
+    payload = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(payload)
+    else:
+        print(payload)
+
+
+if __name__ == "__main__":
+    main()
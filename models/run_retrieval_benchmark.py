@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+"""
+Latency benchmark for ChatSession.retrieve_rag_context in "vector" mode (embed,
+then always rerank) versus "hybrid" mode (BM25 fused with vector results,
+reranking only ambiguous queries), against the in-process fake provider.
+
+Reports per-query latency, how many queries called the reranker and how much
+each mode's top-k overlaps with vector+rerank results.
+
+Usage:
+    python run_retrieval_benchmark.py [--queries 200] [--latency-ms 80] [--output results.json]
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import time
+from typing import Dict, List
+
+
+def synthetic_paper(rng: random.Random, topics: int, sections_per_topic: int) -> tuple:
+    """Markdown with one section per topic; each topic has its own distinctive vocabulary."""
+    common = [f"common{i}" for i in range(300)]
+    vocabularies = [[f"topic{t}term{i}" for i in range(25)] for t in range(topics)]
+    sections = []
+    for _ in range(sections_per_topic):
+        for t in range(topics):
+            sentences = []
+            for _ in range(12):
+                words = rng.sample(vocabularies[t], 4) + rng.sample(common, 8)
+                rng.shuffle(words)
+                sentences.append(" ".join(words).capitalize() + ".")
+            sections.append(f"## Section on topic {t}\n\n" + " ".join(sentences))
+    return "\n\n".join(sections), vocabularies, common
+
+
+def make_queries(rng: random.Random, vocabularies: List[List[str]], common: List[str], n: int) -> List[str]:
+    queries = []
+    for _ in range(n):
+        vocabulary = rng.choice(vocabularies)
+        queries.append("What does the paper say about " + " ".join(rng.sample(vocabulary, 3) + rng.sample(common, 2)) + "?")
+    return queries
+
+
+def summarize(latencies: List[float]) -> Dict[str, float]:
+    latencies = sorted(latencies)
+    return {
+        "mean_ms": statistics.fmean(latencies) * 1000,
+        "p50_ms": latencies[len(latencies) // 2] * 1000,
+        "p95_ms": latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] * 1000,
+    }
+
+
+async def run_mode(mode: str, paper: str, queries: List[str], top_k: int, provider) -> Dict[str, object]:
+    from models.context import ChatSession
+    from models.segments import SegmentRegistry
+
+    session = ChatSession(retrieval_mode=mode, registry=SegmentRegistry())
+    await session.add_shared_document(paper, key="benchmark-paper")
+    chunks = session.shared_segments["benchmark-paper"].chunks
+    reranks_before = provider.request_counts["rerank"]
+
+    latencies, results = [], []
+    for query in queries:
+        started = time.perf_counter()
+        context = await session.retrieve_rag_context(query, top_k=top_k)
+        latencies.append(time.perf_counter() - started)
+        results.append([chunk for chunk in chunks if chunk in context])
+
+    session.close()
+    stats = summarize(latencies)
+    stats["rerank_calls"] = provider.request_counts["rerank"] - reranks_before
+    return {"stats": stats, "results": results}
+
+
+def overlap(results: List[List[str]], reference: List[List[str]], top_k: int) -> float:
+    return statistics.fmean(len(set(a) & set(b)) / top_k for a, b in zip(results, reference))
+
+
+async def run(args) -> Dict[str, object]:
+    from models import set_provider
+    from models.providers import FakeProvider, LatencyModel
+
+    provider = FakeProvider(latency=LatencyModel(args.latency_ms / 1000.0, args.latency_dist), seed=args.seed)
+    set_provider(provider)
+
+    rng = random.Random(args.seed)
+    paper, vocabularies, common = synthetic_paper(rng, args.topics, args.sections_per_topic)
+    queries = make_queries(rng, vocabularies, common, args.queries)
+
+    runs = {mode: await run_mode(mode, paper, queries, args.top_k, provider) for mode in ("vector", "hybrid")}
+    reference = runs["vector"]["results"]
+    report = {
+        "queries": args.queries,
+        "top_k": args.top_k,
+        "latency_ms": args.latency_ms,
+        "latency_dist": args.latency_dist,
+        "paper_chars": len(paper),
+        "modes": {},
+    }
+    for mode, run_result in runs.items():
+        stats = run_result["stats"]
+        stats["overlap_with_vector_rerank"] = overlap(run_result["results"], reference, args.top_k)
+        report["modes"][mode] = stats
+        print(f"{mode:<7} mean {stats['mean_ms']:7.1f}ms  p50 {stats['p50_ms']:7.1f}ms  p95 {stats['p95_ms']:7.1f}ms  "
+              f"reranks {stats['rerank_calls']:>4}/{args.queries}  overlap {stats['overlap_with_vector_rerank']:.2f}")
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark vector vs hybrid RAG retrieval latency.")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=3)
+    parser.add_argument("--topics", type=int, default=40)
+    parser.add_argument("--sections-per-topic", type=int, default=3)
+    parser.add_argument("--latency-ms", type=float, default=80.0, help="Mean simulated request latency")
+    parser.add_argument("--latency-dist", default="lognormal")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write JSON results to this file instead of stdout")
+    args = parser.parse_args()
+
+    # Measure retrieval itself, not the client-side request spacing
+    os.environ.setdefault("RATE_LIMIT_SECONDS", "0")
+
+    report = asyncio.run(run(args))
+    payload = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(payload)
+    else:
+        print(payload)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,293 @@
+#!/usr/bin/env python
+"""
+Benchmarks for taskman overhead.
+
+Measures the per-call cost of @flow and @task (sync and async) against plain
+functions, cache hit/miss latency, the cost of taskman logging, semaphore-heavy
+fan-outs and memory growth over long runs. Results are printed (or written) as
+JSON so runs on different commits can be diffed.
+
+Usage:
+    python benchmarks.py [--output results.json] [--quick]
+"""
+import argparse
+import asyncio
+import gc
+import json
+import logging
+import platform
+import statistics
+import subprocess
+import tempfile
+import time
+import tracemalloc
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Dict, List
+
+from taskman import config, context
+from taskman import configure_cache_path, configure_log_path, flow, task
+
+
+def summarize(samples_ns: List[int]) -> Dict[str, float]:
+    """Per-call statistics in microseconds."""
+    samples = sorted(samples_ns)
+    return {
+        "calls": len(samples),
+        "mean_us": statistics.fmean(samples) / 1000,
+        "median_us": samples[len(samples) // 2] / 1000,
+        "p95_us": samples[min(len(samples) - 1, int(len(samples) * 0.95))] / 1000,
+    }
+
+
+def time_sync(fn: Callable[[], Any], calls: int) -> Dict[str, float]:
+    samples = []
+    for _ in range(calls):
+        started = time.perf_counter_ns()
+        fn()
+        samples.append(time.perf_counter_ns() - started)
+    return summarize(samples)
+
+
+async def time_async(fn: Callable[[], Any], calls: int) -> Dict[str, float]:
+    samples = []
+    for _ in range(calls):
+        started = time.perf_counter_ns()
+        await fn()
+        samples.append(time.perf_counter_ns() - started)
+    return summarize(samples)
+
+
+@contextmanager
+def taskman_paths(cache_dir: Path = None, log_dir: Path = None):
+    """Temporarily configures (or disables) taskman cache and log paths."""
+    prev_cache, prev_log = config.CACHE_BASE_PATH, config.LOG_BASE_PATH
+    config.CACHE_BASE_PATH = None
+    config.LOG_BASE_PATH = None
+    if cache_dir is not None:
+        configure_cache_path(cache_dir)
+    if log_dir is not None:
+        configure_log_path(log_dir)
+    try:
+        yield
+    finally:
+        config.CACHE_BASE_PATH, config.LOG_BASE_PATH = prev_cache, prev_log
+
+
+@contextmanager
+def python_logging(enabled: bool, log_file: Path):
+    """Routes taskman's INFO logging to a file, or silences it."""
+    root = logging.getLogger()
+    prev_level, prev_handlers = root.level, root.handlers[:]
+    for handler in prev_handlers:
+        root.removeHandler(handler)
+    handler = logging.FileHandler(log_file) if enabled else logging.NullHandler()
+    root.addHandler(handler)
+    root.setLevel(logging.INFO if enabled else logging.WARNING)
+    try:
+        yield
+    finally:
+        root.removeHandler(handler)
+        handler.close()
+        for prev in prev_handlers:
+            root.addHandler(prev)
+        root.setLevel(prev_level)
+
+
+# --- Benchmarked functions ---
+
+def plain_sync(x: int) -> int:
+    return x + 1
+
+
+async def plain_async(x: int) -> int:
+    return x + 1
+
+
+def make_decorated():
+    """Builds fresh decorated functions so earlier runs don't share state."""
+    @flow
+    def flow_sync(x: int) -> int:
+        return x + 1
+
+    @flow
+    async def flow_async(x: int) -> int:
+        return x + 1
+
+    @task
+    def task_sync(x: int) -> int:
+        return x + 1
+
+    @task
+    async def task_async(x: int) -> int:
+        return x + 1
+
+    @task(cache_on=("x",))
+    def cached_sync(x: int) -> int:
+        return x + 1
+
+    @task(cache_on=("x",))
+    async def cached_async(x: int) -> int:
+        return x + 1
+
+    @task
+    async def logging_task(x: int) -> int:
+        # append_log is injected by taskman; it is only awaitable when task logs are enabled
+        pending = append_log(f"value {x}")  # noqa: F821
+        if pending is not None:
+            await pending
+        return x + 1
+
+    return dict(
+        flow_sync=flow_sync, flow_async=flow_async,
+        task_sync=task_sync, task_async=task_async,
+        cached_sync=cached_sync, cached_async=cached_async,
+        logging_task=logging_task,
+    )
+
+
+# --- Benchmarks ---
+
+async def bench_call_overhead(calls: int, workdir: Path) -> Dict[str, Any]:
+    fns = make_decorated()
+    results: Dict[str, Any] = {}
+    with taskman_paths(), python_logging(False, workdir / "python.log"):
+        results["plain_sync"] = time_sync(lambda: plain_sync(1), calls)
+        results["plain_async"] = await time_async(lambda: plain_async(1), calls)
+        for name in ("flow_sync", "task_sync"):
+            results[name] = time_sync(lambda fn=fns[name]: fn(1), calls)
+        for name in ("flow_async", "task_async"):
+            results[name] = await time_async(lambda fn=fns[name]: fn(1), calls)
+    for name in ("flow_sync", "task_sync"):
+        results[name]["overhead_us"] = results[name]["mean_us"] - results["plain_sync"]["mean_us"]
+    for name in ("flow_async", "task_async"):
+        results[name]["overhead_us"] = results[name]["mean_us"] - results["plain_async"]["mean_us"]
+    return results
+
+
+async def bench_cache(calls: int, workdir: Path) -> Dict[str, Any]:
+    fns = make_decorated()
+    results: Dict[str, Any] = {}
+    with taskman_paths(cache_dir=workdir / "cache"), python_logging(False, workdir / "python.log"):
+        keys = iter(range(10**9))
+        results["miss_sync"] = time_sync(lambda: fns["cached_sync"](next(keys)), calls)
+        results["miss_async"] = await time_async(lambda: fns["cached_async"](next(keys)), calls)
+        fns["cached_sync"](-1)
+        await fns["cached_async"](-2)
+        results["hit_sync"] = time_sync(lambda: fns["cached_sync"](-1), calls)
+        results["hit_async"] = await time_async(lambda: fns["cached_async"](-2), calls)
+    return results
+
+
+async def bench_logging(calls: int, workdir: Path) -> Dict[str, Any]:
+    fns = make_decorated()
+    results: Dict[str, Any] = {}
+    with taskman_paths(), python_logging(False, workdir / "python.log"):
+        results["off"] = await time_async(lambda: fns["logging_task"](1), calls)
+    with taskman_paths(), python_logging(True, workdir / "python.log"):
+        results["python_logging_only"] = await time_async(lambda: fns["logging_task"](1), calls)
+    with taskman_paths(log_dir=workdir / "logs"), python_logging(True, workdir / "python.log"):
+        results["python_and_task_logs"] = await time_async(lambda: fns["logging_task"](1), calls)
+    return results
+
+
+async def bench_fanout(tasks: int, concurrency: int, workdir: Path) -> Dict[str, Any]:
+    semaphore = asyncio.Semaphore(concurrency)
+
+    @task(semaphore=semaphore)
+    async def limited(x: int) -> int:
+        await asyncio.sleep(0)
+        return x
+
+    @flow
+    async def fanout():
+        return await asyncio.gather(*[limited(i) for i in range(tasks)])
+
+    with taskman_paths(), python_logging(False, workdir / "python.log"):
+        started = time.perf_counter()
+        await fanout()
+        elapsed = time.perf_counter() - started
+    return {
+        "tasks": tasks,
+        "concurrency": concurrency,
+        "wall_s": elapsed,
+        "tasks_per_s": tasks / elapsed,
+    }
+
+
+async def bench_memory(calls: int, workdir: Path) -> Dict[str, Any]:
+    fns = make_decorated()
+
+    @flow
+    async def long_run(n: int):
+        for i in range(n):
+            await fns["task_async"](i)
+            fns["task_sync"](i)
+
+    with taskman_paths(), python_logging(False, workdir / "python.log"):
+        await long_run(100)  # warm up
+        gc.collect()
+        counters_before = len(context.global_counters)
+        tracemalloc.start()
+        before, _ = tracemalloc.get_traced_memory()
+        await long_run(calls)
+        gc.collect()
+        after, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    return {
+        "calls": calls * 2,
+        "retained_bytes": after - before,
+        "retained_bytes_per_call": (after - before) / (calls * 2),
+        "peak_bytes": peak - before,
+        "global_counters_added": len(context.global_counters) - counters_before,
+    }
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=Path(__file__).parent,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+async def run_all(quick: bool) -> Dict[str, Any]:
+    calls = 500 if quick else 5000
+    fanout_tasks = 1000 if quick else 10000
+    with tempfile.TemporaryDirectory() as tmp:
+        workdir = Path(tmp)
+        benchmarks = {
+            "call_overhead": await bench_call_overhead(calls, workdir),
+            "cache": await bench_cache(calls // 5, workdir),
+            "logging": await bench_logging(calls // 5, workdir),
+            "fanout": await bench_fanout(fanout_tasks, 100, workdir),
+            "memory": await bench_memory(calls, workdir),
+        }
+    return {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "quick": quick,
+        "benchmarks": benchmarks,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark taskman overhead.")
+    parser.add_argument("--output", type=Path, help="Write JSON results to this file instead of stdout")
+    parser.add_argument("--quick", action="store_true", help="Fewer iterations, for smoke runs")
+    args = parser.parse_args()
+
+    results = asyncio.run(run_all(args.quick))
+    payload = json.dumps(results, indent=2)
+    if args.output:
+        args.output.write_text(payload)
+    else:
+        print(payload)
+
+
+if __name__ == "__main__":
+    main()
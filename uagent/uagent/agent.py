@@ -1,3 +1,4 @@
+import asyncio
 import os
 import aiohttp
 from datetime import datetime
@@ -15,6 +16,8 @@ from uagents_core.contrib.protocols.chat import (
 SEED_PHRASE = os.getenv("SEED_PHRASE")
 AGENT_SERVER_URL = os.getenv("AGENT_SERVER_URL")
 AGENT_API_SECRET_KEY = os.getenv("AGENT_API_SECRET_KEY")
+# How long to wait for a background /load job before giving up on it
+JOB_TIMEOUT_SECONDS = float(os.getenv("JOB_TIMEOUT_SECONDS", "3600"))
 
 
 # --- Initialize Agent ---
@@ -41,6 +44,9 @@ async def query_science_chat_api(chat_uuid: str, text: str, ctx: Context) -> str
             async with session.post(api_url, headers=headers, json=payload) as response:
                 if response.status == 200:
                     data = await response.json()
+                    # /load runs as a background job; poll it instead of holding the request open
+                    if data.get("type") == "job":
+                        data = await wait_for_job(session, data["job_id"], headers, ctx)
                     # For distillation, provide a summary message
                     if data.get("type") == "distillation":
                         return (f"Paper processed successfully. A distilled version is below.\n\n"
@@ -56,6 +62,29 @@ async def query_science_chat_api(chat_uuid: str, text: str, ctx: Context) -> str
         return "Error: Could not connect to the backend service."
 
 
+async def wait_for_job(session: aiohttp.ClientSession, job_id: str, headers: dict, ctx: Context) -> dict:
+    """Polls a background /load job until it finishes or JOB_TIMEOUT_SECONDS pass, and returns its result event."""
+    job_url = f"{AGENT_SERVER_URL}/v1/jobs/{job_id}"
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + JOB_TIMEOUT_SECONDS
+    while True:
+        async with session.get(job_url, headers=headers) as response:
+            if response.status == 404:
+                ctx.logger.error(f"Job {job_id} no longer exists on the server")
+                return {"type": "error", "content": f"Error: Job {job_id} was not found on the server."}
+            if response.status != 200:
+                ctx.logger.error(f"Job status request failed with status {response.status}: {await response.text()}")
+                return {"type": "error", "content": f"Error: Failed to get the status of job {job_id}."}
+            job = await response.json()
+        if job.get("result") is not None:
+            return job["result"]
+        if loop.time() >= deadline:
+            ctx.logger.error(f"Gave up on job {job_id} after {JOB_TIMEOUT_SECONDS:.0f}s at stage '{job.get('stage')}'")
+            return {"type": "error", "content": f"Error: Loading the paper did not finish in time (job {job_id})."}
+        ctx.logger.info(f"Job {job_id} is at stage '{job.get('stage')}'")
+        await asyncio.sleep(5)
+
+
 # --- Message Handlers ---
 @chat_proto.on_message(ChatMessage)
 async def handle_message(ctx: Context, sender: str, msg: ChatMessage):